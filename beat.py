@@ -0,0 +1,225 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Обнаружение атак (onset) и оценка темпа музыки
+'''
+
+import math
+
+import numpy as np
+
+
+class OnsetDetector:
+    """ Обнаружение атак по спектральному потоку (spectral flux) в группах полос.
+
+    Поток - сумма положительных приращений логарифма уровней полос над максимумом
+    уровня полосы за предыдущие refractory секунд. Длинная басовая нота дает поток
+    только в начале, поэтому срабатывает атака, а не уровень. Сравнение с максимумом,
+    а не с предыдущим кадром, убирает поток от периодических колебаний ровного звука
+    (растекание спектра по блокам) и от шума: они не превышают своих недавних значений.
+    Порог адаптивный: среднее плюс k стандартных отклонений потока группы
+    за последние history секунд. Суммы по истории обновляются на каждом кадре,
+    поэтому обработка кадра занимает O(полос x кадров refractory).
+    """
+    def __init__(self, groups, bins = 60, rate = 50, history = 1.5, refractory = 0.1):
+        """ groups -- границы групп полос [(начало, конец), ...], группы идут подряд
+        bins -- количество полос спектра
+        rate -- частота кадров, Гц
+        history -- длительность истории для адаптивного порога, с
+        refractory -- минимальный интервал между атаками в группе, с
+        """
+        self.groups = len(groups)
+        self.starts = np.array([g[0] for g in groups])
+        self.end = groups[-1][1]
+        self.refractory = refractory
+        # Минимальный поток атаки (в единицах натурального логарифма уровня), чтобы тишина не срабатывала
+        self.minimum = 0.5
+
+        # Логарифмы уровней за предыдущие refractory секунд (кольцо) и их максимум
+        self.recent = np.zeros((max(1, int(round(refractory * rate))), bins))
+        self.recentPos = 0
+        self.reference = np.zeros(bins)
+        self.logSpectrum = np.zeros(bins)
+        self.flux = np.zeros(bins)
+
+        self.size = max(2, int(history * rate))
+        self.history = np.zeros((self.size, self.groups))
+        self.sum = np.zeros(self.groups)
+        self.sumSq = np.zeros(self.groups)
+        self.pos = 0
+        self.count = 0
+
+        self.strength = np.zeros(self.groups)
+        self.mean = np.zeros(self.groups)
+        self.threshold = np.zeros(self.groups)
+        self.onsets = np.zeros(self.groups, dtype=bool)
+        self.lastOnset = np.full(self.groups, -math.inf)
+
+    def process(self, spectrum, now, k):
+        """ Обработка кадра.
+
+        spectrum -- уровни полос
+        now -- время кадра, с
+        k -- множитель стандартного отклонения в пороге (число или массив по группам)
+        Возвращает массив флагов атак по группам (внутренний буфер).
+        """
+        np.log1p(np.maximum(spectrum, 0), out=self.logSpectrum)
+        np.max(self.recent, axis=0, out=self.reference)
+        np.subtract(self.logSpectrum, self.reference, out=self.flux)
+        np.maximum(self.flux, 0, out=self.flux)
+        self.recent[self.recentPos] = self.logSpectrum
+        self.recentPos = (self.recentPos + 1) % len(self.recent)
+        self.strength[:] = np.add.reduceat(self.flux[0:self.end], self.starts)
+
+        # Порог по истории предыдущих кадров
+        n = max(self.count, 1)
+        np.divide(self.sum, n, out=self.mean)
+        std = np.sqrt(np.maximum(self.sumSq / n - self.mean * self.mean, 0))
+        np.add(self.mean, np.multiply(std, k), out=self.threshold)
+        np.maximum(self.threshold, self.minimum, out=self.threshold)
+
+        np.greater(self.strength, self.threshold, out=self.onsets)
+        self.onsets &= (now - self.lastOnset) >= self.refractory
+        self.lastOnset[self.onsets] = now
+
+        self.addHistory(self.strength)
+        return self.onsets
+
+    def addHistory(self, strength):
+        """ Добавление потока кадра в историю с обновлением сумм """
+        old = self.history[self.pos]
+        self.sum += strength - old
+        self.sumSq += strength * strength - old * old
+        old[:] = strength
+        self.pos += 1
+        if self.count < self.size:
+            self.count += 1
+        if self.pos == self.size:
+            self.pos = 0
+            # Раз за проход кольца суммы пересчитываются заново, чтобы не копилась ошибка округления
+            self.sum[:] = self.history.sum(axis=0)
+            self.sumSq[:] = np.square(self.history).sum(axis=0)
+
+
+class TempoEstimator:
+    """ Оценка темпа по автокорреляции силы атак.
+
+    Автокорреляция накапливается с экспоненциальным забыванием (постоянная времени
+    window секунд): каждый кадр добавляет произведение нового значения на
+    предыдущие, что занимает O(количества задержек) без пересчёта всей истории.
+    """
+    def __init__(self, rate = 50, minBpm = 60, maxBpm = 180, window = 4.0):
+        """ rate -- частота кадров, Гц
+        minBpm, maxBpm -- диапазон темпа, удары в минуту
+        window -- постоянная времени забывания, с
+        """
+        self.rate = rate
+        self.minLag = max(1, int(math.floor(rate * 60 / maxBpm)))
+        self.maxLag = int(math.ceil(rate * 60 / minBpm))
+        self.decay = math.exp(-1 / (window * rate))
+
+        # Кольцо хранит каждое значение дважды, последние maxLag + 2 значений всегда лежат подряд
+        self.length = self.maxLag + 2
+        self.ring = np.zeros(2 * self.length)
+        self.pos = 0
+        self.acf = np.zeros(self.length)
+        self.product = np.zeros(self.length)
+        self.smooth = np.zeros(self.maxLag - self.minLag + 1)
+
+    def add(self, value):
+        """ Добавление силы атаки очередного кадра """
+        self.ring[self.pos] = value
+        self.ring[self.pos + self.length] = value
+        self.pos = (self.pos + 1) % self.length
+        # past[-1 - lag] - значение lag кадров назад
+        past = self.ring[self.pos:self.pos + self.length]
+        np.multiply(past[::-1], value, out=self.product)
+        self.acf *= self.decay
+        self.acf += self.product
+
+    def period(self):
+        """ Период удара, кадров, или None, если темп не определён.
+
+        Автокорреляция сглаживается по трем соседним задержкам, так как период
+        обычно не равен целому числу кадров. Из кратных периодов выбирается самый
+        короткий, у которого автокорреляция не меньше 80% максимальной.
+        """
+        if self.acf[0] <= 0:
+            return None
+        np.add(self.acf[self.minLag - 1:self.maxLag], self.acf[self.minLag:self.maxLag + 1], out=self.smooth)
+        self.smooth += self.acf[self.minLag + 1:self.maxLag + 2]
+        peak = self.smooth.max()
+        if peak <= 0:
+            return None
+        i = int(np.argmax(self.smooth >= 0.8 * peak))
+        # Уточнение по центру масс трех соседних задержек
+        w = self.acf[self.minLag + i - 1:self.minLag + i + 2]
+        return self.minLag + i + (w[2] - w[0]) / self.smooth[i]
+
+    def bpm(self):
+        """ Темп, удары в минуту, или 0, если темп не определён """
+        lag = self.period()
+        if lag is None:
+            return 0.0
+        return 60 * self.rate / lag
+
+
+class BeatTracker:
+    """ Атаки по группам полос и удары в темпе музыки.
+
+    Атаки включают лампы RGBY, удары синхронизируют стробоскоп. Момент следующего
+    удара предсказывается по темпу и подстраивается под фактические атаки.
+    """
+    def __init__(self, groups, bins = 60, rate = 50, minBpm = 60, maxBpm = 180):
+        """ groups -- границы групп полос [(начало, конец), ...]
+        bins -- количество полос спектра
+        rate -- частота кадров, Гц
+        minBpm, maxBpm -- диапазон темпа, удары в минуту
+        """
+        self.onset = OnsetDetector(groups, bins, rate)
+        self.tempo = TempoEstimator(rate, minBpm, maxBpm)
+        self.rate = rate
+        # Атаки по всему спектру: их сила задает темп, а сами атаки - фазу ударов
+        self.totalOnset = OnsetDetector([(0, bins)], bins, rate)
+        self.nextBeat = None
+        self.lastBeat = -math.inf
+        self.beatsPerMinute = 0.0
+
+    def process(self, spectrum, now, k):
+        """ Обработка кадра.
+
+        spectrum -- уровни полос
+        now -- время кадра, с
+        k -- множитель стандартного отклонения в пороге атак (число или массив по группам)
+        Возвращает (флаги атак по группам, удар в этом кадре).
+        """
+        onsets = self.onset.process(spectrum, now, k)
+        fullOnset = self.totalOnset.process(spectrum, now, 2.0)[0]
+        # Превышение потока над порогом: шум и ровный звук (в том числе его периодические
+        # колебания из-за растекания спектра по блокам) не попадают в автокорреляцию
+        self.tempo.add(max(self.totalOnset.strength[0] - self.totalOnset.threshold[0], 0.0))
+        self.beatsPerMinute = self.tempo.bpm()
+        if self.beatsPerMinute == 0:
+            self.nextBeat = None
+            return onsets, False
+
+        period = 60 / self.beatsPerMinute
+        if fullOnset:
+            if (self.nextBeat is None) or (now >= self.nextBeat - period / 4):
+                # Атака рядом с ожидаемым ударом (или первая) - удар сейчас, от неё отсчитывается фаза
+                self.lastBeat = now
+                self.nextBeat = now + period
+                return onsets, True
+            if now - self.lastBeat < period / 4:
+                # Атака вскоре после предсказанного удара - сдвигаем фазу без повторного удара
+                self.nextBeat = now + period
+                return onsets, False
+
+        if (self.nextBeat is not None) and (now >= self.nextBeat):
+            self.lastBeat = now
+            self.nextBeat += period
+            if self.nextBeat <= now:
+                self.nextBeat = now + period
+            return onsets, True
+        return onsets, False
@@ -0,0 +1,181 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Проверка атак и темпа на WAV файлах с метрономом (задержка, точность, ошибка темпа)
+'''
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import ColormusicEngine
+from filestream import PcmFile
+
+# Окно сопоставления атаки с ударом метронома, с
+MATCH_BEFORE = 0.01
+MATCH_AFTER = 0.1
+
+
+def writeClickTrack(path, bpm, seconds = 20, samplerate = 44100, seed = 0):
+    """ Стерео WAV: удары бочки (80 Гц) в темпе bpm поверх шума и, с 5-й секунды, ровного баса """
+    rng = np.random.RandomState(seed)
+    n = int(seconds * samplerate)
+    t = np.arange(n) / samplerate
+    x = 0.003 * rng.standard_normal(n) + 0.2 * np.sin(2 * np.pi * 60 * t) * (t > 5)
+    length = int(0.05 * samplerate)
+    kick = 0.7 * np.exp(-np.arange(length) / (0.01 * samplerate)) * np.sin(2 * np.pi * 80 * np.arange(length) / samplerate)
+    for click in np.arange(0.5, seconds - 0.1, 60 / bpm):
+        i = int(round(click * samplerate))
+        x[i:i + length] += kick[0:n - i]
+    with wave.open(path, 'wb') as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(samplerate)
+        w.writeframes((np.repeat(np.clip(x, -1, 1)[:, None], 2, axis=1) * 32000).astype('<i2').tobytes())
+
+
+def clickTimes(filename, threshold = 0.5, refractory = 0.1):
+    """ Эталонные моменты ударов метронома: первый сэмпл, превысивший threshold
+    от максимума файла, после паузы не меньше refractory секунд
+    """
+    source = PcmFile(filename)
+    blocks = []
+    while True:
+        block = source.read(65536)
+        if len(block) == 0:
+            break
+        blocks.append(np.abs(block).max(axis=1))
+    source.close()
+    level = np.concatenate(blocks)
+    above = np.flatnonzero(level >= threshold * level.max())
+    times = []
+    last = -np.inf
+    for i in above:
+        if i - last > refractory * source.samplerate:
+            times.append(i / source.samplerate)
+        last = i
+    return np.array(times), source.samplerate
+
+
+def replay(filename, **params):
+    """ Воспроизведение файла с максимальной скоростью (такт на каждый спектр).
+
+    Возвращает время кадров, флаги атак по лампам R, Y, G (массив кадры x 3), время ударов и итоговый темп.
+    """
+    settings = {"udp": [], "hid": [], "mode": 1, "sensitivityRYG": [100, 100, 100]}
+    engine = ColormusicEngine(settings, tickMode = "audio")
+    engine.startCapture(filename = filename, realtime = False, **params)
+    frames = []
+    onsets = []
+    beats = []
+    # Трекер создаётся заново при выборе частоты тактов, поэтому перехватывается после startCapture
+    process = engine.beat.process
+
+    def recordBeat(spectrum, now, k):
+        result = process(spectrum, now, k)
+        frames.append(now)
+        onsets.append(result[0].copy())
+        if result[1]:
+            beats.append(now)
+        return result
+
+    engine.beat.process = recordBeat
+    engine.start()
+    while engine.isCapturing():
+        engine.checkCapture()
+        time.sleep(0.05)
+    time.sleep(0.1)
+    tempo = engine.tempo()
+    engine.stop()
+    return np.array(frames), np.array(onsets), np.array(beats), tempo
+
+
+def matchOnsets(clicks, onsets):
+    """ Сопоставление атак (время, с) с ударами метронома.
+
+    Возвращает (задержки найденных атак, мс; количество лишних атак).
+    """
+    latencies = []
+    matched = np.zeros(len(onsets), dtype=bool)
+    for click in clicks:
+        candidates = np.flatnonzero((onsets >= click - MATCH_BEFORE) & (onsets <= click + MATCH_AFTER) & ~matched)
+        if len(candidates):
+            matched[candidates[0]] = True
+            latencies.append(onsets[candidates[0]] - click)
+    return np.array(latencies) * 1000, int((~matched).sum())
+
+
+def evaluate(clicks, frames, onsets, beats, tempo, warmup = 8.0):
+    """ Сопоставление атак и ударов с эталоном. Возвращает словарь показателей.
+
+    Удары бочки должны зажигать лампу R: по ней считаются полнота и задержка,
+    по лампам Y и G - только лишние атаки.
+    """
+    latencies, falseR = matchOnsets(clicks, frames[onsets[:, 0]])
+    falseY = matchOnsets(clicks, frames[onsets[:, 1]])[1]
+    falseG = matchOnsets(clicks, frames[onsets[:, 2]])[1]
+    trueBpm = 60 / np.median(np.diff(clicks))
+    # Фаза ударов после того, как темп установился
+    late = beats[beats >= warmup]
+    phase = np.array([np.min(np.abs(clicks - b)) for b in late]) * 1000
+    return {
+        "clicks": len(clicks),
+        "recall": len(latencies) / len(clicks) if len(clicks) else 0.0,
+        "false": (falseR, falseY, falseG),
+        "latencyMean": latencies.mean() if len(latencies) else float("nan"),
+        "latencyMax": latencies.max() if len(latencies) else float("nan"),
+        "bpm": trueBpm,
+        "bpmError": tempo - trueBpm,
+        "phaseMedian": np.median(phase) if len(phase) else float("nan")
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Задержка и точность атак, ошибка темпа на WAV файлах с метрономом")
+    parser.add_argument("files", nargs = "*", help = "WAV файлы с метрономом (по умолчанию - сгенерированные)")
+    parser.add_argument("--bpm", type = float, nargs = "+", default = [90, 120, 150],
+                        help = "темп сгенерированных файлов, ударов в минуту")
+    parser.add_argument("--seconds", type = float, default = 20, help = "длительность сгенерированных файлов, с")
+    parser.add_argument("--fft", type = int, default = None, help = "размер БПФ для STFT (по умолчанию - БПФ по одному блоку)")
+    parser.add_argument("--hop", type = float, default = None, help = "шаг STFT, мс")
+    args = parser.parse_args()
+
+    files = args.files
+    generated = []
+    if not files:
+        for bpm in args.bpm:
+            fd, path = tempfile.mkstemp(suffix = "_%gbpm.wav" % bpm)
+            os.close(fd)
+            writeClickTrack(path, bpm, args.seconds)
+            generated.append(path)
+        files = generated
+
+    rows = []
+    try:
+        for filename in files:
+            clicks = clickTimes(filename)[0]
+            frames, onsets, beats, tempo = replay(filename, fftsize = args.fft, hop = args.hop)
+            rows.append((os.path.basename(filename), evaluate(clicks, frames, onsets, beats, tempo)))
+    finally:
+        for path in generated:
+            os.remove(path)
+
+    print()
+    print("%-24s %6s %8s %13s %9s %9s %7s %8s %9s" % ("file", "clicks", "recall R", "false R/Y/G", "lat ms",
+                                                      "max ms", "bpm", "bpm err", "phase ms"))
+    for name, r in rows:
+        print("%-24s %6d %8.2f %13s %9.1f %9.1f %7.1f %8.1f %9.1f"
+              % (name[-24:], r["clicks"], r["recall"], "%d/%d/%d" % r["false"], r["latencyMean"], r["latencyMax"],
+                 r["bpm"], r["bpmError"], r["phaseMedian"]))
+
+
+if __name__ == "__main__":
+    main()
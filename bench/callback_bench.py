@@ -0,0 +1,104 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Сравнение callback-функции захвата звука: старый цикл по полосам и векторный БПФ
+'''
+
+import argparse
+import math
+import os
+import sys
+import time
+
+from threading import Lock
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from soundcapture import spectrumCallback, captureBlockSize
+from spectrumbuffer import SpectrumBuffer
+
+
+def legacyCallback(state, samplerate, low = 40, high = 2000, gain = 7):
+    """ callback-функция в том виде, в котором она была до векторизации:
+    БПФ по каждому каналу отдельно, спектр собирается циклами Python под блокировкой
+    """
+    delta_f = (high - low) / (60 - 1)
+    fftsize = math.ceil(samplerate / delta_f)
+    low_bin = math.floor(low / delta_f)
+    lock = Lock()
+
+    def callback(indata, frames, time, status):
+        # Левый канал
+        magnitude = np.abs(np.fft.rfft(indata[:, 0], n=fftsize))
+        magnitude *= gain / fftsize
+        leftspectrum = []
+        for x in magnitude[low_bin:low_bin + 60]:
+            leftspectrum.append(round(x * 100000))
+        # Правый канал
+        magnitude = np.abs(np.fft.rfft(indata[:, 1], n=fftsize))
+        magnitude *= gain / fftsize
+        rightspectrum = []
+        for x in magnitude[low_bin:low_bin + 60]:
+            rightspectrum.append(round(x * 100000))
+
+        lock.acquire()
+        state["leftLevel"] = max(leftspectrum)
+        state["rightLevel"] = max(rightspectrum)
+        spectrum = []
+        for i in range(0, len(leftspectrum)):
+            spectrum.append(max(leftspectrum[i], rightspectrum[i]))
+        state["spectrum"] = spectrum
+        lock.release()
+
+    return callback
+
+
+def measure(callback, blocks):
+    """ Время вызова callback для каждого блока, мкс """
+    blocksize = blocks.shape[1]
+    for i in range(0, 10):
+        callback(blocks[i], blocksize, None, "")
+    times = np.zeros(len(blocks))
+    for i in range(0, len(blocks)):
+        start = time.perf_counter()
+        callback(blocks[i], blocksize, None, "")
+        times[i] = time.perf_counter() - start
+    return times * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Callback захвата звука: циклы по полосам и векторизованное БПФ")
+    parser.add_argument("--samplerate", type = int, default = 44100, help = "частота дискретизации, Гц")
+    parser.add_argument("--blocks", type = int, default = 2000, help = "количество блоков по 20 мс")
+    args = parser.parse_args()
+
+    blocksize = captureBlockSize(args.samplerate)
+    rng = np.random.RandomState(0)
+    blocks = (0.1 * rng.standard_normal((args.blocks, blocksize, 2))).astype(np.float32)
+
+    state = {}
+    legacy = legacyCallback(state, args.samplerate)
+    buffer = SpectrumBuffer(60, 4)
+    vectorized = spectrumCallback(buffer, args.samplerate)
+
+    # Результаты обеих функций совпадают
+    legacy(blocks[0], blocksize, None, "")
+    vectorized(blocks[0], blocksize, None, "")
+    spectrum, left, right = buffer.readLatest()
+    assert list(spectrum) == state["spectrum"], "spectra differ"
+    assert (left, right) == (state["leftLevel"], state["rightLevel"]), "levels differ"
+
+    before = measure(legacy, blocks)
+    after = measure(vectorized, blocks)
+    print("%-10s %10s %10s %10s" % ("callback", "mean us", "p50 us", "p99 us"))
+    for name, times in (("legacy", before), ("vectorized", after)):
+        print("%-10s %10.1f %10.1f %10.1f" % (name, times.mean(), np.percentile(times, 50), np.percentile(times, 99)))
+    print("Speedup %.2fx, %.2f%% of the %d ms block budget"
+          % (before.mean() / after.mean(), after.mean() / 200, 20))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Выделения памяти при формировании отчётов USB HID (tracemalloc)
+'''
+
+import argparse
+import os
+import sys
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from effects import LED_COUNT
+from output import HidReport, HidOutput, DeltaFilter, HID_ALL_ON
+
+
+class FakeReport:
+    """ Выходной отчёт pywinusb без устройства: запоминает последний кадр.
+
+    Счётчика отправок нет: новые объекты int сами попали бы в замер.
+    """
+    def __init__(self):
+        self.data = None
+
+    def set_raw_data(self, data):
+        self.data = data
+
+    def send(self):
+        pass
+
+
+def legacyWriteHID(report, leds):
+    """ writeHID до перехода на заранее выделенные буферы """
+    buf = [0x00]
+    for item in leds:
+        for k in item:
+            buf.append(k)
+    report.set_raw_data(buf)
+    report.send()
+
+
+def legacyStrob(report):
+    """ strob до перехода на готовый кадр HID_ALL_ON """
+    buf = [0x00]
+    for i in range(0, 30):
+        buf.append(0xFF)
+    report.set_raw_data(buf)
+    report.send()
+
+
+def hidPath():
+    """ Такт и вспышка через HidReport, DeltaFilter и HidOutput (без потока отправки) """
+    output = HidOutput(FakeReport())
+    hidReport = HidReport()
+    delta = DeltaFilter()
+
+    def writeHID(leds):
+        frame = hidReport.fill(leds)
+        if delta.needSend(frame):
+            output.send(frame)
+            delta.markSent(frame)
+
+    def strob():
+        output.send(HID_ALL_ON)
+
+    return writeHID, strob
+
+
+def measure(writeHID, strob, frames):
+    """ Выделения памяти за len(frames) тактов.
+
+    Перед каждым тактом трассы очищаются, поэтому пик - это память, выделенная за такт,
+    а текущий объём после такта - выделенная за такт память, которая ещё жива.
+    Возвращает (максимум памяти за такт, байт; средний живой объём после такта, байт).
+    """
+    # Прогрев: буферы и кэши создаются до начала замера
+    for leds in frames[0:10]:
+        writeHID(leds)
+        strob()
+    tracemalloc.start()
+    transient = 0
+    retained = 0
+    for leds in frames:
+        tracemalloc.clear_traces()
+        writeHID(leds)
+        strob()
+        current, peak = tracemalloc.get_traced_memory()
+        transient = max(transient, peak)
+        retained += current
+    tracemalloc.stop()
+    return transient, retained / len(frames)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Выделение памяти на отчёт USB HID за такт (tracemalloc)")
+    parser.add_argument("--ticks", type = int, default = 1000, help = "количество тактов")
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    frames = [rng.randint(0, 256, (LED_COUNT, 3)).astype(np.int16) for i in range(0, args.ticks)]
+
+    legacyReport = FakeReport()
+    # Пустой такт: собственные выделения цикла замера
+    results = [
+        ("empty", measure(lambda leds: None, lambda: None, frames)),
+        ("legacy", measure(lambda leds: legacyWriteHID(legacyReport, leds), lambda: legacyStrob(legacyReport), frames)),
+        ("buffers", measure(*hidPath(), frames)),
+    ]
+    print("%-8s %18s %20s" % ("path", "peak per tick, B", "alive after tick, B"))
+    for name, (transient, retained) in results:
+        print("%-8s %18d %20.1f" % (name, transient, retained))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Сравнение неравномерности тактов при захвате звука в потоке и в процессе
+'''
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import wave
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import ColormusicEngine
+
+
+def writeWav(path, seconds, samplerate = 44100):
+    """ Стерео WAV с шумом и ударами каждые полсекунды """
+    rng = np.random.RandomState(0)
+    t = np.arange(int(seconds * samplerate)) / samplerate
+    x = 0.05 * rng.standard_normal((len(t), 2)) + 0.5 * (np.mod(t, 0.5) < 0.02)[:, None]
+    with wave.open(path, 'wb') as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(samplerate)
+        w.writeframes((np.clip(x, -1, 1) * 32000).astype('<i2').tobytes())
+
+
+def busyLoop(isStopped):
+    """ Нагрузка на GIL, как от окна программы и MIDI в основном процессе """
+    while not isStopped():
+        sum(i * i for i in range(0, 2000))
+
+
+def measure(filename, use_multiprocessing, load, tickMode):
+    """ Воспроизведение файла в темпе реального времени.
+
+    Возвращает статистику интервалов между тактами и статистику буфера спектров.
+    """
+    settings = {"udp": [], "hid": [], "mode": 1, "sensitivityRYG": [100, 100, 100]}
+    engine = ColormusicEngine(settings, tickMode = tickMode)
+    stopped = []
+    workers = [threading.Thread(target = busyLoop, args = (lambda: len(stopped) > 0,)) for i in range(0, load)]
+    for worker in workers:
+        worker.start()
+    engine.startCapture(use_multiprocessing, filename = filename, realtime = True)
+    engine.start()
+    while engine.isCapturing():
+        engine.checkCapture()
+        time.sleep(0.1)
+    ticks = engine.thread.histogram.stats()
+    spectra = engine.buffer.stats()
+    stopped.append(True)
+    for worker in workers:
+        worker.join()
+    engine.stop()
+    return ticks, spectra
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Разброс интервалов тактов: захват звука в потоке и в отдельном процессе")
+    parser.add_argument("--file", default = None, help = "воспроизводимый WAV файл (по умолчанию - сгенерированный шум)")
+    parser.add_argument("--seconds", type = float, default = 5, help = "длительность сгенерированного файла, с")
+    parser.add_argument("--load", type = int, nargs = "+", default = [0, 2], help = "количество занятых потоков Python")
+    parser.add_argument("--tick", default = "audio", choices = ("timer", "audio"), help = "источник тактов обработки")
+    args = parser.parse_args()
+
+    filename = args.file
+    if filename is None:
+        fd, filename = tempfile.mkstemp(suffix = ".wav")
+        os.close(fd)
+        writeWav(filename, args.seconds)
+
+    results = []
+    try:
+        for load in args.load:
+            for use_multiprocessing in (False, True):
+                ticks, spectra = measure(filename, use_multiprocessing, load, args.tick)
+                results.append(("process" if use_multiprocessing else "thread", load, ticks, spectra))
+    finally:
+        if args.file is None:
+            os.remove(filename)
+
+    print()
+    print("%-8s %4s %8s %8s %8s %8s %8s" % ("capture", "load", "ticks", "p50 ms", "p99 ms", "max ms", "dropped"))
+    for mode, load, ticks, spectra in results:
+        print("%-8s %4d %8d %8.1f %8.1f %8.1f %8d" % (mode, load, ticks["ticks"], ticks["p50"], ticks["p99"],
+                                                       ticks["max"], spectra["dropped"]))
+
+
+if __name__ == "__main__":
+    main()
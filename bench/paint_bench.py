@@ -0,0 +1,157 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Время отрисовки окна программы в QImage без экрана
+'''
+
+import argparse
+import copy
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Без экрана Qt рисует в память
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5 import QtWidgets
+from PyQt5.QtGui import QImage, QPainter, QColor, QFont, QRegion
+from PyQt5.QtCore import Qt, QRect
+
+from main import settings as defaultSettings
+from engine import ColormusicEngine
+from effects import RED, GREEN, BLUE
+from gui import ColormusicApp, buttPress, SPECTRUM_RECT, VU_RECT, LEDS_RECT, LAMPS_RECT, TEXT_RECT
+
+
+def legacyDrawUI(window, qp):
+    """ drawUI до кэширования: всё окно, 600 ячеек спектра и новые QColor/QFont на каждую ячейку """
+    engine = window.engine
+    activeColor = QColor(234, 237, 242)
+    bgColor = QColor(39, 72, 135)
+
+    # Фон
+    qp.setPen(bgColor)
+    qp.setBrush(bgColor)
+    qp.drawRect(0, 0, 700, 500)
+
+    # Рамки
+    qp.setPen(activeColor)
+    window.drawSimpleRect(qp, 48, 60, 652, 164)
+    window.drawSimpleRect(qp, 11, 60, 35, 164)
+
+    # Спектр сигнала
+    qp.setPen(bgColor)
+    maxv = 1000
+    columns = [(50 + 10*x, v) for x, v in enumerate(engine.spectrum)]
+    columns += [(13, engine.leftLevel), (23, engine.rightLevel)]
+    for x, v in columns:
+        for y in range(0, 10):
+            if v >= (maxv/10)*(y+1):
+                if y >= 8:
+                    qp.setBrush(QColor(255, 0, 0))
+                elif y >= 6:
+                    qp.setBrush(QColor(255, 255, 0))
+                else:
+                    qp.setBrush(QColor(0, 255, 0))
+            else:
+                qp.setBrush(bgColor)
+            qp.drawRect(x, 62 + 10*(9 - y), 9, 9)
+
+    # Кнопки
+    for buttons in (window.butt, buttPress):
+        for item in buttons:
+            x, y = buttons[item][0], buttons[item][1]
+            w, h = buttons[item][2], buttons[item][3]
+            if buttons[item][5]:
+                qp.setBrush(activeColor)
+            else:
+                qp.setBrush(bgColor)
+            qp.setPen(activeColor)
+            qp.drawRect(x, y, w, h)
+            if buttons[item][5]:
+                qp.setPen(bgColor)
+            else:
+                qp.setPen(activeColor)
+            qp.setFont(QFont('Arial', 10))
+            qp.drawText(QRect(x, y, w, h), Qt.AlignCenter, buttons[item][4])
+
+    # Светодиоды и лампы
+    qp.setPen(activeColor)
+    for i in range(0, 10):
+        qp.setBrush(QColor(int(engine.leds[i][RED]), int(engine.leds[i][GREEN]), int(engine.leds[i][BLUE])))
+        qp.drawRect(30 + i * 22, 200, 20, 20)
+    for i in range(0, 4):
+        qp.setBrush(QColor(255, 0, 0) if engine.lampBytes[i] else QColor(0, 0, 0))
+        qp.drawRect(280 + i * 22, 200, 20, 20)
+
+    # Надписи
+    qp.setPen(activeColor)
+    qp.setFont(QFont('Arial', 10))
+    qp.drawText(QRect(100, 35, 50, 20), Qt.AlignCenter, str(window.agBurstValue) + "%")
+    for i, slider in enumerate((window.sensR, window.sensY, window.sensG)):
+        qp.drawText(QRect(slider.x(), slider.y() - 10, slider.width(), 10), Qt.AlignCenter,
+                    str(window.settings["sensitivityRYG"][i]))
+
+
+def nextFrame(window, rng):
+    """ Новые показания обработчика и количество ячеек шкал, как в on_paint_timer """
+    engine = window.engine
+    engine.spectrum = rng.randint(0, 1100, 60)
+    engine.leftLevel, engine.rightLevel = rng.randint(0, 1100, 2)
+    engine.leds[:] = rng.randint(0, 256, engine.leds.shape)
+    engine.lampBytes[:] = rng.randint(0, 256, 4)
+    window.spectrumCounts = np.searchsorted(window.levelSteps, engine.spectrum, side='right')
+    window.vuCounts = np.searchsorted(window.levelSteps, (engine.leftLevel, engine.rightLevel), side='right')
+
+
+def measure(window, draw, frames):
+    """ Среднее и 99-й процентиль времени отрисовки кадра, мс """
+    image = QImage(701, 501, QImage.Format_ARGB32_Premultiplied)
+    rng = np.random.RandomState(0)
+    times = np.zeros(frames)
+    for i in range(-10, frames):
+        nextFrame(window, rng)
+        qp = QPainter()
+        start = time.perf_counter()
+        qp.begin(image)
+        draw(qp)
+        qp.end()
+        if i >= 0:
+            times[i] = time.perf_counter() - start
+    return times.mean() * 1000, np.percentile(times, 99) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Время отрисовки кадра окна без экрана")
+    parser.add_argument("--frames", type = int, default = 500, help = "количество кадров")
+    args = parser.parse_args()
+
+    app = QtWidgets.QApplication(sys.argv[:1])
+    settings = copy.deepcopy(defaultSettings)
+    engine = ColormusicEngine(settings)
+    window = ColormusicApp(engine, settings)
+    # Окно рисуется только из замера
+    window.timer.stop()
+    window.paintTimer.stop()
+
+    full = QRegion(0, 0, 701, 501)
+    dynamic = QRegion(SPECTRUM_RECT) + QRegion(VU_RECT) + QRegion(LEDS_RECT) + QRegion(LAMPS_RECT) + QRegion(TEXT_RECT)
+    results = [
+        ("legacy, full window", measure(window, lambda qp: legacyDrawUI(window, qp), args.frames)),
+        ("cached, full window", measure(window, lambda qp: window.drawUI(qp, full), args.frames)),
+        ("cached, dirty regions", measure(window, lambda qp: window.drawUI(qp, dynamic), args.frames)),
+    ]
+    print("%-22s %10s %10s" % ("paint", "mean ms", "p99 ms"))
+    for name, (mean, p99) in results:
+        print("%-22s %10.3f %10.3f" % (name, mean, p99))
+    window.closeRes()
+    engine.closeHID()
+    engine.closeUDP()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Время запуска и пиковая память программы с окном и без окна (--headless)
+'''
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN = os.path.join(ROOT, "main.py")
+
+
+def writeWav(path, seconds, samplerate = 44100):
+    """ Стерео WAV с шумом """
+    rng = np.random.RandomState(0)
+    x = 0.05 * rng.standard_normal((int(seconds * samplerate), 2))
+    with wave.open(path, 'wb') as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(samplerate)
+        w.writeframes((x * 32000).astype('<i2').tobytes())
+
+
+def launch(args, workdir, settle):
+    """ Запуск main.py с ключами args.
+
+    Программа без окна завершается сама в конце файла, программу с окном
+    через settle секунд после запуска останавливает SIGTERM, а если она
+    не завершилась за 2 секунды - SIGKILL (настройки при этом не сохраняются).
+    Возвращает (время от запуска процесса до сообщения "Started in", с;
+    время запуска по сообщению программы, мс; пиковая память процесса, МБ).
+    """
+    env = dict(os.environ)
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, MAIN] + args, cwd = workdir, env = env,
+                            stdout = subprocess.PIPE, stderr = subprocess.STDOUT, universal_newlines = True)
+    started = threading.Event()
+    result = {}
+
+    def readOutput():
+        # Вывод читается постоянно, чтобы процесс не остановился на заполненном канале
+        for line in proc.stdout:
+            if line.startswith("Started in") and not started.is_set():
+                result["ready"] = time.perf_counter() - start
+                result["reported"] = float(line.split()[2])
+                started.set()
+
+    reader = threading.Thread(target = readOutput)
+    reader.start()
+    if started.wait(60) and ("--headless" not in args):
+        time.sleep(settle)
+    if ("--headless" not in args) or not started.is_set():
+        proc.terminate()
+        deadline = time.perf_counter() + 2
+        while os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is None:
+            if time.perf_counter() > deadline:
+                proc.kill()
+                break
+            time.sleep(0.05)
+    # wait4 возвращает статистику именно этого процесса: ru_maxrss в Linux - КБ, в macOS - байты
+    usage = os.wait4(proc.pid, 0)[2]
+    proc.returncode = 0
+    reader.join()
+    scale = 1 if sys.platform == "darwin" else 1024
+    return result.get("ready", float("nan")), result.get("reported", float("nan")), usage.ru_maxrss * scale / 2**20
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Время запуска и пиковая память с окном и без окна")
+    parser.add_argument("--runs", type = int, default = 3, help = "количество запусков каждого режима")
+    parser.add_argument("--seconds", type = float, default = 3, help = "длительность воспроизводимого файла, с")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    filename = os.path.join(workdir, "noise.wav")
+    writeWav(filename, args.seconds)
+    modes = (("headless", ["--headless"]), ("gui", []))
+    results = {}
+    try:
+        for run in range(0, args.runs):
+            for name, flags in modes:
+                results.setdefault(name, []).append(launch(flags + ["--file", filename], workdir, args.seconds))
+    finally:
+        for item in os.listdir(workdir):
+            os.remove(os.path.join(workdir, item))
+        os.rmdir(workdir)
+
+    print("%-9s %14s %15s %13s" % ("mode", "ready, ms", "reported, ms", "peak RSS, MB"))
+    for name, flags in modes:
+        runs = np.array(results[name])
+        print("%-9s %14.0f %15.0f %13.1f" % (name, np.median(runs[:, 0]) * 1000, np.median(runs[:, 1]),
+                                            runs[:, 2].max()))
+
+
+if __name__ == "__main__":
+    main()
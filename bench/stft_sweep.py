@@ -0,0 +1,63 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Замер стоимости STFT для разных размеров БПФ и шагов
+'''
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from soundcapture import spectrumCallback, captureBlockSize
+from spectrumbuffer import SpectrumBuffer
+
+
+def measure(samplerate, fftsize, hop, bands, seconds):
+    """ Время обработки блоков звука длиной в шаг STFT.
+
+    Возвращает (шаг в сэмплах, среднее время блока, мс, 99-й процентиль, мс).
+    """
+    blocksize = captureBlockSize(samplerate, fftsize = fftsize, hop = hop)
+    buffer = SpectrumBuffer(60, 8)
+    callback = spectrumCallback(buffer, samplerate, fftsize = fftsize, hop = hop, bands = bands)
+    rng = np.random.RandomState(0)
+    blocks = max(50, int(seconds * samplerate / blocksize))
+    data = (0.1 * rng.standard_normal((blocks + fftsize // blocksize + 1, blocksize, 2))).astype(np.float32)
+    # Прогрев: кольцо сэмплов заполняется, кэши планов БПФ и весов полос строятся
+    for i in range(0, fftsize // blocksize + 1):
+        callback(data[i], blocksize, None, "")
+    times = np.zeros(blocks)
+    for i in range(0, blocks):
+        start = time.perf_counter()
+        callback(data[i + fftsize // blocksize + 1], blocksize, None, "")
+        times[i] = time.perf_counter() - start
+    return blocksize, times.mean() * 1000, np.percentile(times, 99) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Время STFT по размерам БПФ и шагам")
+    parser.add_argument("--samplerate", type = int, default = 44100, help = "частота дискретизации, Гц")
+    parser.add_argument("--sizes", type = int, nargs = "+", default = [512, 1024, 2048, 4096, 8192],
+                        help = "размеры БПФ")
+    parser.add_argument("--hops", type = float, nargs = "+", default = [2, 5, 10, 20], help = "шаги STFT, мс")
+    parser.add_argument("--bands", choices = ("log", "mel"), help = "полосы BandAnalyzer вместо линейных")
+    parser.add_argument("--seconds", type = float, default = 2.0, help = "длительность звука на точку, с")
+    args = parser.parse_args()
+
+    print("%6s %7s %7s %10s %10s %8s" % ("fft", "hop ms", "hop", "mean ms", "p99 ms", "load %"))
+    for fftsize in args.sizes:
+        for hop in args.hops:
+            hopSize, mean, p99 = measure(args.samplerate, fftsize, hop, args.bands, args.seconds)
+            # Доля реального времени блока, которую занимает обработка
+            load = mean / (hopSize / args.samplerate * 1000) * 100
+            print("%6d %7.1f %7d %10.3f %10.3f %8.1f" % (fftsize, hop, hopSize, mean, p99, load))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Проверка AsyncUdpOutput на 50 приёмниках через loopback
+'''
+
+import argparse
+import os
+import select
+import socket
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from output import AsyncUdpOutput
+from protocol import FrameEncoder, FrameReceiver, decodeFrame
+
+MULTICAST_GROUP = "239.255.0.77"
+
+
+def openReceivers(count, port = 0, group = None):
+    """ count сокетов приёмников. port = 0 - у каждого свой порт (unicast),
+    иначе все слушают общий порт (broadcast или multicast группа group)
+    """
+    socks = []
+    for i in range(0, count):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if hasattr(socket, "SO_REUSEPORT"):
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind(("", port))
+            if group is not None:
+                mreq = struct.pack("4s4s", socket.inet_aton(group), socket.inet_aton("127.0.0.1"))
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        else:
+            sock.bind(("127.0.0.1", 0))
+        sock.setblocking(False)
+        socks.append(sock)
+    return socks
+
+
+def frameValues(i):
+    """ Яркости i-го кадра: по ним приёмник находит момент передачи кадра """
+    return [i & 0xFF, (i >> 8) & 0xFF, 0, 255]
+
+
+def listen(socks, receivers, submitted, latencies, isStopped):
+    """ Приём кадров всеми сокетами, пока isStopped() не вернёт True.
+
+    submitted -- время передачи кадров в AsyncUdpOutput по их яркостям (time.perf_counter)
+    latencies -- список, в который добавляются задержки от передачи до приёма, с
+    """
+    index = {sock: i for i, sock in enumerate(socks)}
+    while not isStopped():
+        ready, _, _ = select.select(socks, [], [], 0.05)
+        for sock in ready:
+            while True:
+                try:
+                    data = sock.recv(1500)
+                except BlockingIOError:
+                    break
+                now = time.perf_counter()
+                receivers[index[sock]].process(data)
+                latencies.append(now - submitted[tuple(decodeFrame(data)[2])])
+
+
+def run(label, targets, socks, frames, rate, maxRate, interface = None):
+    """ Отправка frames кадров с частотой rate и сводка по приёмникам """
+    receivers = [FrameReceiver() for sock in socks]
+    submitted = {}
+    latencies = []
+    stopped = []
+    listener = threading.Thread(target = listen,
+                                args = (socks, receivers, submitted, latencies, lambda: len(stopped) > 0))
+    listener.start()
+
+    dev = AsyncUdpOutput("udp0", "udp", targets, maxRate = maxRate, interface = interface)
+    encoder = FrameEncoder(4)
+    dev.stamp = encoder.stamp
+    dev.start()
+    dev.ready.wait(2.0)
+    for i in range(0, frames):
+        frame = encoder.update(frameValues(i))
+        submitted[tuple(frameValues(i))] = time.perf_counter()
+        dev.submit(frame)
+        time.sleep(1 / rate)
+    time.sleep(0.2)
+    dev.stop()
+    stopped.append(True)
+    listener.join()
+    for sock in socks:
+        sock.close()
+
+    st = dev.stats()
+    received = [r.stats()["received"] for r in receivers]
+    lost = sum(r.stats()["lost"] for r in receivers)
+    # Задержка от передачи кадра в AsyncUdpOutput до приёма, по всем приёмникам
+    if latencies:
+        avg, peak = sum(latencies) / len(latencies) * 1000, max(latencies) * 1000
+    else:
+        avg, peak = float("nan"), float("nan")
+    print("%-10s  receivers %2d  frames %4d  received %4d..%4d  lost %3d  dropped %3d  collapsed %3d  "
+          "paused %d  latency avg %.2f ms  max %.2f ms"
+          % (label, len(socks), dev.frames, min(received), max(received), lost, st["dropped"],
+             st["collapsed"], st["paused"], avg, peak))
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Проверка AsyncUdpOutput на приёмниках через loopback")
+    parser.add_argument("--receivers", type = int, default = 50, help = "количество приёмников (ламп)")
+    parser.add_argument("--frames", type = int, default = 200, help = "количество отправляемых кадров")
+    parser.add_argument("--rate", type = float, default = 100, help = "частота передачи кадров, Гц")
+    parser.add_argument("--maxRate", type = float, default = 30, help = "ограничение частоты отправки в проверке limited, Гц")
+    parser.add_argument("--port", type = int, default = 38888, help = "общий порт для broadcast и multicast")
+    args = parser.parse_args()
+
+    socks = openReceivers(args.receivers)
+    run("unicast", [sock.getsockname() for sock in socks], socks, args.frames, args.rate, None)
+    socks = openReceivers(args.receivers)
+    run("limited", [sock.getsockname() for sock in socks], socks, args.frames, args.rate, args.maxRate)
+    try:
+        socks = openReceivers(args.receivers, args.port)
+        run("broadcast", [("127.255.255.255", args.port)], socks, args.frames, args.rate, None)
+        socks = openReceivers(args.receivers, args.port + 1, MULTICAST_GROUP)
+        run("multicast", [(MULTICAST_GROUP, args.port + 1)], socks, args.frames, args.rate, None, "127.0.0.1")
+    except OSError as e:
+        print("Broadcast/multicast: " + type(e).__name__ + ': ' + str(e))
+
+
+if __name__ == "__main__":
+    main()
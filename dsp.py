@@ -0,0 +1,396 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Обработка спектра сигнала
+'''
+
+import math
+
+import numpy as np
+
+
+class SlidingMax:
+    """ Максимум за последние size значений (монотонная очередь).
+
+    В очереди хранятся только значения, которые ещё могут стать максимумом, по
+    убыванию. Добавление значения - O(1) в среднем. Очередь лежит в заранее
+    выделенных списках фиксированной длины.
+    """
+    def __init__(self, size):
+        """ size -- длина окна, значений """
+        self.size = size
+        self.values = [0.0] * size
+        self.frames = [0] * size
+        self.head = 0
+        self.count = 0
+        self.frame = 0
+
+    def add(self, value):
+        """ Добавление значения. Возвращает максимум окна. """
+        size = self.size
+        # Голова очереди вышла за окно. Проверяется до добавления: при убывающих значениях
+        # очередь заполнена целиком, и новое значение записывается на место головы.
+        if (self.count > 0) and (self.frames[self.head] <= self.frame - size):
+            self.head = (self.head + 1) % size
+            self.count -= 1
+        # Меньшие значения из хвоста очереди уже никогда не станут максимумом
+        while (self.count > 0) and (self.values[(self.head + self.count - 1) % size] <= value):
+            self.count -= 1
+        i = (self.head + self.count) % size
+        self.values[i] = value
+        self.frames[i] = self.frame
+        self.count += 1
+        self.frame += 1
+        return self.values[self.head]
+
+    def reset(self):
+        """ Очистка окна """
+        self.count = 0
+
+
+class PeakHistogram:
+    """ Процентиль значений за последние size значений.
+
+    Значения раскладываются по логарифмическим столбцам (steps на декаду), окно
+    хранит номера столбцов, поэтому добавление - O(1), а процентиль - проход по
+    нескольким десяткам столбцов без выделения памяти.
+    """
+    def __init__(self, size, steps = 24, decades = 6):
+        """ size -- длина окна, значений
+        steps -- столбцов на декаду
+        decades -- количество декад от 1 и выше
+        """
+        self.size = size
+        self.steps = steps
+        self.counts = np.zeros(steps * decades + 1, dtype=np.int64)
+        self.cumulative = np.zeros(len(self.counts), dtype=np.int64)
+        self.window = [-1] * size
+        self.pos = 0
+        self.total = 0
+
+    def add(self, value):
+        """ Добавление значения """
+        if value > 1:
+            index = min(int(math.log10(value) * self.steps), len(self.counts) - 1)
+        else:
+            index = 0
+        old = self.window[self.pos]
+        if old >= 0:
+            self.counts[old] -= 1
+        else:
+            self.total += 1
+        self.counts[index] += 1
+        self.window[self.pos] = index
+        self.pos = (self.pos + 1) % self.size
+
+    def percentile(self, p):
+        """ Значение (верхняя граница столбца), не меньше которого p процентов значений окна """
+        np.cumsum(self.counts, out=self.cumulative)
+        index = int(np.searchsorted(self.cumulative, self.total * p / 100))
+        return 10 ** ((index + 1) / self.steps)
+
+    def reset(self):
+        """ Очистка окна """
+        self.counts.fill(0)
+        self.window[:] = [-1] * self.size
+        self.pos = 0
+        self.total = 0
+
+
+class AutoGainControl:
+    """ Автоматическая регулировка усиления по пиковому уровню за скользящее окно.
+
+    Опорный уровень - максимум (или процентиль) пиков спектра за window секунд.
+    Усиление плавно стремится к target / опорный уровень: уменьшается с постоянной
+    времени attack, увеличивается - с постоянной release. Поэтому после громкого
+    пика усиление восстанавливается постепенно, а не скачком.
+    """
+    def __init__(self, rate = 50, window = 15, attack = 0.05, release = 3.0, percentile = None):
+        """ rate -- частота кадров, Гц
+        window -- длина окна, с
+        attack -- постоянная времени уменьшения усиления, с
+        release -- постоянная времени увеличения усиления, с
+        percentile -- опорный уровень - процентиль пиков (например, 95), None - максимум.
+                      Процентиль не дает одиночному выбросу задать усиление на всё окно.
+        """
+        size = max(1, int(window * rate))
+        self.percentile = percentile
+        if percentile is None:
+            self.tracker = SlidingMax(size)
+        else:
+            self.tracker = PeakHistogram(size)
+        self.attackCoef = math.exp(-1 / (attack * rate))
+        self.releaseCoef = math.exp(-1 / (release * rate))
+        self.target = 1000
+        self.gain = None
+
+    def process(self, peak):
+        """ Добавление пикового уровня кадра. Возвращает усиление для кадра. """
+        if self.percentile is None:
+            reference = self.tracker.add(peak)
+        else:
+            self.tracker.add(peak)
+            reference = self.tracker.percentile(self.percentile)
+        desired = self.target / max(reference, 1)
+
+        if self.gain is None:
+            self.gain = desired
+        elif desired < self.gain:
+            self.gain = desired + self.attackCoef * (self.gain - desired)
+        else:
+            self.gain = desired + self.releaseCoef * (self.gain - desired)
+        return self.gain
+
+    def reset(self):
+        """ Сброс состояния (например, после тишины) """
+        self.tracker.reset()
+        self.gain = None
+
+
+class EnvelopeFollower:
+    """ Огибающие яркости нескольких каналов с раздельными временами нарастания и спада.
+
+    Уровень канала стремится к целевому: растёт с постоянной времени attack,
+    спадает - с постоянной decay. Все каналы обновляются одной векторной
+    операцией над заранее выделенными буферами.
+    """
+    def __init__(self, channels = 4, rate = 50, attack = 0.0, decay = 0.15):
+        """ channels -- количество каналов
+        rate -- частота кадров, Гц
+        attack -- постоянная времени нарастания, с (0 - мгновенно)
+        decay -- постоянная времени спада, с
+        """
+        self.attackCoef = math.exp(-1 / (attack * rate)) if attack > 0 else 0.0
+        self.decayCoef = math.exp(-1 / (decay * rate)) if decay > 0 else 0.0
+        self.levels = np.zeros(channels)
+        self.coef = np.zeros(channels)
+        self.rising = np.zeros(channels, dtype=bool)
+
+    def process(self, target):
+        """ Обновление уровней по целевым target. Возвращает уровни (внутренний буфер). """
+        np.greater(target, self.levels, out=self.rising)
+        self.coef.fill(self.decayCoef)
+        self.coef[self.rising] = self.attackCoef
+        # levels = target + coef * (levels - target)
+        np.subtract(self.levels, target, out=self.levels)
+        self.levels *= self.coef
+        self.levels += target
+        return self.levels
+
+    def reset(self):
+        """ Сброс уровней в ноль """
+        self.levels.fill(0)
+
+
+class GainStage:
+    """ Автоматическая регулировка усиления и логарифмический компрессор спектра.
+
+    Все вычисления выполняются над массивами NumPy в заранее выделенных буферах.
+    Константы пересчитываются только при изменении значения agBurstValue.
+    """
+    def __init__(self, bins = 60, rate = 50, **agc):
+        """ bins -- количество полос спектра
+        rate -- частота обработки, Гц
+        agc -- параметры AutoGainControl (window, attack, release, percentile)
+        """
+        self.bins = bins
+        self.agc = AutoGainControl(rate, **agc)
+
+        self.burstValue = None
+        self.setBurst(0)
+
+        self.gained = np.zeros(bins)
+        self.ratio = np.zeros(bins)
+        self.compressed = np.zeros(bins)
+
+    def setBurst(self, agBurstValue):
+        """ Установка запаса усиления в процентах (0-70) """
+        if agBurstValue == self.burstValue:
+            return
+        self.burstValue = agBurstValue
+        # Целевой уровень спектра
+        self.target = (agBurstValue / 100) * 1000 + 1000
+        self.agc.target = self.target
+        # Коэффициент компрессора: уровень 50 переходит в 0, уровень 1000 - в target
+        self.compFactor = self.target * (1 / math.log10(1000 / 50))
+
+    def autoGain(self, spectrum):
+        """ Автоматическая регулировка усиления.
+
+        Возвращает усиленный спектр (внутренний буфер) или исходный спектр при тишине.
+        """
+        # Если максимальный уровень сигнала не превышает 20, то считаем, что тишина.
+        # Тишина не попадает в окно AGC, поэтому после паузы усиление остаётся прежним.
+        if spectrum[0:30].max() > 20:
+            gainCorrection = self.agc.process(spectrum.max())
+            np.multiply(spectrum, gainCorrection, out=self.gained)
+            return self.gained
+        else:
+            return spectrum
+
+    def compress(self, spectrum):
+        """ Логарифмический компрессор. Возвращает сжатый спектр (внутренний буфер). """
+        np.divide(spectrum, 50, out=self.ratio)
+        # Уровни не выше 50 дают неположительный логарифм и обнуляются
+        self.compressed.fill(0)
+        np.log10(self.ratio, out=self.compressed, where=self.ratio > 1)
+        self.compressed *= self.compFactor
+        return self.compressed
+
+    def process(self, spectrum, autoGain, logComp):
+        """ Обработка спектра включенными ступенями.
+
+        spectrum -- исходный спектр, не изменяется
+        autoGain -- включена автоматическая регулировка усиления
+        logComp -- включен логарифмический компрессор
+        """
+        if autoGain:
+            spectrum = self.autoGain(spectrum)
+        if logComp:
+            spectrum = self.compress(spectrum)
+        return spectrum
+
+
+class StftAnalyzer:
+    """ Кратковременное преобразование Фурье (STFT) с перекрытием окон.
+
+    Сэмплы накапливаются в кольцевом буфере, и через каждые hop сэмплов
+    вычисляется спектр последних fftsize сэмплов, умноженных на окно Ханна.
+    Окно, буферы кадра и индексы полос вычисляются один раз при создании.
+    План БПФ numpy (pocketfft) кэширует сам для каждого размера.
+    """
+    def __init__(self, fftsize = 2048, hop = 512, channels = 2):
+        """ fftsize -- размер БПФ, сэмплов
+        hop -- шаг между соседними кадрами, сэмплов
+        channels -- количество каналов
+        """
+        if (hop <= 0) or (hop > fftsize):
+            raise ValueError("STFT hop must be in range 1..fftsize")
+        self.fftsize = fftsize
+        self.hop = hop
+        self.channels = channels
+        self.window = np.hanning(fftsize)[:, None]
+        # Сумма окна - для нормировки амплитуды
+        self.windowSum = self.window.sum()
+
+        # Кольцо хранит каждый сэмпл дважды (в позициях i и i + fftsize),
+        # поэтому последние fftsize сэмплов всегда лежат в памяти подряд
+        self.ring = np.zeros((2 * fftsize, channels))
+        self.pos = 0
+        self.pending = 0
+        self.frame = np.zeros((fftsize, channels))
+        self.magnitude = np.zeros((fftsize // 2 + 1, channels))
+
+    def push(self, samples, callback):
+        """ Добавление блока сэмплов (кадры, каналы).
+
+        callback(magnitude) вызывается для каждого готового кадра, magnitude - модуль
+        спектра (fftsize // 2 + 1, каналы), нормированный на сумму окна. Массив
+        переиспользуется, копировать его нужно только если он нужен после callback.
+        """
+        n = samples.shape[0]
+        start = 0
+        while start < n:
+            # Сэмплы до следующего кадра или до конца блока
+            count = min(self.hop - self.pending, n - start, self.fftsize - self.pos)
+            chunk = samples[start:start + count, 0:self.channels]
+            self.ring[self.pos:self.pos + count] = chunk
+            self.ring[self.pos + self.fftsize:self.pos + self.fftsize + count] = chunk
+            self.pos = (self.pos + count) % self.fftsize
+            self.pending += count
+            start += count
+
+            if self.pending == self.hop:
+                self.pending = 0
+                np.multiply(self.ring[self.pos:self.pos + self.fftsize], self.window, out=self.frame)
+                np.abs(np.fft.rfft(self.frame, axis=0), out=self.magnitude)
+                self.magnitude /= self.windowSum
+                callback(self.magnitude)
+
+    def binIndex(self, samplerate, frequencies):
+        """ Номера ближайших к frequencies бинов спектра """
+        index = np.rint(np.asarray(frequencies) * self.fftsize / samplerate).astype(np.int64)
+        return np.clip(index, 0, self.fftsize // 2)
+
+
+# Матрицы весов полос, уже вычисленные для (samplerate, fftsize, bands, low, high, scale)
+_bandWeightsCache = {}
+
+
+def hzToMel(f):
+    """ Перевод частоты, Гц, в мел """
+    return 2595 * np.log10(1 + np.asarray(f) / 700)
+
+
+def melToHz(m):
+    """ Перевод мел в частоту, Гц """
+    return 700 * (10 ** (np.asarray(m) / 2595) - 1)
+
+
+def bandWeights(samplerate, fftsize, bands = 60, low = 40, high = 2000, scale = "log"):
+    """ Матрица треугольных фильтров полос (bands, бины БПФ) и номер её первого бина.
+
+    Центры полос расположены равномерно по логарифму частоты (scale="log") или в
+    мел (scale="mel"). Края полос - bands + 2 точки от low до high: полоса i начинается
+    в точке i, имеет центр в точке i + 1 и заканчивается в точке i + 2.
+    Учитываются только бины, попадающие хотя бы в одну полосу.
+    Результат кэшируется, повторный вызов с теми же параметрами не пересчитывает матрицу.
+    """
+    key = (samplerate, fftsize, bands, low, high, scale)
+    cached = _bandWeightsCache.get(key)
+    if cached is not None:
+        return cached
+
+    if scale == "log":
+        edges = np.geomspace(low, high, bands + 2)
+    elif scale == "mel":
+        edges = melToHz(np.linspace(hzToMel(low), hzToMel(high), bands + 2))
+    else:
+        raise ValueError("Unknown band scale: " + str(scale))
+
+    binWidth = samplerate / fftsize
+    freqs = np.arange(fftsize // 2 + 1) * binWidth
+    left = edges[0:bands, None]
+    center = edges[1:bands + 1, None]
+    right = edges[2:bands + 2, None]
+    # Полосы уже бина БПФ расширяются до бина, чтобы в каждую попал хотя бы один бин
+    riseWidth = np.maximum(center - left, binWidth)
+    fallWidth = np.maximum(right - center, binWidth)
+    weights = np.minimum((freqs - (center - riseWidth)) / riseWidth,
+                         ((center + fallWidth) - freqs) / fallWidth)
+    np.maximum(weights, 0, out=weights)
+
+    used = np.nonzero(weights.any(axis=0))[0]
+    first = int(used[0])
+    weights = np.ascontiguousarray(weights[:, first:int(used[-1]) + 1])
+    _bandWeightsCache[key] = (weights, first)
+    return weights, first
+
+
+class BandAnalyzer:
+    """ Перевод спектра БПФ в логарифмические или мел-полосы.
+
+    Уровень полосы - корень из суммы мощностей бинов с весами фильтра, поэтому синус
+    дает в любой полосе свою амплитуду, а шум в широких полосах не завышается линейно.
+    Один кадр - одно умножение матрицы весов на спектр в заранее выделенные буферы.
+    """
+    def __init__(self, samplerate, fftsize, bands = 60, low = 40, high = 2000, scale = "log", channels = 2):
+        """ samplerate -- частота дискретизации
+        fftsize -- размер БПФ (спектр содержит fftsize // 2 + 1 бинов)
+        bands -- количество полос
+        low, high -- нижний край первой полосы и верхний край последней полосы, Гц
+        scale -- расположение полос: "log" или "mel"
+        channels -- количество каналов
+        """
+        self.weights, self.first = bandWeights(samplerate, fftsize, bands, low, high, scale)
+        self.last = self.first + self.weights.shape[1]
+        self.power = np.zeros((self.weights.shape[1], channels))
+        self.levels = np.zeros((bands, channels))
+
+    def process(self, magnitude):
+        """ Уровни полос (полосы, каналы) по модулю спектра (бины, каналы). Возвращает внутренний буфер. """
+        np.square(magnitude[self.first:self.last], out=self.power)
+        np.dot(self.weights, self.power, out=self.levels)
+        np.sqrt(self.levels, out=self.levels)
+        return self.levels
@@ -0,0 +1,212 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Режимы работы 10 канальной RGB цветомузыки
+'''
+
+import numpy as np
+
+# Индексы цветов светодиодов
+RED = 0
+GREEN = 1
+BLUE = 2
+
+LED_COUNT = 10
+
+# Длительность шага сдвига и затухания, с (такт исходной программы)
+STEP_TIME = 0.02
+
+# Описание режимов работы. Каждый режим задаётся данными, а не кодом:
+#   bands -- границы полос спектра, пиковое значение каждой полосы идёт в свой канал
+#   rules -- для каждого канала: список ступеней (порог, цвет), срабатывает первая
+#            ступень, порог которой превышен, и светодиоды leds канала
+#   value -- "flash": включение цвета на 255
+#            "level": яркость round(ch ** power / scale / 3), не больше 255
+#   shift -- сдвиг светодиодов (начало, конец): leds[начало:конец] = leds[начало + 1:конец + 1]
+#   decay -- величина затухания за шаг и номера затухающих светодиодов
+#   clear -- гашение всех светодиодов перед выводом на каждом такте
+#   mirror -- отражение светодиодов 0-4 на 9-5
+# Сдвиг и затухание выполняются шагами по STEP_TIME секунд независимо от частоты тактов.
+ALWAYS = -np.inf
+
+EFFECT_MODES = {
+    1: {
+        "bands": [0, 2, 4, 8, 14, 30],
+        "rules": [([(900, RED), (800, GREEN), (650, BLUE)], [i]) for i in range(0, 5)],
+        "value": "flash",
+        "decay": (50, range(0, 5)),
+        "mirror": True
+    },
+    2: {
+        "bands": [0, 5, 23, 60],
+        "rules": [
+            ([(750, RED)], [0, 1, 2, 3]),
+            ([(750, GREEN)], [3, 4, 5, 6]),
+            ([(750, BLUE)], [6, 7, 8, 9])
+        ],
+        "value": "flash",
+        "decay": (50, range(0, 10))
+    },
+    3: {
+        "bands": [0, 5, 23, 60],
+        "rules": [
+            ([(750, RED)], [0, 3, 6, 9]),
+            ([(750, GREEN)], [1, 4, 5, 8]),
+            ([(750, BLUE)], [2, 4, 5, 7])
+        ],
+        "value": "flash",
+        "decay": (50, range(0, 10))
+    },
+    4: {
+        "bands": [0, 5, 23, 60],
+        "rules": [
+            ([(750, RED)], range(0, 10)),
+            ([(750, GREEN)], range(0, 10)),
+            ([(750, BLUE)], range(0, 10))
+        ],
+        "value": "flash",
+        "decay": (50, range(0, 10))
+    },
+    5: {
+        "bands": [0, 5, 23, 60],
+        "rules": [
+            ([(750, RED)], [4]),
+            ([(750, GREEN)], [4]),
+            ([(750, BLUE)], [4])
+        ],
+        "value": "flash",
+        "shift": (0, 4),
+        "decay": (50, range(4, 6)),
+        "mirror": True
+    },
+    6: {
+        "bands": [0, 3, 6, 9, 12, 15, 18, 21, 24, 27, 30],
+        "rules": [([(800, RED), (600, BLUE), (ALWAYS, GREEN)], [i]) for i in range(0, 10)],
+        "value": "level",
+        "clear": True
+    },
+    7: {
+        "bands": [0, 5, 23, 60],
+        "rules": [
+            ([(ALWAYS, RED)], [0, 1, 2, 3]),
+            ([(ALWAYS, GREEN)], [3, 4, 5, 6]),
+            ([(ALWAYS, BLUE)], [6, 7, 8, 9])
+        ],
+        "value": "level",
+        "power": 4,
+        "scale": 1000000000
+    }
+}
+
+
+class Effect:
+    """ Режим работы, подготовленный из описания в EFFECT_MODES.
+
+    Все маски и таблицы строятся один раз, обработка такта выполняется
+    несколькими векторными операциями над массивом светодиодов.
+    """
+    def __init__(self, spec):
+        bands = spec["bands"]
+        self.starts = np.array(bands[:-1])
+        self.end = bands[-1]
+        rules = spec["rules"]
+        if len(rules) != len(self.starts):
+            raise ValueError("Effect rules do not match bands")
+
+        # Пороги ступеней (каналы x ступени) и маски светодиодов для каждой ступени
+        steps = max(len(ladder) for ladder, leds in rules)
+        self.thresholds = np.full((len(rules), steps), np.inf)
+        self.masks = np.zeros((len(rules), steps, LED_COUNT, 3), dtype=bool)
+        for band, (ladder, leds) in enumerate(rules):
+            for step, (threshold, color) in enumerate(ladder):
+                self.thresholds[band, step] = threshold
+                self.masks[band, step, list(leds), color] = True
+        self.bandIndex = np.arange(len(rules))
+
+        self.level = spec["value"] == "level"
+        self.power = spec.get("power", 1)
+        self.scale = spec.get("scale", 1)
+        self.shift = spec.get("shift")
+        if "decay" in spec:
+            amount, leds = spec["decay"]
+            self.decay = amount
+            self.decayLeds = np.array(leds)
+        else:
+            self.decay = 0
+        self.clear = spec.get("clear", False)
+        self.mirror = spec.get("mirror", False)
+
+    def process(self, spectrum, leds, steps = 1):
+        """ Обработка одного такта.
+
+        spectrum -- спектр сигнала
+        leds -- массив состояний светодиодов (10, 3), изменяется на месте
+        steps -- количество шагов сдвига и затухания за этот такт (0, если шаг ещё не прошёл)
+        """
+        ch = np.maximum.reduceat(spectrum[0:self.end], self.starts)
+
+        if self.clear:
+            leds.fill(0)
+
+        if self.shift:
+            a, b = self.shift
+            for i in range(0, steps):
+                leds[a:b] = leds[a + 1:b + 1]
+
+        # Затухание светодиодов
+        if self.decay and steps:
+            part = leds[self.decayLeds]
+            part -= self.decay * steps
+            np.maximum(part, 0, out=part)
+            leds[self.decayLeds] = part
+
+        # Выбор ступени для каждого канала
+        hits = ch[:, None] > self.thresholds
+        active = hits.any(axis=1)
+        if active.any():
+            selected = self.masks[self.bandIndex, hits.argmax(axis=1)][active]
+
+            if self.level:
+                ch = ch[active].astype(np.float64)
+                values = np.minimum(np.rint(ch ** self.power / self.scale / 3), 255)
+            else:
+                values = np.full(len(selected), 255)
+            # Яркость для каждой ячейки: максимум по каналам, которые её включают
+            cells = (selected * values[:, None, None]).max(axis=0)
+            np.copyto(leds, cells, where=selected.any(axis=0), casting='unsafe')
+
+        # Отражение выполняется и без срабатываний, чтобы затухание дошло до светодиодов 5-9
+        if self.mirror:
+            leds[5:10] = leds[4::-1]
+
+
+class EffectEngine:
+    """ Обработчик режимов работы RGB цветомузыки.
+
+    Сдвиг и затухание идут шагами по STEP_TIME: при частоте тактов 200 Гц шаг
+    выполняется раз в 4 такта, поэтому вспышки гаснут и бегущий огонь движется
+    так же, как при 50 Гц.
+    """
+    def __init__(self, modes = EFFECT_MODES, rate = 50):
+        """ modes -- словарь описаний режимов {номер: описание}
+        rate -- частота тактов, Гц
+        """
+        self.effects = {}
+        for mode in modes:
+            self.effects[mode] = Effect(modes[mode])
+        self.stepsPerTick = 1 / (rate * STEP_TIME)
+        self.phase = 0.0
+        # Состояние светодиодов. 10 штук по три (RGB)
+        self.leds = np.zeros((LED_COUNT, 3), dtype=np.int16)
+
+    def process(self, mode, spectrum):
+        """ Обработка спектра в выбранном режиме. Неизвестный режим оставляет светодиоды без изменений. """
+        # Небольшой допуск, чтобы ошибка округления не теряла шаг при 50 Гц
+        self.phase += self.stepsPerTick + 1e-9
+        steps = int(self.phase)
+        self.phase -= steps
+        effect = self.effects.get(mode)
+        if effect is not None:
+            effect.process(spectrum, self.leds, steps)
+        return self.leds
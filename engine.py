@@ -0,0 +1,475 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Обработка звука и управление устройствами цветомузыки без GUI
+'''
+
+import copy
+import math
+import time
+
+from threading import Thread
+
+import numpy as np
+
+try:
+    from pywinusb import hid
+except ImportError:
+    # pywinusb работает только под Windows, без него USB HID устройство не используется
+    hid = None
+
+from spectrumbuffer import SpectrumBuffer
+from soundcapture import captureSpectrum, captureSamplerate, spectrumRate, SoundProcess
+from dsp import GainStage, EnvelopeFollower
+from effects import EffectEngine
+from beat import BeatTracker
+from protocol import FrameEncoder
+from scheduler import FrameScheduler
+from output import UdpOutput, AsyncUdpOutput, DeviceOutput, OutputRegistry, HidReport, HidOutput, HID_ALL_ON
+
+# Время, в течение которого сработавшая лампа RYG остается включенной, с
+LAMP_HOLD = 0.1
+# Границы полос спектра для ламп R, Y, G
+LAMP_BANDS = (0, 4, 8, 13)
+
+
+class SoundThread(Thread):
+    """ Класс захвата аудиопотока. Выполняется в отдельном потоке.
+    Здесь же происходит быстрое преобразование Фурье.
+    """
+    def __init__(self, buffer, **params):
+        """ buffer -- буфер спектров
+        params -- параметры captureSpectrum
+        """
+        Thread.__init__(self)
+        self.buffer = buffer
+        self.params = params
+        self.stopped = False
+
+    def run(self):
+        print("Start Sound capture thread")
+        try:
+            captureSpectrum(self.buffer, self.isStopped, **self.params)
+            print("Stop Sound capture thread")
+
+        except KeyboardInterrupt:
+            print('Interrupted by user')
+        except Exception as e:
+            print(type(e).__name__ + ': ' + str(e))
+
+    def isStopped(self):
+        """ Проверка флага остановки потока """
+        return self.stopped
+
+    def stop(self):
+        """ Остановка потока с ожиданием его завершения """
+        self.stopped = True
+        self.join()
+
+    def isAlive(self):
+        """ Проверка, работает ли поток """
+        return self.is_alive()
+
+
+class ColormusicEngine:
+    """ Обработка спектра и вывод на устройства цветомузыки.
+
+    Не зависит от Qt: может работать без окна (ключ --headless) или
+    вместе с окном программы, которое только отображает его состояние.
+    """
+    def __init__(self, settings, keepalive = 1.0, rate = 50, tickMode = "timer", agc = None):
+        """ settings -- словарь настроек программы
+        keepalive -- максимальный интервал между отправками одинаковых кадров на устройства, с
+        rate -- частота обработки, Гц (в режиме "audio" заменяется частотой спектров при запуске захвата)
+        tickMode -- "timer": такты с частотой rate, "audio": такт на каждый спектр
+        agc -- параметры автоматической регулировки усиления (см. dsp.AutoGainControl)
+        """
+        self.settings = settings
+        self.rate = rate
+        self.tickMode = tickMode
+        self.buffer = SpectrumBuffer(60)
+        self.sound = None
+        # Частота спектров воспроизводимого файла, Гц (None - захват с аудиоустройства).
+        # При воспроизведении файла время кадра отсчитывается по звуку, а не по часам компьютера.
+        self.fileSpectrumRate = None
+
+        # Частотный спектр сигнала и пиковые уровни каналов
+        self.spectrum = np.zeros(60)
+        self.leftLevel = 0
+        self.rightLevel = 0
+
+        # Автоматическая регулировка усиления и логарифмический компрессор
+        if agc is None:
+            agc = {}
+        self.agcParams = agc
+        self.autoGain = False
+        self.logComp = False
+        self.agBurstValue = 0
+
+        # Данные для 4-х канальной цветомузыки
+        # Red, yellow, green, blue: лампа включена (яркость от 128)
+        self.chanRYGB = [False, False, False, False]
+        self.lampTarget = np.zeros(7)
+        self.lampLevels = np.zeros(4)
+        self.lampBytes = np.zeros(4, dtype=np.uint8)
+
+        # Ступени, постоянные времени которых заданы в тактах
+        self.setRate(rate)
+        # Лампы RGBY включаются по атакам, а не по превышению уровня
+        self.beatRGBY = False
+        # Стробоскоп в такт музыке
+        self.beatStrob = False
+
+        # Устройства вывода, у каждого свой поток отправки, карта каналов и ограничение частоты
+        self.output = OutputRegistry(keepalive)
+        # Буферы отчёта USB HID по устройствам
+        self.hidReports = {}
+        self.hids = self.openHID(vid = 0x1EAF, pid = 0x0028)
+        hidConfig = settings.get("hid", [])
+        for i, hidDevice in enumerate(self.hids):
+            conf = hidConfig[i] if i < len(hidConfig) else {}
+            dev = self.output.addDevice("hid%d" % i, "hid", hidDevice.send,
+                                        conf.get("channels"), conf.get("maxRate"))
+            self.hidReports[dev.name] = HidReport(channels = dev.channels)
+
+        # Сетевые контроллеры: сокеты по устройствам (у AsyncUdpOutput - None) и настройки, по которым они созданы
+        self.udp = []
+        self.udpConfig = []
+        # Кодировщики двоичного протокола по устройствам (для остальных - старый формат из 4 символов)
+        self.udpEncoders = {}
+        for dev in self.openUDP():
+            self.output.add(dev)
+
+        self.thread = None
+
+    def setRate(self, rate):
+        """ Частота тактов rate, Гц, и создание ступеней обработки, которые от неё зависят """
+        self.rate = rate
+        self.gainStage = GainStage(60, rate, **self.agcParams)
+
+        # Режимы работы RGB цветомузыки и состояния светодиодов (массив 10 x 3)
+        self.effects = EffectEngine(rate = rate)
+        self.leds = self.effects.leds
+
+        # Яркость ламп RYGB 0..255. Сработавшая лампа загорается полностью и спадает до
+        # половины яркости за LAMP_HOLD секунд, ниже порога лампа светится пропорционально уровню.
+        # Огибающие: срабатывания R, Y, G, дежурный канал B, подсветка R, Y, G.
+        self.lampEnvelope = EnvelopeFollower(7, rate, 0.0, LAMP_HOLD / math.log(255 / 128))
+
+        # Атаки в полосах ламп R, Y, G и темп музыки. Кадры поступают с частотой тактов.
+        self.beat = BeatTracker(tuple(zip(LAMP_BANDS[:-1], LAMP_BANDS[1:])), 60, rate)
+        self.onsets = self.beat.onset.onsets
+
+    def startCapture(self, use_multiprocessing = False, **params):
+        """ Запуск захвата звука.
+
+        use_multiprocessing -- захват звука и БПФ в отдельном процессе
+        params -- параметры captureSpectrum (device, block_duration, low, high, gain, filename, realtime,
+                  fftsize, hop, bands, pcm_rate, pcm_channels)
+        Файл, воспроизводимый с максимальной скоростью, обрабатывается такт на каждый спектр:
+        захват ждёт, пока такт прочитает предыдущий спектр.
+        """
+        lockstep = (params.get("filename") is not None) and not params.get("realtime", True)
+        if lockstep and self.tickMode != "audio":
+            print("Full speed file replay: tick on every spectrum")
+            self.tickMode = "audio"
+
+        # Кольцо вмещает все спектры, опубликованные за такт, с запасом
+        slots = 4
+        try:
+            samplerate = captureSamplerate(params.get("device"), params.get("filename"),
+                                           params.get("pcm_rate", 44100))
+            frameRate = spectrumRate(samplerate, params.get("block_duration", 20), params.get("fftsize"),
+                                     params.get("hop"))
+        except Exception as e:
+            # Ошибку устройства или файла сообщит захват звука
+            print("Spectrum rate: " + type(e).__name__ + ': ' + str(e))
+            frameRate = None
+        if params.get("filename") is not None:
+            self.fileSpectrumRate = frameRate
+        if frameRate is not None:
+            if self.tickMode == "audio":
+                # Такт на каждый спектр: постоянные времени считаются по частоте спектров
+                if abs(frameRate - self.rate) > 0.01:
+                    print("Audio ticks: rate %.1f Hz" % frameRate)
+                self.setRate(frameRate)
+            slots = max(slots, int(math.ceil(frameRate / self.rate)) + 3)
+
+        if use_multiprocessing:
+            self.sound = SoundProcess(60, slots, lockstep = lockstep, **params)
+            self.buffer = self.sound.buffer
+        else:
+            self.buffer = SpectrumBuffer(60, slots, lockstep = lockstep)
+            self.sound = SoundThread(self.buffer, **params)
+        self.sound.start()
+
+    def isCapturing(self):
+        """ Проверка, идёт ли захват звука (при воспроизведении файла - не закончился ли он) """
+        return (self.sound is not None) and self.sound.isAlive()
+
+    def checkCapture(self):
+        """ Вывод ошибок процесса захвата звука в консоль.
+
+        Вызывается периодически (по таймеру окна или в цикле работы без окна),
+        чтобы ошибка была видна сразу, а не только при остановке. Возвращает список новых ошибок.
+        """
+        if not isinstance(self.sound, SoundProcess):
+            return []
+        errors = self.sound.takeErrors()
+        for e in errors:
+            print("Sound capture process: " + e)
+        return errors
+
+    def start(self):
+        """ Запуск отправки данных и обработки тактов """
+        self.output.start()
+        # Планировщик создаётся после запуска захвата звука, когда буфер спектров уже известен
+        self.thread = FrameScheduler(self.tick, self.rate, self.tickMode, self.buffer)
+        self.thread.start()
+
+    def stop(self):
+        """ Остановка обработки, захвата звука и закрытие устройств """
+        # Захват больше не ждёт тактов, которых уже не будет
+        self.buffer.lockstep = False
+        if self.thread is not None:
+            self.thread.stop()
+        print("Spectrum buffer: " + str(self.buffer.stats()))
+        if self.sound is not None:
+            self.sound.stop()
+        self.output.stop()
+        print("Output: " + str(self.output.stats()))
+        self.closeHID()
+        self.closeUDP()
+
+    def tickSummary(self):
+        """ Краткая статистика интервалов между тактами для отображения """
+        if self.thread is None:
+            return ""
+        return self.thread.summary
+
+    def frameTime(self):
+        """ Время последнего прочитанного спектра, с.
+
+        При воспроизведении файла - время конца блока звука от начала файла (номер спектра,
+        делённый на частоту спектров), так атаки и темп не зависят от скорости воспроизведения.
+        При захвате с аудиоустройства - time.monotonic().
+        """
+        if self.fileSpectrumRate is not None:
+            return self.buffer.lastReadSeq / self.fileSpectrumRate
+        return time.monotonic()
+
+    def tick(self):
+        """ Обработка одного такта: спектр, режимы работы, вывод на устройства """
+        spectrum, self.leftLevel, self.rightLevel = self.buffer.readLatest()
+
+        # Атаки и удары определяются по спектру до регулировки усиления
+        self.onsets, beat = self.beat.process(spectrum, self.frameTime(), self.onsetThreshold())
+
+        # Автоматическая регулировка усиления и логарифмический компрессор
+        self.gainStage.setBurst(self.agBurstValue)
+        self.spectrum = self.gainStage.process(spectrum, self.autoGain, self.logComp)
+
+        # Обработка данных для 10 канальной RGB цветомузыки
+        self.effects.process(self.settings["mode"], self.spectrum)
+
+        # Обработка данных для 4 канальной RGBY цветомузыки
+        self.processRGBY()
+
+        self.writeHID()
+        self.sendUDP()
+        if beat and self.beatStrob:
+            self.strob()
+
+    def onsetThreshold(self):
+        """ Множители порога атак для ламп R, Y, G по их чувствительности (0-127) """
+        return [0.5 + 4 * (128 - sens) / 128 for sens in self.settings["sensitivityRYG"]]
+
+    def tempo(self):
+        """ Темп музыки, удары в минуту (0 - не определён) """
+        return self.beat.beatsPerMinute
+
+    def processRGBY(self):
+        """ Обработка спектра для вывода на цветомузыку.
+
+        Лампа R, Y или G загорается полностью при превышении порога (или в режиме
+        beatRGBY при атаке), ниже порога светится не ярче 127 пропорционально уровню.
+        Огибающие всех ламп обновляются за один шаг. Синяя лампа - дежурная: горит,
+        когда R, Y и G выключены. Все четыре лампы одновременно не включаются
+        (защита от превышения тока).
+        """
+        if len(self.spectrum) == 0:
+            return
+        target = self.lampTarget
+        ch = np.maximum.reduceat(self.spectrum[0:LAMP_BANDS[-1]], LAMP_BANDS[:-1])
+        value = (128 - np.asarray(self.settings["sensitivityRYG"], dtype=float)) * 7.8125
+        if self.beatRGBY:
+            np.multiply(self.onsets, 255, out=target[0:3])
+        else:
+            np.multiply(ch > value, 255, out=target[0:3])
+        # Подсветка - доля порога
+        np.divide(ch, value, out=target[4:7])
+        np.multiply(target[4:7], 127, out=target[4:7])
+        np.minimum(target[4:7], 127, out=target[4:7])
+        # Дежурный канал задаётся после огибающих R, Y и G (см. ниже)
+        target[3] = 0
+
+        envelope = self.lampEnvelope.process(target)
+        levels = self.lampLevels
+        np.maximum(envelope[0:3], envelope[4:7], out=levels[0:3])
+        # Синяя лампа горит, когда R, Y и G выключены в этом же кадре. При включенной R, Y или G
+        # она гаснет полностью, поэтому все четыре лампы не бывают включены одновременно
+        # (защита от превышения тока)
+        if (levels[0:3] >= 127.5).any():
+            envelope[3] = 0
+        else:
+            envelope[3] = 255
+        levels[3] = envelope[3]
+        np.rint(levels, out=levels)
+        np.copyto(self.lampBytes, levels, casting='unsafe')
+        for i in range(0, 4):
+            self.chanRYGB[i] = bool(self.lampBytes[i] >= 128)
+
+    def strob(self):
+        """ Генерация строба на цветомузыке """
+        self.output.submitGroup("hid", HID_ALL_ON)
+
+    def writeHID(self):
+        """ Передача состояния светодиодов в потоки отправки на USB HID устройства """
+        for dev in self.output.group("hid"):
+            dev.submit(self.hidReports[dev.name].fill(self.leds))
+
+    def openHID(self, vid, pid):
+        """ Открытие всех USB HID устройств с заданными VID и PID.
+
+        vid -- Vendor ID
+        pid -- Product ID
+        Возвращает список HidOutput.
+        """
+        result = []
+        if hid is None:
+            return result
+        filter = hid.HidDeviceFilter(vendor_id = vid, product_id = pid)
+        for device in filter.get_devices():
+            try:
+                device.open()
+                result.append(HidOutput(device.find_output_reports()[0], device))
+            except Exception as e:
+                print("USB device: " + type(e).__name__ + ': ' + str(e))
+        print("USB devices founded: %d" % len(result))
+        return result
+
+    def closeHID(self):
+        """ Закрытие USB HID устройств """
+        for hidDevice in self.hids:
+            hidDevice.close()
+
+    def udpEndpoints(self):
+        """ Список сетевых контроллеров из настроек.
+
+        settings["udp"] - словарь {"ip", "port"} одного контроллера или список таких
+        словарей. Необязательные ключи: "channels" - номера каналов RYGB для каналов
+        контроллера по порядку, "maxRate" - максимальная частота кадров, Гц.
+        Вместо "ip" и "port" может быть "targets": [{"ip", "port"}, ...] - один кадр
+        отправляется на все адреса (в том числе широковещательный или multicast,
+        "interface" - IP адрес интерфейса для multicast).
+        "protocol": "binary" - кадры двоичного протокола (protocol.py) с яркостью ламп 0..255
+        вместо 4 символов.
+        """
+        udp = self.settings["udp"]
+        if isinstance(udp, dict):
+            return [udp]
+        return udp
+
+    def openUDP(self):
+        """ Создание сетевых устройств по settings["udp"].
+
+        Возвращает список устройств вывода (ещё не зарегистрированных и не запущенных).
+        """
+        udpList = []
+        encoders = {}
+        devices = []
+        endpoints = self.udpEndpoints()
+        for i, conf in enumerate(endpoints):
+            if "targets" in conf:
+                # Один кадр на несколько адресов (список, broadcast или multicast) через asyncio
+                targets = [(t["ip"], t["port"]) for t in conf["targets"]]
+                dev = AsyncUdpOutput("udp%d" % i, "udp", targets, self.output.keepalive, conf.get("maxRate"),
+                                     conf.get("channels"), interface = conf.get("interface"))
+                udpList.append(None)
+            else:
+                udp = UdpOutput(conf["ip"], conf["port"])
+                udpList.append(udp)
+                dev = DeviceOutput("udp%d" % i, "udp", udp.send, self.output.keepalive, conf.get("maxRate"),
+                                   conf.get("channels"))
+            if conf.get("protocol") == "binary":
+                channels = len(dev.channels) if dev.channels is not None else 4
+                encoders[dev.name] = FrameEncoder(channels, self.output.keepalive)
+                # Номер кадра назначается в потоке отправки, отброшенные отправителем кадры его не получают
+                dev.stamp = encoders[dev.name].stamp
+            devices.append(dev)
+        self.udp = udpList
+        self.udpEncoders = encoders
+        self.udpConfig = copy.deepcopy(endpoints)
+        return devices
+
+    def updateUDP(self):
+        """ Применение изменившихся settings["udp"].
+
+        Вызывается периодически (по таймеру окна или в цикле работы без окна). Если у
+        контроллеров изменились только адреса, сокеты пересоздаются (UdpOutput.configure),
+        иначе сетевые устройства создаются заново. Возвращает True, если настройки изменились.
+        """
+        endpoints = self.udpEndpoints()
+        if endpoints == self.udpConfig:
+            return False
+        if self.onlyAddressChanged(endpoints):
+            for udp, conf in zip(self.udp, endpoints):
+                udp.configure(conf["ip"], conf["port"])
+            self.udpConfig = copy.deepcopy(endpoints)
+            print("UDP: addresses changed")
+            return True
+        oldUdp = self.udp
+        self.output.replaceGroup("udp", self.openUDP())
+        for udp in oldUdp:
+            if udp is not None:
+                udp.close()
+        print("UDP: devices rebuilt (%d)" % len(self.udp))
+        return True
+
+    def onlyAddressChanged(self, endpoints):
+        """ Проверка, что у контроллеров endpoints по сравнению с текущими изменились только ip и port """
+        if len(endpoints) != len(self.udpConfig):
+            return False
+        rest = lambda conf: {k: v for k, v in conf.items() if k not in ("ip", "port")}
+        for old, new in zip(self.udpConfig, endpoints):
+            if ("targets" in old) or ("targets" in new) or (rest(old) != rest(new)):
+                return False
+        return True
+
+    def sendUDP(self):
+        """ Отправка данных на сетевые устройства """
+        c = []
+        for item in self.chanRYGB:
+            if item == True:
+                c.append('1')
+            else:
+                c.append('0')
+
+        for dev in self.output.group("udp"):
+            channels = dev.channels if dev.channels is not None else range(0, 4)
+            encoder = self.udpEncoders.get(dev.name)
+            if encoder is None:
+                dev.submit(bytes("".join(c[i] for i in channels), "utf-8"))
+            else:
+                frame = encoder.update([int(self.lampBytes[i]) for i in channels])
+                if frame is not None:
+                    dev.submit(frame)
+
+    def closeUDP(self):
+        """ Закрытие UDP соединений с сетевыми устройствами """
+        for udp in self.udp:
+            if udp is None:
+                continue
+            print("UDP %s:%s: %s" % (udp.ip, udp.port, str(udp.stats())))
+            udp.close()
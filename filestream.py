@@ -0,0 +1,177 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Воспроизведение звука из файла вместо захвата с аудиоустройства
+'''
+
+import time
+import wave
+
+from threading import Thread
+
+import numpy as np
+
+
+class PcmFile:
+    """ Чтение звука из WAV файла или файла raw PCM блоками.
+
+    Сэмплы возвращаются в формате float32 в диапазоне -1..1, как у sounddevice.
+    """
+    def __init__(self, filename, samplerate = 44100, channels = 2, dtype = 'int16'):
+        """ filename -- путь к файлу. Файлы *.wav читаются с заголовком,
+                       остальные считаются raw PCM с параметрами ниже.
+        samplerate -- частота дискретизации raw файла
+        channels -- количество каналов raw файла
+        dtype -- формат сэмпла raw файла ('int16', 'int32', 'float32')
+        """
+        self.filename = filename
+        if filename.lower().endswith(".wav"):
+            self.wav = wave.open(filename, 'rb')
+            self.samplerate = self.wav.getframerate()
+            self.channels = self.wav.getnchannels()
+            self.sampwidth = self.wav.getsampwidth()
+            self.file = None
+        else:
+            self.wav = None
+            self.samplerate = samplerate
+            self.channels = channels
+            self.dtype = np.dtype(dtype)
+            self.sampwidth = self.dtype.itemsize
+            self.file = open(filename, 'rb')
+
+    def read(self, frames):
+        """ Чтение не более frames кадров.
+
+        Возвращает массив (кадры, каналы) float32, пустой в конце файла.
+        """
+        if self.wav is not None:
+            data = self.wav.readframes(frames)
+            samples = self.decodeWav(data)
+        else:
+            data = self.file.read(frames * self.channels * self.sampwidth)
+            count = len(data) // (self.channels * self.sampwidth)
+            samples = np.frombuffer(data, dtype=self.dtype, count=count * self.channels)
+            if self.dtype.kind == 'i':
+                samples = samples / float(2 ** (8 * self.sampwidth - 1))
+        return samples.astype(np.float32).reshape(-1, self.channels)
+
+    def decodeWav(self, data):
+        """ Преобразование кадров WAV файла в массив сэмплов """
+        if self.sampwidth == 1:
+            # 8 бит - беззнаковые сэмплы
+            return (np.frombuffer(data, dtype=np.uint8) - 128.0) / 128.0
+        if self.sampwidth == 3:
+            # 24 бита - расширяем до 32 бит
+            raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+            wide = np.zeros((raw.shape[0], 4), dtype=np.uint8)
+            wide[:, 1:] = raw
+            return wide.view('<i4').ravel() / float(2 ** 31)
+        dtype = {2: '<i2', 4: '<i4'}[self.sampwidth]
+        return np.frombuffer(data, dtype=dtype) / float(2 ** (8 * self.sampwidth - 1))
+
+    def close(self):
+        """ Закрытие файла """
+        if self.wav is not None:
+            self.wav.close()
+        if self.file is not None:
+            self.file.close()
+
+
+class FileInputStream:
+    """ Поток звука из файла с интерфейсом sounddevice.InputStream.
+
+    Файл подаётся в callback блоками по blocksize кадров в отдельном потоке.
+    В режиме realtime блоки выдаются с темпом реального времени, иначе - с
+    максимальной скоростью, что позволяет измерить пропускную способность обработки.
+    """
+    def __init__(self, source, callback, blocksize, channels = 2, realtime = True):
+        """ source -- источник звука (PcmFile)
+        callback(indata, frames, time, status) -- функция обработки блока
+        blocksize -- размер блока в кадрах
+        channels -- количество каналов, передаваемых в callback
+        realtime -- выдавать блоки в темпе реального времени
+        """
+        self.source = source
+        self.callback = callback
+        self.blocksize = blocksize
+        self.channels = channels
+        self.realtime = realtime
+        self.samplerate = source.samplerate
+        self.active = False
+        self.stopped = False
+        self.thread = None
+
+        # Статистика
+        self.blocks = 0
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+        self.close()
+
+    def start(self):
+        """ Запуск воспроизведения в отдельном потоке """
+        self.active = True
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """ Остановка воспроизведения """
+        self.stopped = True
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def close(self):
+        """ Закрытие источника звука """
+        self.source.close()
+
+    def run(self):
+        """ Подача файла в callback. Можно вызывать напрямую без запуска потока. """
+        self.active = True
+        period = self.blocksize / self.samplerate
+        indata = np.zeros((self.blocksize, self.channels), dtype=np.float32)
+        start = time.perf_counter()
+        # Ошибка чтения файла или обработки блока тоже завершает поток: active сбрасывается всегда
+        try:
+            while not self.stopped:
+                block = self.source.read(self.blocksize)
+                frames = block.shape[0]
+                if frames == 0:
+                    break
+                # Моно файл дублируется во все каналы, неполный последний блок дополняется тишиной
+                indata.fill(0)
+                if block.shape[1] >= self.channels:
+                    indata[0:frames] = block[:, 0:self.channels]
+                else:
+                    indata[0:frames] = block[:, 0:1]
+                self.callback(indata, self.blocksize, None, "")
+                self.blocks += 1
+
+                if self.realtime:
+                    delay = start + self.blocks * period - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+        finally:
+            self.elapsed = time.perf_counter() - start
+            self.active = False
+            print("File input: " + str(self.stats()))
+
+    def stats(self):
+        """ Статистика воспроизведения в виде словаря """
+        if self.elapsed > 0:
+            rate = self.blocks / self.elapsed
+        else:
+            rate = 0.0
+        return {
+            "blocks": self.blocks,
+            "seconds": self.elapsed,
+            "blocksPerSecond": rate,
+            "audioSeconds": self.blocks * self.blocksize / self.samplerate
+        }
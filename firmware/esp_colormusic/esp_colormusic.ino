@@ -33,6 +33,16 @@ IPAddress subnet(255, 255, 255, 0);
 //Время последнего приёма пакета данных
 unsigned long lastRX = 0;
 
+//Двоичный протокол (protocol.py): 'C' 'M', версия, количество каналов N,
+//номер кадра (uint16 LE), время отправки (uint32 LE, мс), N байт яркости каналов
+const byte FRAME_VERSION = 1;
+const int FRAME_HEADER_SIZE = 10;
+//После паузы в приёме кадр принимается с любым номером, мс
+const unsigned long RESYNC_TIME = 1000;
+//Номер последнего принятого кадра
+uint16_t lastSeq = 0;
+bool seqValid = false;
+
 void setup()
 {
   for (int i = 0; i < 4; i++)
@@ -113,6 +123,25 @@ void loop()
         }
       }
     }
+    else if ((n >= FRAME_HEADER_SIZE) && (packetBuffer[0] == 'C') && (packetBuffer[1] == 'M') &&
+             (packetBuffer[2] == FRAME_VERSION))
+    {
+      byte count = packetBuffer[3];
+      uint16_t seq = (byte)packetBuffer[4] | ((uint16_t)(byte)packetBuffer[5] << 8);
+      //Кадр, пришедший позже более нового, отбрасываем
+      bool stale = seqValid && (millis() - lastRX < RESYNC_TIME) && ((int16_t)(seq - lastSeq) <= 0);
+      if (!stale && (n >= FRAME_HEADER_SIZE + count))
+      {
+        lastSeq = seq;
+        seqValid = true;
+        lastRX = millis();
+        //Лампы включаются реле, поэтому яркость от 128 и выше - включено
+        for (int i = 0; i < 4; i++)
+        {
+          state[i] = (i < count) && ((byte)packetBuffer[FRAME_HEADER_SIZE + i] >= 128);
+        }
+      }
+    }
   }
 
   //Гасим лампы, если больше 5 секунд нет пакетов
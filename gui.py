@@ -0,0 +1,537 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Главное окно программы
+'''
+
+import time
+
+from collections import deque
+
+import numpy as np
+
+# Qt
+from PyQt5 import QtWidgets, QtCore, QtGui
+from PyQt5.QtWidgets import QTableWidgetItem, QLabel, QInputDialog, QComboBox, QSystemTrayIcon
+from PyQt5.QtWidgets import QMessageBox, QWidget, QMenu
+from PyQt5.QtGui import QPixmap, QPainter, QColor, QFont
+from PyQt5.QtCore import Qt, QRect
+# design
+import mainform
+
+from effects import RED, GREEN, BLUE
+from midi import MidiDevice, LPC_OFF, LPC_RED, LPC_GREEN, LPC_ORANGE, LPC_YELLOW, MIDI_CC, MIDI_KNOB
+
+# Области окна, которые перерисовываются при изменении показаний
+SPECTRUM_RECT = QRect(50, 62, 600, 100)
+VU_RECT = QRect(13, 62, 20, 100)
+LEDS_RECT = QRect(30, 200, 219, 21)
+LAMPS_RECT = QRect(280, 200, 87, 21)
+TEXT_RECT = QRect(396, 200, 298, 40)
+
+# Интервал проверки ошибок процесса захвата звука и изменения настроек UDP, с
+CAPTURE_CHECK_INTERVAL = 0.5
+
+# Кнопки без фиксации
+buttPress = {
+    "agbvPlus": [150, 35, 20, 20, "+", False, None],
+    "agbvMinus": [80, 35, 20, 20, "-", False, None]
+}
+
+
+class SystemTrayIcon(QSystemTrayIcon):
+    """ Класс значка в системном трее """
+    def __init__(self, icon, parent=None):
+        QSystemTrayIcon.__init__(self, icon, parent)
+        menu = QMenu(parent)
+        exitAction = menu.addAction("Exit")
+        self.setContextMenu(menu)
+
+
+class ColormusicApp(QtWidgets.QMainWindow, mainform.Ui_MainWindow):
+    """ Класс главного окна приложения """
+    def __init__(self, engine, settings, fps = 30):
+        """ engine -- обработчик цветомузыки (ColormusicEngine)
+        settings -- словарь настроек программы
+        fps -- максимальная частота перерисовки окна, кадров/с
+        """
+        super().__init__()
+        self.setupUi(self)  # Это нужно для инициализации нашего дизайна
+        self.engine = engine
+        self.settings = settings
+
+        # Кнопки с фиксацией
+        #   X, Y, W, H, текст кнопки, состояние, callback
+        self.butt = {
+            "OnOff": [10, 10, 50, 20, "ON", False, None],
+            "AutoGain": [80, 10, 90, 20, "Auto gain", False, None],
+            "LogComp": [180, 10, 90, 20, "Comp", False, None],
+            "Strob1": [280, 10, 45, 45, "Strob", False, self.eventStrobButton],
+            "Strob2": [330, 10, 45, 45, "Strob", False, self.eventStrobButton],
+            "Strob3": [380, 10, 45, 45, "Strob", False, self.eventStrobButton],
+            "Strob4": [430, 10, 45, 45, "Strob", False, self.eventStrobButton],
+            "Strob5": [480, 10, 45, 45, "Strob", False, self.eventStrobButton],
+            "StrobBeat": [530, 10, 45, 45, "Beat", False, self.eventStrobButton],
+            "Onset": [585, 10, 65, 20, "Onset", False, None]
+        }
+        self.butt["Onset"][5] = self.engine.beatRGBY
+
+        # Установка значений элементам управления из текущих настроек
+        self.sensR.setValue(self.settings["sensitivityRYG"][0])
+        self.sensY.setValue(self.settings["sensitivityRYG"][1])
+        self.sensG.setValue(self.settings["sensitivityRYG"][2])
+
+        # Номер активной страницы ланчпада
+        self.LaunchPadPage = 1
+
+        # Активность стробоскопов
+        self.StroboActive = False
+        self.StroboTimer = QtCore.QTimer()
+        self.StroboTimer.timeout.connect(self.engine.strob)
+
+        # Запас усиления для автоматического уровня сигнала
+        self.agBurstValue = 0
+
+        self.sensR.valueChanged.connect(lambda: self.sensitivityChange(0))
+        self.sensY.valueChanged.connect(lambda: self.sensitivityChange(1))
+        self.sensG.valueChanged.connect(lambda: self.sensitivityChange(2))
+
+        # Главный таймер
+        self.timer = QtCore.QTimer()
+        self.timer.timeout.connect(self.on_timer)
+        self.timer.start(20)
+
+        # Таймер перерисовки окна, не зависит от частоты обработки
+        self.paintTimer = QtCore.QTimer()
+        self.paintTimer.timeout.connect(self.on_paint_timer)
+        self.paintTimer.start(max(1, round(1000 / fps)))
+        # Последние отображённые показания по областям окна
+        self.paintState = {}
+
+        # Сообщения MIDI приходят из потока ввода и разбираются в потоке GUI по таймеру.
+        # deque.append и deque.popleft потокобезопасны, блокировки не нужны.
+        self.midiQueue = deque()
+        # Вывод сообщений MIDI в консоль не чаще раза в секунду
+        self.midiLogTime = 0.0
+        self.midiLogSkipped = 0
+        # Статистика задержки от приёма сообщения до его обработки
+        self.midiHandled = 0
+        self.midiLatencySum = 0.0
+        self.midiLatencyMax = 0.0
+        # Ошибки процесса захвата звука и настройки UDP проверяются раз в CAPTURE_CHECK_INTERVAL секунд
+        self.captureCheckTime = 0.0
+
+        self.midi = MidiDevice()
+        midi_id = self.midi.findDevice(self.settings["midi"]["dev_name"])
+        self.midi.startInput(device_id = midi_id[0], callback = self.midiCallback)
+        self.midi.startOutput(midi_id[1])
+
+        self.setMidiState()
+
+        self.initPaintCache()
+
+        #self.midi.resetLaunchpad()
+        #self.midi.demo()
+        #self.midi.setLed(8, 0, LPC_YELLOW)
+        #self.midi.setLed(8, 1, LPC_RED[1])
+        #self.midi.setLed(8, 2, LPC_RED[1])
+
+
+    def sensitivityChange(self, id):
+        """ Event на изменение положения ручек регулировки чувствительности """
+        if id == 0:
+            value = self.sensR.value()
+        elif id == 1:
+            value = self.sensY.value()
+        else:
+            value = self.sensG.value()
+        # value = (100 - value) * 10
+        self.settings["sensitivityRYG"][id] = value
+
+
+    def closeRes(self):
+        """ Закрытие всех ресурсов, которые были выделены во время работы.
+
+        Эту функцию надо вызывать в конце работы приложения, перед уничтожением формы.
+        """
+        self.midi.resetLaunchpad()
+        del self.midi
+        print("MIDI dispatch: " + str(self.midiStats()))
+
+
+    def setMidiState(self):
+        """ Функция для установки начального состояния MIDI устройства """
+        if self.settings["midi"]["dev_name"] == "X-TOUCH MINI":
+            # Вид индикации энкодеров
+            self.midi.send(MIDI_CC, 1, 2)
+            self.midi.send(MIDI_CC, 2, 2)
+            self.midi.send(MIDI_CC, 3, 2)
+            # Текущие положения энкодеров
+            self.midi.send(186, 1, self.settings["sensitivityRYG"][0])
+            self.midi.send(186, 2, self.settings["sensitivityRYG"][1])
+            self.midi.send(186, 3, self.settings["sensitivityRYG"][2])
+
+
+    def midiCallback(self, message):
+        """ callback функция, которая вызывается при получении сообщения от MIDI устройства.
+        Выполняется в потоке MIDI, поэтому только ставит сообщение в очередь.
+
+        message -- MIDI сообщение. """
+        self.midiQueue.append((time.perf_counter(), message))
+
+
+    def processMidi(self):
+        """ Разбор сообщений MIDI, накопившихся с прошлого такта таймера (в потоке GUI).
+
+        Из нескольких сообщений CC для одного контроллера обрабатывается только последнее.
+        """
+        messages = []
+        # Позиция сообщения CC в messages по (статус, номер контроллера)
+        controls = {}
+        now = time.perf_counter()
+        while self.midiQueue:
+            received, message = self.midiQueue.popleft()
+            latency = now - received
+            self.midiHandled += 1
+            self.midiLatencySum += latency
+            self.midiLatencyMax = max(self.midiLatencyMax, latency)
+
+            if (message[0] & 0xF0) == 0xB0:
+                key = (message[0], message[1])
+                i = controls.get(key)
+                if i is not None:
+                    messages[i] = message
+                    continue
+                controls[key] = len(messages)
+            messages.append(message)
+
+        for message in messages:
+            self.logMidi(message, now)
+            self.handleMidi(message)
+
+
+    def logMidi(self, message, now):
+        """ Вывод сообщения MIDI в консоль не чаще раза в секунду """
+        if now - self.midiLogTime < 1:
+            self.midiLogSkipped += 1
+            return
+        if self.midiLogSkipped:
+            print("MIDI: ", message, "(+%d)" % self.midiLogSkipped)
+        else:
+            print("MIDI: ", message)
+        self.midiLogTime = now
+        self.midiLogSkipped = 0
+
+
+    def handleMidi(self, message):
+        """ Обработка сообщения MIDI в потоке GUI """
+        msg = message[0]
+        key = message[1]
+        velocity = message[2]
+        
+        if self.settings["midi"]["dev_name"] == "X-TOUCH MINI":
+            if msg == MIDI_KNOB: # Информация о вращении ручек энкодеров
+                if key == 1:
+                    self.sensR.setValue(velocity)
+                if key == 2:
+                    self.sensY.setValue(velocity)
+                if key == 3:
+                    self.sensG.setValue(velocity)
+
+        #self.midi.send(186, message[1], 50) состояние ручек
+        #self.midi.send(176, 2, 2) вид светодиодов
+
+
+    def midiStats(self):
+        """ Статистика разбора сообщений MIDI в виде словаря, задержка в мс """
+        if self.midiHandled:
+            avg = self.midiLatencySum / self.midiHandled * 1000
+        else:
+            avg = 0.0
+        return {
+            "handled": self.midiHandled,
+            "avgLatency": avg,
+            "maxLatency": self.midiLatencyMax * 1000
+        }
+
+
+    def eventStrobButton(self, name, state):
+        """ Событие нажатия на кнопку стробоскопа """
+        for s in ("Strob1", "Strob2", "Strob3", "Strob4", "Strob5", "StrobBeat"):
+            self.butt[s][5] = False
+        if state:
+            self.butt[name][5] = True
+
+        # Стробоскоп в такт музыке включает обработчик цветомузыки
+        self.engine.beatStrob = state and (name == "StrobBeat")
+        if self.engine.beatStrob:
+            self.StroboTimer.stop()
+        elif state:
+            if name == "Strob1":
+                bpm = 60
+            elif name == "Strob2":
+                bpm = 120
+            elif name == "Strob3":
+                bpm = 300
+            elif name == "Strob4":
+                bpm = 600
+            elif name == "Strob5":
+                bpm = 1200
+
+            period = round(60000 / bpm)
+            self.StroboActive = True
+            self.StroboTimer.start(period)
+        else:
+            self.StroboTimer.stop()
+
+
+    def mousePressEvent(self, QMouseEvent):
+        """ Событие нажатия кнопки мыши """
+        xx = QMouseEvent.x()
+        yy = QMouseEvent.y()
+        for item in self.butt:
+            x, y = self.butt[item][0], self.butt[item][1]
+            w, h = self.butt[item][2], self.butt[item][3]
+            if (xx >= x) and (xx < x + w) and (yy >= y) and (yy < y + h):
+                self.butt[item][5] = not self.butt[item][5]
+                proc = self.butt[item][6]
+                if proc:
+                    proc(item, self.butt[item][5])
+
+        for item in buttPress:
+            x, y = buttPress[item][0], buttPress[item][1]
+            w, h = buttPress[item][2], buttPress[item][3]
+            if (xx >= x) and (xx < x + w) and (yy >= y) and (yy < y + h):
+                buttPress[item][5] = True
+                if item == "agbvPlus":
+                    self.agBurstValue += 5
+                    if self.agBurstValue > 70:
+                        self.agBurstValue = 70
+                elif item == "agbvMinus":
+                    self.agBurstValue -= 5
+                    if self.agBurstValue < 0:
+                        self.agBurstValue = 0
+
+    
+    def mouseReleaseEvent(self, QMouseEvent):
+        """ Событие отпускания кнопки мыши """
+        xx = QMouseEvent.x()
+        yy = QMouseEvent.y()
+        for item in buttPress:
+            if buttPress[item][5]:
+                buttPress[item][5] = False
+
+
+    def on_timer(self):
+        """ Обработчик события главного таймера.
+        Таймер вызывается каждые 20 мс. Здесь разбираются сообщения MIDI и состояние кнопок
+        передаётся обработчику цветомузыки. Сама обработка выполняется в потоке
+        обработчика, окно перерисовывается по своему таймеру (on_paint_timer).
+        """
+        self.processMidi()
+        self.engine.autoGain = self.butt["AutoGain"][5]
+        self.engine.logComp = self.butt["LogComp"][5]
+        self.engine.beatRGBY = self.butt["Onset"][5]
+        self.engine.agBurstValue = self.agBurstValue
+
+        now = time.monotonic()
+        if now >= self.captureCheckTime:
+            self.captureCheckTime = now + CAPTURE_CHECK_INTERVAL
+            self.engine.updateUDP()
+            errors = self.engine.checkCapture()
+            if errors:
+                QMessageBox.warning(self, "Sound capture", "\n".join(errors))
+
+
+    def on_paint_timer(self):
+        """ Обработчик события таймера перерисовки.
+        Перерисовываются только области, показания которых изменились. Свёрнутое
+        (или спрятанное в трей) окно не перерисовывается.
+        """
+        if self.isMinimized() or not self.isVisible():
+            return
+        engine = self.engine
+
+        self.spectrumCounts = np.searchsorted(self.levelSteps, engine.spectrum, side='right')
+        self.vuCounts = np.searchsorted(self.levelSteps, (engine.leftLevel, engine.rightLevel), side='right')
+        self.markDirty("spectrum", self.spectrumCounts.tobytes(), SPECTRUM_RECT)
+        self.markDirty("vu", self.vuCounts.tobytes(), VU_RECT)
+        self.markDirty("leds", engine.leds.tobytes(), LEDS_RECT)
+        self.markDirty("lamps", engine.lampBytes.tobytes(), LAMPS_RECT)
+        self.markDirty("text", (engine.tickSummary(), round(engine.tempo())), TEXT_RECT)
+
+        # Кнопки и надписи
+        for buttons in (self.butt, buttPress):
+            for item in buttons:
+                x, y, w, h = buttons[item][0:4]
+                self.markDirty(item, buttons[item][5], QRect(x, y, w + 1, h + 1))
+        self.markDirty("labels", (self.agBurstValue, tuple(self.settings["sensitivityRYG"])), self.labelsRect())
+
+
+    def markDirty(self, name, key, rect):
+        """ Перерисовка области rect, если показание key области name изменилось """
+        if self.paintState.get(name) != key:
+            self.paintState[name] = key
+            self.update(rect)
+
+
+    def labelsRect(self):
+        """ Область надписей с запасом усиления и чувствительностью каналов """
+        rect = QRect(100, 35, 50, 20)
+        for sens in (self.sensR, self.sensY, self.sensG):
+            rect = rect.united(QRect(sens.x(), sens.y() - 10, sens.width(), 10))
+        return rect
+
+
+    def paintEvent(self, e):
+        """ Обработчик перерисовки формы """
+        qp = QPainter()
+        qp.begin(self)
+        self.drawUI(qp, e.region())
+        qp.end()
+
+
+    def drawSimpleRect(self, qp, x1, y1, x2, y2):
+        """ Рисует пустой прямоугольник """
+        qp.drawLine(x1, y1, x2, y1)
+        qp.drawLine(x2, y1, x2, y2)
+        qp.drawLine(x2, y2, x1, y2)
+        qp.drawLine(x1, y2, x1, y1)
+
+
+    def initPaintCache(self):
+        """ Подготовка кистей, шрифтов и изображений для отрисовки GUI """
+        self.activeColor = QColor(234, 237, 242)
+        self.bgColor = QColor(39, 72, 135)
+        self.font = QFont('Arial', 10)
+        # Цвета шкалы спектра: зелёный (уровни 0-5), жёлтый (6-7), красный (8-9)
+        self.levelColors = ((0, 6, QColor(0, 255, 0)), (6, 8, QColor(255, 255, 0)), (8, 10, QColor(255, 0, 0)))
+        # Цвета ламп RYGB при полной яркости
+        self.lampColors = ((255, 0, 0), (255, 255, 0), (0, 255, 0), (0, 0, 255))
+        # Пороги уровней шкалы спектра
+        self.levelSteps = np.arange(1, 11) * 100
+        # Количество включенных ячеек шкал спектра и уровней каналов
+        self.spectrumCounts = np.zeros(60, dtype=np.int64)
+        self.vuCounts = np.zeros(2, dtype=np.int64)
+
+        # Сетка ячеек шкал: рисуется поверх столбцов и разделяет их на ячейки
+        self.gridPixmap = QPixmap(700, 500)
+        self.gridPixmap.fill(Qt.transparent)
+        qp = QPainter()
+        qp.begin(self.gridPixmap)
+        qp.setPen(self.bgColor)
+        qp.setBrush(Qt.NoBrush)
+        for y in range(0, 10):
+            for x in range(0, 60):
+                qp.drawRect(50 + 10*x, 62 + 10*(9 - y), 9, 9)
+            qp.drawRect(13, 62 + 10*(9 - y), 9, 9)
+            qp.drawRect(23, 62 + 10*(9 - y), 9, 9)
+        qp.end()
+
+        # Статичная часть GUI (фон, рамки, кнопки, надписи). Перерисовывается при изменении состояния.
+        self.staticPixmap = QPixmap(701, 501)
+        self.staticKey = None
+
+
+    def drawStatic(self, qp):
+        """ Рисуем статичную часть GUI """
+        activeColor = self.activeColor
+        bgColor = self.bgColor
+
+        # Фон
+        qp.setPen(bgColor)
+        qp.setBrush(bgColor)
+        qp.drawRect(0, 0, 700, 500)
+
+        # Рамки
+        qp.setPen(activeColor)
+        self.drawSimpleRect(qp, 48, 60, 652, 164)
+        self.drawSimpleRect(qp, 11, 60, 35, 164)
+
+        # Рисуем кнопки
+        qp.setFont(self.font)
+        for buttons in (self.butt, buttPress):
+            for item in buttons:
+                x, y = buttons[item][0], buttons[item][1]
+                w, h = buttons[item][2], buttons[item][3]
+                if buttons[item][5]:
+                    qp.setBrush(activeColor)
+                else:
+                    qp.setBrush(bgColor)
+                qp.setPen(activeColor)
+                qp.drawRect(x, y, w, h)
+
+                if buttons[item][5]:
+                    qp.setPen(bgColor)
+                else:
+                    qp.setPen(activeColor)
+                qp.drawText(QRect(x, y, w, h), Qt.AlignCenter, buttons[item][4])
+
+        # Надписи
+        qp.setPen(activeColor)
+        qp.drawText(QRect(100, 35, 50, 20), Qt.AlignCenter, str(self.agBurstValue) + "%")
+        qp.drawText(QRect(self.sensR.x(), self.sensR.y() - 10, self.sensR.width(), 10), Qt.AlignCenter, str(self.settings["sensitivityRYG"][0]))
+        qp.drawText(QRect(self.sensY.x(), self.sensY.y() - 10, self.sensY.width(), 10), Qt.AlignCenter, str(self.settings["sensitivityRYG"][1]))
+        qp.drawText(QRect(self.sensG.x(), self.sensG.y() - 10, self.sensG.width(), 10), Qt.AlignCenter, str(self.settings["sensitivityRYG"][2]))
+
+
+    def drawLevelBar(self, qp, x, count):
+        """ Рисует столбец шкалы с count включенными ячейками.
+        Вместо отдельных ячеек рисуется по одному прямоугольнику на каждый цвет.
+        """
+        for start, stop, color in self.levelColors:
+            if count <= start:
+                break
+            top = min(count, stop)
+            qp.fillRect(x, 62 + 10*(10 - top), 10, 10*(top - start), color)
+
+
+    def drawUI(self, qp, region):
+        """ Рисуем GUI. region -- перерисовываемая область окна """
+        # Статичная часть перерисовывается только при изменении состояния кнопок и надписей
+        key = (tuple(self.butt[item][5] for item in self.butt),
+               tuple(buttPress[item][5] for item in buttPress),
+               self.agBurstValue, tuple(self.settings["sensitivityRYG"]),
+               self.sensR.geometry(), self.sensY.geometry(), self.sensG.geometry())
+        if key != self.staticKey:
+            self.staticKey = key
+            sp = QPainter()
+            sp.begin(self.staticPixmap)
+            self.drawStatic(sp)
+            sp.end()
+        bounds = region.boundingRect()
+        qp.drawPixmap(bounds, self.staticPixmap, bounds)
+
+        engine = self.engine
+
+        # Спектр сигнала и уровни каналов (по показаниям, которые были при проверке изменений)
+        if region.intersects(SPECTRUM_RECT):
+            counts = self.spectrumCounts
+            for x in np.flatnonzero(counts).tolist():
+                self.drawLevelBar(qp, 50 + 10*x, int(counts[x]))
+        if region.intersects(VU_RECT):
+            self.drawLevelBar(qp, 13, int(self.vuCounts[0]))
+            self.drawLevelBar(qp, 23, int(self.vuCounts[1]))
+        qp.drawPixmap(bounds, self.gridPixmap, bounds)
+
+        # Текущее состояние светодиодов
+        qp.setPen(self.activeColor)
+        if region.intersects(LEDS_RECT):
+            for i in range(0, 10):
+                qp.setBrush(QColor(int(engine.leds[i, RED]), int(engine.leds[i, GREEN]), int(engine.leds[i, BLUE])))
+                qp.drawRect(30 + i * 22, 200, 20, 20)
+
+        # Текущая яркость ламп RGBY
+        if region.intersects(LAMPS_RECT):
+            for i in range(0, 4):
+                level = int(engine.lampBytes[i])
+                r, g, b = self.lampColors[i]
+                qp.setBrush(QColor(r * level // 255, g * level // 255, b * level // 255))
+                qp.drawRect(280 + i * 22, 200, 20, 20)
+
+        # Статистика интервалов между тактами обработки
+        if region.intersects(TEXT_RECT):
+            qp.setFont(self.font)
+            qp.drawText(QRect(400, 200, 290, 20), Qt.AlignLeft | Qt.AlignVCenter, engine.tickSummary())
+            qp.drawText(QRect(400, 220, 290, 20), Qt.AlignLeft | Qt.AlignVCenter, "Tempo %.0f BPM" % engine.tempo())
@@ -0,0 +1,421 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Работа с MIDI устройствами (Launchpad, X-TOUCH MINI)
+'''
+
+import time
+
+from threading import Thread
+
+from os import environ
+environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+
+import numpy as np
+
+import pygame
+import pygame.midi
+from pygame.locals import *
+
+# Цвета для вывода на Launchpad. Для мигающего необходимо прибавить LPC_FLASH к основному значению.
+LPC_OFF = 12
+LPC_RED = (0, 0x0D, 0x0E, 0x0F)
+LPC_GREEN = (0, 0x1C, 0x2C, 0x3C)
+LPC_ORANGE = (0, 0x1D, 0x2E, 0x3F)
+LPC_YELLOW = 0x3E
+LPC_FLASH = -4
+
+MIDI_CC = 176
+MIDI_PROGRAM = 192
+MIDI_LED_BUTTON = 154
+MIDI_KNOB = 186
+
+# Биты цвета Launchpad: яркость красного (0-1) и зелёного (4-5). Биты Copy и Clear (2-3)
+# управляют записью во второй буфер и в кадровом буфере не используются.
+LPC_COLOR_MASK = 0x33
+
+
+class MidiDevice:
+    """ Класс для работы с MIDI устройствами """
+    def __init__(self):
+        pygame.init()
+        pygame.fastevent.init()
+        pygame.midi.init()
+        self.DoubleBufferActivePage = 0
+        self.__print_device_info()
+
+    def __del__(self):
+        """ Деструктор класса MidiDevice.
+
+        Закрываем ресурсы и ждём завершения дочерних потоков.
+        """
+        try:
+            self.devOut.close()
+        except AttributeError:
+            pass
+        self.midi_thread.stopped = True
+        self.midi_thread.join()
+        pygame.midi.quit()
+    
+    def startInput(self, device_id = None, callback = None):
+        """ Включение MIDI-устройства ввода
+
+        device_id -- ID MIDI-устройства
+        callback(msg) -- callback функция, вызываемая при получении данных от устройства """
+        self.midi_thread = self.MidiInputThread(device_id, callback)
+        self.midi_thread.start()
+
+
+    def startOutput(self, device_id = None):
+        """ Включение MIDI-устройства вывода
+
+        device_id -- ID MIDI-устройства
+        """
+        if device_id is None:
+            port = pygame.midi.get_default_output_id()
+        else:
+            port = device_id
+
+        if port != -1:
+            print("\nusing output_id :%s:" % port)
+            try:
+                self.devOut = pygame.midi.Output(port, 0)
+            except:
+                self.devOut = None
+
+    def send(self, msg, key, velocity):
+        """ Отправка данных на устройство """
+        try:
+            self.devOut.write_short(msg, key, velocity)
+        except AttributeError:
+            pass
+
+    def sendBatch(self, messages):
+        """ Отправка списка сообщений [(msg, key, velocity), ...] одним вызовом PortMidi """
+        events = [[m, 0] for m in messages]
+        try:
+            # PortMidi принимает не более 1024 событий за вызов
+            for i in range(0, len(events), 1024):
+                self.devOut.write(events[i:i + 1024])
+        except AttributeError:
+            pass
+
+    def resetLaunchpad(self):
+        """ Launchpad: Сброс ланчпада """
+        self.send(0xB0, 0, 0)
+    
+    def setLed(self, x, y, c = None):
+        """ Launchpad: Включает выбранный светодиод.
+        Варианты вызова:
+        setLed(x, y, color), где x,y - координаты кнопки по сетке
+        setLed(n, color), где n - номер кнопки по-порядку
+        """
+        if c == None:
+            n = x
+            color = y
+        else:
+            n = 16 * y + x
+            color = c
+        self.send(0x90, n, color)
+
+    def setTopLed(self, n, color):
+        """ Launchpad: Включение светодиода на ланчпаде в верхем ряду кнопок
+
+        :param n: номер кнопки
+        :param color: цвет
+        """
+        self.send(0xB0, 0x68 + n, color)
+
+
+    def doubleBufferEnable(self):
+        """ Launchpad: Включение двойной буферизации """
+        self.send(0xB0, 0x00, 0x31)
+        self.DoubleBufferActivePage = 0
+
+
+    def doubleBufferDisable(self):
+        """ Launchpad: Выключение двойной буферизации """
+        self.send(0xB0, 0x00, 0x30)
+
+    def swapBuffer(self):
+        """ Launchpad: Обмен страниц буфера.
+
+        Страница, в которую шла запись, становится видимой, а её содержимое
+        копируется в новую страницу для записи.
+        """
+        if self.DoubleBufferActivePage == 0:
+            self.send(0xB0, 0x00, 0x34)
+            self.DoubleBufferActivePage = 1
+        else:
+            self.send(0xB0, 0x00, 0x31)
+            self.DoubleBufferActivePage = 0
+
+    def flashEnable(self):
+        """ Launchpad: Включение режима мигания """
+        self.send(0xB0, 0x00, 0x28)
+
+    def flashActive(self, enable):
+        """ Launchpad: активация мигания """
+        if enable:
+            self.send(0xB0, 0x00, 0x20)
+        else:
+            self.send(0xB0, 0x00, 0x21)
+
+    def rapidLedUpdate(self, velocity1, velocity2):
+        """ Launchpad: Быстрое обновление данных. В качестве параметров передаются сразу два цвета для двух кнопок"""
+        self.send(0x92, velocity1, velocity2)
+
+    def allLedsOn(self, brightness):
+        """ Launchpad: Включение всех светодиодов.
+
+        :param brightness: яркость (1-3)
+        """
+        if (brightness >= 1) and (brightness <= 3):
+            self.send(0xB0, 0x00, 0x7C + brightness)
+
+    def demo(self):
+        """ Launchpad: демка """
+        frame = LaunchpadFrameBuffer(self)
+        for x1, y1, x2, y2, color in ((0, 0, 4, 4, LPC_GREEN[3]), (4, 4, 8, 8, LPC_GREEN[3]),
+                                      (0, 4, 4, 8, LPC_RED[3]), (4, 0, 8, 4, LPC_RED[3]),
+                                      (2, 2, 6, 6, LPC_ORANGE[3])):
+            frame.grid[y1:y2, x1:x2] = color
+            frame.show()
+            time.sleep(0.1)
+            frame.clear()
+            frame.show()
+        frame.close()
+
+    def __print_device_info(self):
+        """ Вывод информации о подключенных MIDI устройствах """
+        for i in range( pygame.midi.get_count() ):
+            r = pygame.midi.get_device_info(i)
+            (interf, name, input, output, opened) = r
+
+            in_out = ""
+            if input:
+                in_out = "(input)"
+            if output:
+                in_out = "(output)"
+
+            print ("%2i: interface: %s, name: %s, opened: %s  %s" %
+                   (i, interf.decode('utf-8'), name.decode('utf-8'), opened, in_out))
+
+    def findDevice(self, devname):
+        """ Ищет MIDI устройство по его имени.
+
+        Возвращает кортеж из ID устройства ввода и ID устройства вывода.
+        None вместо значения, если устройство с требуемым именем не найдено.
+        """
+        id_in = None
+        id_out = None
+
+        for i in range( pygame.midi.get_count() ):
+            r = pygame.midi.get_device_info(i)
+            (interf, name, input, output, opened) = r
+
+            if name.decode('utf-8') == devname:
+                if input:
+                    id_in = i
+                if output:
+                    id_out = i
+
+        return (id_in, id_out)
+
+
+    class MidiInputThread(Thread):
+        """ Поток работы с MIDI устройством.
+
+        Опрос устройства адаптивный: пока приходят сообщения, поток спит pollMin,
+        а в тишине интервал удваивается до pollMax. За один опрос вычитываются все
+        накопившиеся сообщения. Из серии сообщений CC с одним номером контроллера
+        (вращение энкодера) в callback передаётся только последнее.
+        """
+        def __init__(self, device_id, callback, pollMin = 0.001, pollMax = 0.01):
+            """ device_id -- ID MIDI-устройства
+            callback(msg) -- функция обработки сообщения
+            pollMin, pollMax -- минимальный и максимальный интервал опроса, с
+            """
+            Thread.__init__(self)
+            self.device_id = device_id
+            self.callback = callback
+            self.pollMin = pollMin
+            self.pollMax = pollMax
+            self.stopped = False
+
+            # Статистика
+            self.received = 0
+            self.coalesced = 0
+            self.maxQueue = 0
+            self.latencySum = 0
+            self.maxLatency = 0
+
+        def run(self):
+            print("Start MIDI thread")
+            if self.device_id != -1:
+                self.input_main(self.device_id, self.callback)
+            print("Stop MIDI thread")
+            print("MIDI input: " + str(self.stats()))
+
+        def input_main(self, device_id = None, callback = None):
+            if device_id is None:
+                input_id = pygame.midi.get_default_input_id()
+            else:
+                input_id = device_id
+
+            if input_id != -1:
+                print ("using input_id :%s:" % input_id)
+                devIn = pygame.midi.Input( input_id )
+                self.pollInput(devIn, callback)
+                devIn.close()
+            else:
+                print("MIDI device not found.")
+
+        def pollInput(self, devIn, callback):
+            """ Опрос устройства ввода devIn до остановки потока.
+
+            devIn -- pygame.midi.Input или объект с такими же методами poll() и read(n)
+            """
+            delay = self.pollMin
+            while not self.stopped:
+                midi_events = []
+                while devIn.poll():
+                    midi_events += devIn.read(64)
+
+                if midi_events:
+                    delay = self.pollMin
+                    self.dispatch(midi_events, callback)
+                else:
+                    delay = min(delay * 2, self.pollMax)
+                time.sleep(delay)
+
+        def dispatch(self, midi_events, callback):
+            """ Передача сообщений в callback с объединением серий CC """
+            self.received += len(midi_events)
+            self.maxQueue = max(self.maxQueue, len(midi_events))
+
+            messages = []
+            # Позиция сообщения CC в messages по (статус, номер контроллера)
+            controls = {}
+            for item in midi_events:
+                midi_msg, timestamp = item[0], item[1]
+                if (midi_msg[0] & 0xF0) == 0xB0:
+                    key = (midi_msg[0], midi_msg[1])
+                    i = controls.get(key)
+                    if i is not None:
+                        messages[i] = (midi_msg, timestamp)
+                        self.coalesced += 1
+                        continue
+                    controls[key] = len(messages)
+                messages.append((midi_msg, timestamp))
+
+            now = pygame.midi.time()
+            for midi_msg, timestamp in messages:
+                latency = now - timestamp
+                self.latencySum += latency
+                self.maxLatency = max(self.maxLatency, latency)
+                callback(midi_msg)
+
+        def stats(self):
+            """ Статистика приёма в виде словаря. Задержка - от метки времени PortMidi до callback, мс. """
+            dispatched = self.received - self.coalesced
+            return {
+                "received": self.received,
+                "coalesced": self.coalesced,
+                "maxQueue": self.maxQueue,
+                "avgLatency": self.latencySum / dispatched if dispatched else 0.0,
+                "maxLatency": self.maxLatency
+            }
+
+
+class LaunchpadFrameBuffer:
+    """ Кадровый буфер Launchpad с двойной буферизацией.
+
+    Кадр рисуется в массивах grid (8 строк x 9 столбцов: сетка 8x8 и правый столбец
+    кнопок) и top (верхний ряд из 8 кнопок), затем show() отправляет его на ланчпад.
+    Запись идёт в невидимую страницу, поэтому кадр появляется целиком после
+    обмена страниц. Отправляются только изменившиеся светодиоды. Если их больше,
+    чем сообщений в быстром обновлении (rapidLedUpdate, по два светодиода в
+    сообщении), весь кадр передаётся быстрым обновлением.
+
+    Цвета - значения LPC_*, мигание в кадровом буфере не поддерживается.
+    Методы вызываются из одного потока: любое другое сообщение на ланчпад
+    прерывает последовательность быстрого обновления.
+    """
+    # Количество сообщений в быстром обновлении всех 80 светодиодов
+    RAPID_MESSAGES = 40
+
+    def __init__(self, midi):
+        """ midi -- MidiDevice с открытым выводом на Launchpad """
+        self.midi = midi
+        self.grid = np.full((8, 9), LPC_OFF, dtype=np.uint8)
+        self.top = np.full(8, LPC_OFF, dtype=np.uint8)
+        # Содержимое видимой страницы (после обмена страниц её копия - в странице для записи)
+        self.shownGrid = np.zeros((8, 9), dtype=np.uint8)
+        self.shownTop = np.zeros(8, dtype=np.uint8)
+        # Порядок быстрого обновления: сетка 8x8 по строкам, правый столбец, верхний ряд
+        self.rapidOrder = np.zeros(80, dtype=np.uint8)
+
+        # Статистика
+        self.frames = 0
+        self.messages = 0
+
+        # Обе страницы очищаются, запись идёт в невидимую
+        self.midi.resetLaunchpad()
+        self.midi.doubleBufferEnable()
+
+    def clear(self, color = LPC_OFF):
+        """ Заполнение кадра одним цветом """
+        self.grid.fill(color)
+        self.top.fill(color)
+
+    def drawLevels(self, levels, maximum = 1000):
+        """ Столбцы уровней на сетке 8x8 (8 значений, 0..maximum): зелёный, оранжевый, красный сверху """
+        heights = np.clip(np.rint(np.asarray(levels[0:8], dtype=float) * 8 / maximum), 0, 8)
+        # Строка 0 - верхняя, столбец высотой h занимает строки 8 - h .. 7
+        rows = np.arange(8)[:, None]
+        lit = rows >= (8 - heights)[None, :]
+        colors = np.where(rows < 2, LPC_RED[3], np.where(rows < 4, LPC_ORANGE[3], LPC_GREEN[3]))
+        self.grid[:, 0:8] = np.where(lit, np.broadcast_to(colors, (8, 8)), LPC_OFF)
+
+    def show(self):
+        """ Отправка изменений кадра и обмен страниц. Возвращает количество отправленных сообщений. """
+        grid = self.grid & LPC_COLOR_MASK
+        top = self.top & LPC_COLOR_MASK
+        changedY, changedX = np.nonzero(grid != self.shownGrid)
+        changedTop = np.nonzero(top != self.shownTop)[0]
+        count = len(changedY) + len(changedTop)
+        if count == 0:
+            return 0
+
+        if count > self.RAPID_MESSAGES:
+            order = self.rapidOrder
+            order[0:64] = grid[:, 0:8].ravel()
+            order[64:72] = grid[:, 8]
+            order[72:80] = top
+            messages = [(0x92, int(a), int(b)) for a, b in zip(order[0::2], order[1::2])]
+        else:
+            messages = [(0x90, 16 * int(y) + int(x), int(grid[y, x])) for y, x in zip(changedY, changedX)]
+            messages += [(0xB0, 0x68 + int(n), int(top[n])) for n in changedTop]
+        self.midi.sendBatch(messages)
+        # Обмен страниц также завершает последовательность быстрого обновления
+        self.midi.swapBuffer()
+
+        self.shownGrid[:] = grid
+        self.shownTop[:] = top
+        self.frames += 1
+        self.messages += len(messages) + 1
+        return len(messages) + 1
+
+    def close(self):
+        """ Выключение двойной буферизации и очистка ланчпада """
+        self.midi.doubleBufferDisable()
+        self.midi.resetLaunchpad()
+
+    def stats(self):
+        """ Статистика отправки в виде словаря """
+        return {
+            "frames": self.frames,
+            "messages": self.messages
+        }
@@ -0,0 +1,641 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Вывод данных на устройства цветомузыки
+'''
+
+import time
+import socket
+import asyncio
+
+from threading import Thread, Condition, Event
+
+import numpy as np
+
+# Отчёт USB HID: нулевой байт (номер отчёта) и 10 светодиодов по три канала (RGB)
+HID_REPORT_SIZE = 31
+# Готовые кадры: все каналы включены (вспышка стробоскопа) и все выключены
+HID_ALL_ON = bytes([0x00] + [0xFF] * (HID_REPORT_SIZE - 1))
+HID_ALL_OFF = bytes(HID_REPORT_SIZE)
+
+
+class DeltaFilter:
+    """ Фильтр повторяющихся кадров.
+
+    Кадр отправляется только если он отличается от последнего отправленного,
+    либо если с момента последней отправки прошло больше keepalive секунд.
+    Keepalive нужен, чтобы контроллер не погасил лампы по таймауту приёма.
+    """
+    def __init__(self, keepalive = 1.0):
+        """ keepalive -- максимальный интервал между отправками, с """
+        self.keepalive = keepalive
+        self.last = None
+        self.lastTime = 0.0
+
+        # Статистика
+        self.passed = 0     # кадров пропущено фильтром на отправку
+        self.skipped = 0    # кадров отброшено как повторные
+
+    def needSend(self, frame):
+        """ Проверяет, нужно ли отправлять кадр frame (bytes) """
+        if (frame == self.last) and (time.monotonic() - self.lastTime < self.keepalive):
+            self.skipped += 1
+            return False
+        self.passed += 1
+        return True
+
+    def markSent(self, frame):
+        """ Запоминает кадр frame (bytes) как успешно отправленный """
+        if (self.last is not None) and (len(self.last) == len(frame)):
+            # Копирование в уже выделенный буфер
+            self.last[:] = frame
+        else:
+            self.last = bytearray(frame)
+        self.lastTime = time.monotonic()
+
+    def reset(self):
+        """ Сброс фильтра. Следующий кадр будет отправлен в любом случае """
+        self.last = None
+
+    def stats(self):
+        """ Статистика фильтра в виде словаря """
+        return {
+            "passed": self.passed,
+            "skipped": self.skipped
+        }
+
+
+class HidReport:
+    """ Кольцо заранее выделенных буферов отчёта USB HID.
+
+    Состояние светодиодов копируется прямо в буфер отчёта через представление NumPy,
+    поэтому при формировании кадра память не выделяется. Несколько буферов нужны,
+    чтобы не перезаписать кадр, который в этот момент отправляет поток отправки.
+    """
+    def __init__(self, slots = 3, channels = None):
+        """ slots -- количество буферов в кольце
+        channels -- карта каналов: номера светодиодов обработчика для светодиодов устройства
+                    по порядку, None - все 10 светодиодов как есть
+        """
+        if channels is None:
+            self.channels = None
+        else:
+            self.channels = np.asarray(channels, dtype=np.intp)
+            self.mapped = np.zeros((len(self.channels), 3), dtype=np.int16)
+        self.buffers = []
+        self.views = []
+        for i in range(0, slots):
+            buf = bytearray(HID_REPORT_SIZE)
+            self.buffers.append(buf)
+            self.views.append(np.frombuffer(buf, dtype=np.uint8, offset=1).reshape(-1, 3))
+        self.index = 0
+
+    def fill(self, leds):
+        """ Заполнение следующего буфера состоянием светодиодов leds (массив 10 x 3).
+
+        Возвращает буфер отчёта (bytearray).
+        """
+        self.index = (self.index + 1) % len(self.buffers)
+        if self.channels is None:
+            np.copyto(self.views[self.index], leds, casting='unsafe')
+        else:
+            np.take(leds, self.channels, axis=0, out=self.mapped)
+            np.copyto(self.views[self.index][0:len(self.channels)], self.mapped, casting='unsafe')
+        return self.buffers[self.index]
+
+
+class HidOutput:
+    """ USB HID устройство (плата STM32) """
+    def __init__(self, report, device = None):
+        """ report -- выходной отчёт устройства (pywinusb HidReport или объект с теми же методами)
+        device -- открытое устройство, закрывается в close()
+        """
+        self.report = report
+        self.device = device
+
+    def send(self, frame):
+        """ Отправка кадра. Вызывается из потока отправки устройства. """
+        self.report.set_raw_data(frame)
+        self.report.send()
+        return True
+
+    def close(self):
+        """ Выключение всех каналов и закрытие устройства """
+        try:
+            self.report.set_raw_data(HID_ALL_OFF)
+            self.report.send()
+            if self.device is not None:
+                self.device.close()
+        except Exception:
+            pass
+
+
+class UdpOutput:
+    """ Постоянное UDP соединение с сетевым контроллером цветомузыки.
+
+    Сокет создаётся один раз и пересоздаётся только при изменении адреса устройства.
+    """
+    def __init__(self, ip = None, port = None):
+        self.ip = None
+        self.port = None
+        self.sock = None
+
+        # Статистика
+        self.sent = 0           # отправлено пакетов
+        self.errors = 0         # ошибок отправки
+        self.bytes = 0          # отправлено байт
+        self.sendTime = 0.0     # суммарное время отправки, с
+        self.maxSendTime = 0.0  # максимальное время отправки, с
+
+        if ip is not None:
+            self.configure(ip, port)
+
+    def configure(self, ip, port):
+        """ Установка адреса устройства. Сокет пересоздаётся только если адрес изменился.
+
+        ip -- IP адрес устройства
+        port -- порт устройства
+        """
+        if (ip == self.ip) and (port == self.port) and (self.sock is not None):
+            return
+        self.close()
+        self.ip = ip
+        self.port = port
+        try:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.connect((ip, port))
+        except OSError as e:
+            print("UDP: " + type(e).__name__ + ': ' + str(e))
+            self.errors += 1
+            self.close()
+
+    def send(self, data):
+        """ Отправка пакета на устройство.
+
+        Возвращает True, если пакет отправлен.
+        """
+        if self.sock is None:
+            return False
+        start = time.perf_counter()
+        try:
+            self.sock.send(data)
+        except OSError:
+            self.errors += 1
+            return False
+        elapsed = time.perf_counter() - start
+        self.sendTime += elapsed
+        if elapsed > self.maxSendTime:
+            self.maxSendTime = elapsed
+        self.sent += 1
+        self.bytes += len(data)
+        return True
+
+    def close(self):
+        """ Закрытие сокета """
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def stats(self):
+        """ Статистика отправки в виде словаря """
+        if self.sent:
+            avg = self.sendTime / self.sent
+        else:
+            avg = 0.0
+        return {
+            "sent": self.sent,
+            "errors": self.errors,
+            "bytes": self.bytes,
+            "avgSendTime": avg,
+            "maxSendTime": self.maxSendTime
+        }
+
+
+class DeviceOutput(Thread):
+    """ Поток отправки кадров на одно устройство цветомузыки.
+
+    Хранится только последний кадр: если новый кадр приходит раньше, чем был
+    отправлен предыдущий, старый перезаписывается. Кадры не отправляются чаще
+    maxRate, повторные кадры отсекает DeltaFilter. У каждого устройства свой поток,
+    поэтому медленное устройство не задерживает остальные.
+    """
+    def __init__(self, name, group, send, keepalive = 1.0, maxRate = None, channels = None):
+        """ name -- имя устройства
+        group -- группа устройств ("hid" или "udp"), кадры строятся по группе
+        send(frame) -- функция отправки кадра (bytes), возвращает True при успехе
+        keepalive -- максимальный интервал между отправками одинаковых кадров, с
+        maxRate -- максимальная частота кадров, Гц (None - без ограничения)
+        channels -- карта каналов устройства (используется при построении кадра)
+        """
+        Thread.__init__(self)
+        self.daemon = True
+        self.name = name
+        self.group = group
+        self.sendFrame = send
+        self.delta = DeltaFilter(keepalive)
+        if maxRate:
+            self.minInterval = 1 / maxRate
+        else:
+            self.minInterval = 0.0
+        self.channels = channels
+        # stamp(frame) -- запись номера кадра перед отправкой (FrameEncoder.stamp), None - не нужна
+        self.stamp = None
+
+        self.cond = Condition()
+        self.pending = None
+        # Копия отправляемого кадра: буфер производителя может быть переиспользован
+        self.current = bytearray()
+        self.stopped = False
+
+        # Статистика
+        self.overwrites = 0     # кадров перезаписано до отправки
+        self.limited = 0        # ожиданий из-за ограничения частоты
+        self.sent = 0
+        self.errors = 0
+        self.sendTime = 0.0
+        self.maxSendTime = 0.0
+        self.startTime = None
+        self.stopTime = None
+
+    def submit(self, frame):
+        """ Передача кадра frame (bytes) для отправки """
+        with self.cond:
+            if self.pending is not None:
+                self.overwrites += 1
+            self.pending = frame
+            self.cond.notify()
+
+    def take(self, notBefore):
+        """ Ожидание кадра, но не раньше момента notBefore (time.monotonic).
+
+        Пока идёт ожидание, новые кадры заменяют ожидающий. Возвращает копию
+        кадра или None, если за 0.1 с кадров не было.
+        """
+        with self.cond:
+            if self.pending is None:
+                self.cond.wait(0.1)
+                if self.pending is None:
+                    return None
+            delay = notBefore - time.monotonic()
+            if delay > 0:
+                self.limited += 1
+                while (delay > 0) and not self.stopped:
+                    self.cond.wait(delay)
+                    delay = notBefore - time.monotonic()
+            if len(self.current) == len(self.pending):
+                self.current[:] = self.pending
+            else:
+                self.current = bytearray(self.pending)
+            self.pending = None
+        return self.current
+
+    def run(self):
+        print("Start output thread (%s)" % self.name)
+        self.startTime = time.monotonic()
+        nextSend = 0.0
+        while not self.stopped:
+            frame = self.take(nextSend)
+            if frame is not None and self.deliver(frame):
+                nextSend = time.monotonic() + self.minInterval
+        self.stopTime = time.monotonic()
+        print("Stop output thread (%s)" % self.name)
+
+    def deliver(self, frame):
+        """ Отправка кадра с учётом фильтра повторов. Возвращает True, если кадр отправлен. """
+        if not self.delta.needSend(frame):
+            return False
+        if self.stamp is not None:
+            self.stamp(frame)
+        start = time.perf_counter()
+        try:
+            ok = self.sendFrame(frame)
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - start
+        if not ok:
+            self.errors += 1
+            return False
+        self.delta.markSent(frame)
+        self.sent += 1
+        self.sendTime += elapsed
+        if elapsed > self.maxSendTime:
+            self.maxSendTime = elapsed
+        return True
+
+    def stop(self):
+        """ Остановка потока с ожиданием его завершения """
+        self.stopped = True
+        with self.cond:
+            self.cond.notify()
+        if self.is_alive():
+            self.join()
+
+    def elapsed(self):
+        """ Время работы потока, с """
+        if self.startTime is None:
+            return 0.0
+        if self.stopTime is None:
+            return time.monotonic() - self.startTime
+        return self.stopTime - self.startTime
+
+    def stats(self):
+        """ Статистика отправки в виде словаря """
+        if self.sent:
+            avg = self.sendTime / self.sent
+        else:
+            avg = 0.0
+        elapsed = self.elapsed()
+        return {
+            "sent": self.sent,
+            "errors": self.errors,
+            "skipped": self.delta.skipped,
+            "overwrites": self.overwrites,
+            "limited": self.limited,
+            "framesPerSecond": self.sent / elapsed if elapsed > 0 else 0.0,
+            "avgSendTime": avg,
+            "maxSendTime": self.maxSendTime
+        }
+
+
+class UdpProtocol(asyncio.DatagramProtocol):
+    """ Протокол UDP для AsyncUdpOutput: передаёт ошибки и управление потоком владельцу """
+    def __init__(self, owner):
+        self.owner = owner
+
+    def error_received(self, exc):
+        self.owner.errors += 1
+
+    def pause_writing(self):
+        # Буфер отправки сокета переполнен - ждём, пока он освободится
+        self.owner.paused += 1
+        self.owner.writable.clear()
+
+    def resume_writing(self):
+        self.owner.writable.set()
+
+
+class AsyncUdpOutput(Thread):
+    """ Отправка кадров по UDP через asyncio в отдельном потоке.
+
+    Один кадр отправляется на все адреса targets: это может быть список
+    контроллеров, широковещательный адрес сети (например, 192.168.10.255) или
+    multicast группа - тогда один пакет за такт получают все лампы.
+
+    Кадры передаются в цикл событий через ограниченную очередь maxQueue. Если
+    очередь заполнена, самый старый кадр отбрасывается. Когда переполнен буфер
+    сокета, отправка ждёт его освобождения (pause_writing/resume_writing).
+    Если отправке пришлось ждать (ограничение maxRate или буфер сокета), очередь
+    сворачивается до самого свежего кадра, чтобы лампы не отставали от музыки.
+    Интерфейс совпадает с DeviceOutput, поэтому устройство регистрируется в OutputRegistry.
+    """
+    def __init__(self, name, group, targets, keepalive = 1.0, maxRate = None, channels = None,
+                 maxQueue = 4, ttl = 1, interface = None):
+        """ name -- имя устройства
+        group -- группа устройств ("udp")
+        targets -- список адресов [(ip, port), ...]
+        keepalive -- максимальный интервал между отправками одинаковых кадров, с
+        maxRate -- максимальная частота кадров, Гц (None - без ограничения)
+        channels -- карта каналов устройства (используется при построении кадра)
+        maxQueue -- длина очереди кадров
+        ttl -- TTL multicast пакетов (1 - только локальная сеть)
+        interface -- IP адрес сетевого интерфейса для multicast (None - по таблице маршрутизации)
+        """
+        Thread.__init__(self)
+        self.daemon = True
+        self.name = name
+        self.group = group
+        self.targets = [(ip, int(port)) for ip, port in targets]
+        self.delta = DeltaFilter(keepalive)
+        if maxRate:
+            self.minInterval = 1 / maxRate
+        else:
+            self.minInterval = 0.0
+        self.channels = channels
+        self.maxQueue = maxQueue
+        self.ttl = ttl
+        self.interface = interface
+        # stamp(frame) -- запись номера кадра перед отправкой (FrameEncoder.stamp), None - не нужна
+        self.stamp = None
+
+        self.loop = None
+        self.queue = None
+        self.writable = None
+        self.ready = Event()
+
+        # Статистика
+        self.frames = 0         # кадров отправлено
+        self.sent = 0           # пакетов отправлено (кадры x адреса)
+        self.errors = 0
+        self.dropped = 0        # кадров отброшено из-за переполнения очереди
+        self.collapsed = 0      # устаревших кадров отброшено после ожидания отправки
+        self.maxDepth = 0       # максимальная длина очереди
+        self.paused = 0         # остановок из-за переполнения буфера сокета
+        self.latencySum = 0.0   # суммарная задержка от submit до отправки, с
+        self.maxLatency = 0.0
+        self.startTime = None
+        self.stopTime = None
+
+    def submit(self, frame):
+        """ Передача кадра frame (bytes) для отправки. Вызывается из любого потока. """
+        if not self.ready.is_set() or not self.delta.needSend(frame):
+            return
+        self.delta.markSent(frame)
+        self.loop.call_soon_threadsafe(self.enqueue, (time.perf_counter(), bytearray(frame)))
+
+    def enqueue(self, item):
+        """ Постановка кадра в очередь (в цикле событий) """
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(item)
+        self.maxDepth = max(self.maxDepth, self.queue.qsize())
+
+    def run(self):
+        print("Start output thread (%s)" % self.name)
+        self.startTime = time.monotonic()
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.loop.run_until_complete(self.main())
+        except OSError as e:
+            print("UDP: " + type(e).__name__ + ': ' + str(e))
+            self.errors += 1
+        finally:
+            self.ready.clear()
+            self.loop.close()
+        self.stopTime = time.monotonic()
+        print("Stop output thread (%s)" % self.name)
+
+    async def main(self):
+        """ Цикл отправки кадров """
+        self.queue = asyncio.Queue(self.maxQueue)
+        self.writable = asyncio.Event()
+        self.writable.set()
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.ttl)
+        if self.interface is not None:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(self.interface))
+        sock.setblocking(False)
+        transport, protocol = await self.loop.create_datagram_endpoint(lambda: UdpProtocol(self), sock = sock)
+        self.ready.set()
+
+        nextSend = 0.0
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                break
+            waited = False
+            delay = nextSend - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                waited = True
+            if not self.writable.is_set():
+                await self.writable.wait()
+                waited = True
+            if waited:
+                item = self.newest(item)
+                if item is None:
+                    break
+
+            submitted, frame = item
+            if self.stamp is not None:
+                self.stamp(frame)
+            for addr in self.targets:
+                try:
+                    transport.sendto(frame, addr)
+                    self.sent += 1
+                except OSError:
+                    self.errors += 1
+            self.frames += 1
+            latency = time.perf_counter() - submitted
+            self.latencySum += latency
+            self.maxLatency = max(self.maxLatency, latency)
+            nextSend = time.monotonic() + self.minInterval
+        transport.close()
+
+    def newest(self, item):
+        """ Самый свежий кадр из item и очереди, остальные отбрасываются.
+
+        Возвращает None, если в очереди сигнал завершения.
+        """
+        while not self.queue.empty():
+            newer = self.queue.get_nowait()
+            if newer is None:
+                return None
+            self.collapsed += 1
+            item = newer
+        return item
+
+    def finish(self):
+        """ Очистка очереди и сигнал завершения (в цикле событий) """
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+    def stop(self):
+        """ Остановка потока с ожиданием его завершения """
+        if self.ready.is_set():
+            self.loop.call_soon_threadsafe(self.finish)
+        if self.is_alive():
+            self.join()
+
+    def stats(self):
+        """ Статистика отправки в виде словаря """
+        if self.startTime is None:
+            elapsed = 0.0
+        elif self.stopTime is None:
+            elapsed = time.monotonic() - self.startTime
+        else:
+            elapsed = self.stopTime - self.startTime
+        return {
+            "sent": self.sent,
+            "errors": self.errors,
+            "skipped": self.delta.skipped,
+            "dropped": self.dropped,
+            "collapsed": self.collapsed,
+            "maxDepth": self.maxDepth,
+            "paused": self.paused,
+            "framesPerSecond": self.frames / elapsed if elapsed > 0 else 0.0,
+            "avgLatency": self.latencySum / self.frames if self.frames else 0.0,
+            "maxLatency": self.maxLatency
+        }
+
+
+class OutputRegistry:
+    """ Набор устройств вывода: N USB HID устройств и N сетевых контроллеров.
+
+    Каждое устройство имеет свою карту каналов, свой поток отправки и своё
+    ограничение частоты кадров.
+    """
+    def __init__(self, keepalive = 1.0):
+        """ keepalive -- максимальный интервал между отправками одинаковых кадров, с """
+        self.keepalive = keepalive
+        self.devices = []
+        self.groups = {}
+        self.started = False
+
+    def addDevice(self, name, group, send, channels = None, maxRate = None):
+        """ Регистрация устройства. Возвращает DeviceOutput.
+
+        name -- имя устройства
+        group -- группа устройств ("hid" или "udp")
+        send(frame) -- функция отправки кадра (bytes), возвращает True при успехе
+        channels -- карта каналов устройства
+        maxRate -- максимальная частота кадров, Гц (None - без ограничения)
+        """
+        return self.add(DeviceOutput(name, group, send, self.keepalive, maxRate, channels))
+
+    def add(self, dev):
+        """ Регистрация готового устройства вывода (DeviceOutput или AsyncUdpOutput). Возвращает dev. """
+        self.devices.append(dev)
+        self.groups.setdefault(dev.group, []).append(dev)
+        return dev
+
+    def replaceGroup(self, group, devices):
+        """ Замена устройств группы group на devices (например, при изменении настроек).
+
+        Список группы заменяется целиком, поэтому поток обработки, который в этот момент
+        отправляет кадры, видит либо старые, либо новые устройства. Потоки старых устройств
+        останавливаются, новых - запускаются, если запущен весь набор.
+        """
+        old = self.group(group)
+        self.groups[group] = list(devices)
+        self.devices = [dev for dev in self.devices if dev.group != group] + list(devices)
+        for dev in old:
+            dev.stop()
+            print("Output %s: %s" % (dev.name, str(dev.stats())))
+        if self.started:
+            for dev in devices:
+                dev.start()
+
+    def group(self, group):
+        """ Список устройств группы """
+        return self.groups.get(group, [])
+
+    def submitGroup(self, group, frame):
+        """ Передача одного кадра всем устройствам группы """
+        for dev in self.group(group):
+            dev.submit(frame)
+
+    def start(self):
+        """ Запуск потоков отправки """
+        self.started = True
+        for dev in self.devices:
+            dev.start()
+
+    def stop(self):
+        """ Остановка потоков отправки """
+        self.started = False
+        for dev in self.devices:
+            dev.stop()
+
+    def stats(self):
+        """ Статистика отправки по устройствам и суммарная частота кадров в виде словаря """
+        result = {"framesPerSecond": 0.0}
+        for dev in self.devices:
+            st = dev.stats()
+            result[dev.name] = st
+            result["framesPerSecond"] += st["framesPerSecond"]
+        return result
@@ -0,0 +1,193 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Двоичный протокол кадров для сетевого контроллера цветомузыки
+'''
+
+import time
+import socket
+import struct
+
+# Формат кадра (little-endian):
+#   2 байта  -- сигнатура b"CM"
+#   1 байт   -- версия протокола
+#   1 байт   -- количество каналов N
+#   2 байта  -- номер кадра (по кругу 0..65535)
+#   4 байта  -- время отправки, мс (по кругу)
+#   N байт   -- яркость каналов 0..255
+# Старый формат - ровно 4 ASCII символа '1'/'0' (лампы R, Y, G, B) - тоже принимается.
+FRAME_MAGIC = b"CM"
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct("<2sBBHI")
+# Номер и время кадра внутри заголовка
+FRAME_SEQ = struct.Struct("<HI")
+FRAME_SEQ_OFFSET = 4
+LEGACY_FRAME_SIZE = 4
+# Пауза, после которой приёмник принимает кадр с любым номером (например, после перезапуска программы), мс
+RESYNC_TIME = 1000
+
+
+def timestampMs():
+    """ Текущее время для поля времени кадра, мс (по кругу 32 бита) """
+    return int(time.monotonic() * 1000) & 0xFFFFFFFF
+
+
+class FrameEncoder:
+    """ Формирование кадров в кольце заранее выделенных буферов.
+
+    Кадр формируется только при изменении яркости каналов или если с последнего
+    кадра прошло больше keepalive секунд. Номер и время кадра записывает stamp()
+    в потоке отправки непосредственно перед отправкой: кадры, которые отправитель
+    перезаписал или отбросил из очереди, номера не получают, поэтому пропуск
+    номера на приёмнике означает потерю кадра в сети.
+    """
+    def __init__(self, channels = 4, keepalive = 1.0, slots = 3):
+        """ channels -- количество каналов
+        keepalive -- максимальный интервал между кадрами с одинаковой яркостью, с
+        slots -- количество буферов в кольце
+        """
+        self.channels = channels
+        self.keepalive = keepalive
+        self.buffers = [bytearray(FRAME_HEADER.size + channels) for i in range(0, slots)]
+        self.index = 0
+        self.seq = 0
+        self.last = bytearray(channels)
+        self.lastTime = None
+
+    def update(self, values):
+        """ Кадр для яркостей values (0..255) или None, если кадр отправлять не нужно """
+        now = time.monotonic()
+        if (self.lastTime is not None) and (now - self.lastTime < self.keepalive):
+            if all(self.last[i] == values[i] for i in range(0, self.channels)):
+                return None
+        self.lastTime = now
+        self.last[:] = bytes(values)
+        return self.encode(values)
+
+    def encode(self, values):
+        """ Формирование кадра для яркостей values (0..255) в следующем буфере кольца.
+
+        Номер и время кадра нулевые, их записывает stamp().
+        """
+        self.index = (self.index + 1) % len(self.buffers)
+        buf = self.buffers[self.index]
+        FRAME_HEADER.pack_into(buf, 0, FRAME_MAGIC, FRAME_VERSION, self.channels, 0, 0)
+        buf[FRAME_HEADER.size:] = bytes(values)
+        return buf
+
+    def stamp(self, frame):
+        """ Запись следующего номера и текущего времени в кадр frame (bytearray).
+
+        Вызывается из потока отправки для копии кадра перед самой отправкой.
+        Возвращает frame.
+        """
+        FRAME_SEQ.pack_into(frame, FRAME_SEQ_OFFSET, self.seq, timestampMs())
+        self.seq = (self.seq + 1) & 0xFFFF
+        return frame
+
+
+def decodeFrame(data):
+    """ Разбор кадра.
+
+    Возвращает кортеж (номер кадра, время отправки, список яркостей). Для кадра
+    старого формата номер и время - None, яркость - 255 или 0.
+    При ошибке формата вызывает ValueError.
+    """
+    if len(data) == LEGACY_FRAME_SIZE:
+        return (None, None, [255 if c == ord('1') else 0 for c in bytes(data)])
+    if len(data) < FRAME_HEADER.size:
+        raise ValueError("Frame is too short")
+    magic, version, count, seq, stamp = FRAME_HEADER.unpack_from(data, 0)
+    if magic != FRAME_MAGIC:
+        raise ValueError("Bad frame signature")
+    if version != FRAME_VERSION:
+        raise ValueError("Unsupported frame version %d" % version)
+    if len(data) < FRAME_HEADER.size + count:
+        raise ValueError("Frame is truncated")
+    return (seq, stamp, list(data[FRAME_HEADER.size:FRAME_HEADER.size + count]))
+
+
+class FrameReceiver:
+    """ Эталонный приёмник кадров, повторяющий логику прошивки контроллера.
+
+    Устаревшие кадры (номер не больше последнего принятого) отбрасываются,
+    пропуски номеров считаются потерями. Задержка вычисляется по времени
+    отправки и имеет смысл, если отправитель и приёмник на одном компьютере.
+    """
+    def __init__(self, channels = 4):
+        """ channels -- количество каналов приёмника """
+        self.values = [0] * channels
+        self.lastSeq = None
+        self.lastTime = None
+
+        # Статистика
+        self.received = 0
+        self.legacy = 0
+        self.stale = 0
+        self.lost = 0
+        self.invalid = 0
+        self.latencySum = 0
+        self.maxLatency = 0
+
+    def process(self, data, now = None):
+        """ Обработка пакета data. now -- время приёма, мс (по умолчанию timestampMs()).
+
+        Возвращает True, если кадр принят и яркость каналов обновлена.
+        """
+        if now is None:
+            now = timestampMs()
+        try:
+            seq, stamp, values = decodeFrame(data)
+        except ValueError:
+            self.invalid += 1
+            return False
+
+        if seq is None:
+            self.legacy += 1
+        else:
+            if (self.lastSeq is not None) and ((now - self.lastTime) & 0xFFFFFFFF) < RESYNC_TIME:
+                # Разность номеров по кругу: 1..32767 - новый кадр, остальное - устаревший
+                delta = (seq - self.lastSeq) & 0xFFFF
+                if (delta == 0) or (delta >= 0x8000):
+                    self.stale += 1
+                    return False
+                self.lost += delta - 1
+            self.lastSeq = seq
+            latency = (now - stamp) & 0xFFFFFFFF
+            self.latencySum += latency
+            self.maxLatency = max(self.maxLatency, latency)
+
+        self.received += 1
+        self.lastTime = now
+        for i in range(0, len(self.values)):
+            self.values[i] = values[i] if i < len(values) else 0
+        return True
+
+    def listen(self, port, isStopped, ip = ""):
+        """ Приём кадров с UDP порта port, пока isStopped() не вернёт True """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((ip, port))
+        sock.settimeout(0.1)
+        try:
+            while not isStopped():
+                try:
+                    data = sock.recv(1500)
+                except socket.timeout:
+                    continue
+                self.process(data)
+        finally:
+            sock.close()
+
+    def stats(self):
+        """ Статистика приёма в виде словаря, задержка в мс """
+        frames = self.received - self.legacy
+        return {
+            "received": self.received,
+            "legacy": self.legacy,
+            "stale": self.stale,
+            "lost": self.lost,
+            "invalid": self.invalid,
+            "avgLatency": self.latencySum / frames if frames else 0.0,
+            "maxLatency": self.maxLatency
+        }
@@ -0,0 +1,165 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Планировщик тактов обработки цветомузыки
+'''
+
+import os
+import time
+
+from threading import Thread
+
+import numpy as np
+
+
+class IntervalHistogram:
+    """ Гистограмма интервалов между тактами с шагом resolution мс. """
+    def __init__(self, resolution = 0.1, maximum = 200):
+        """ resolution -- ширина столбца гистограммы, мс
+        maximum -- максимальный учитываемый интервал, мс (большие попадают в последний столбец)
+        """
+        self.resolution = resolution
+        self.counts = np.zeros(int(maximum / resolution) + 1, dtype=np.int64)
+        self.total = 0
+        self.maxInterval = 0.0
+
+    def add(self, interval):
+        """ Добавление интервала interval, с """
+        ms = interval * 1000
+        index = int(ms / self.resolution)
+        if index >= len(self.counts):
+            index = len(self.counts) - 1
+        self.counts[index] += 1
+        self.total += 1
+        if ms > self.maxInterval:
+            self.maxInterval = ms
+
+    def percentile(self, p):
+        """ Интервал, мс, меньше которого p процентов тактов """
+        if self.total == 0:
+            return 0.0
+        index = int(np.searchsorted(np.cumsum(self.counts), self.total * p / 100))
+        return (index + 0.5) * self.resolution
+
+    def reset(self):
+        """ Очистка гистограммы """
+        self.counts.fill(0)
+        self.total = 0
+        self.maxInterval = 0.0
+
+    def stats(self):
+        """ Статистика интервалов в виде словаря """
+        return {
+            "ticks": self.total,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "max": self.maxInterval
+        }
+
+
+class FrameScheduler(Thread):
+    """ Поток, вызывающий обработку такта.
+
+    Два режима работы:
+      "timer" -- такты с частотой rate. Моменты тактов отсчитываются от времени запуска,
+                 поэтому ошибки отдельных тактов не накапливаются. Последнюю миллисекунду
+                 перед тактом поток не спит, а уступает процессор, что убирает
+                 погрешность системного таймера.
+      "audio" -- такт выполняется сразу после появления нового спектра в буфере,
+                 то есть обработка идёт в темпе аудиоблоков.
+    """
+    def __init__(self, tick, rate = 50, mode = "timer", buffer = None):
+        """ tick() -- функция обработки такта
+        rate -- частота тактов в режиме "timer", Гц (50-200)
+        mode -- режим работы ("timer" или "audio")
+        buffer -- буфер спектров, нужен для режима "audio"
+        """
+        Thread.__init__(self)
+        self.daemon = True
+        self.tick = tick
+        self.period = 1 / rate
+        self.mode = mode
+        self.buffer = buffer
+        self.stopped = False
+        # Запас времени, который не спим перед тактом, с
+        self.spinMargin = 0.001
+
+        self.histogram = IntervalHistogram()
+        # Краткая статистика для вывода в GUI, обновляется раз в секунду
+        self.summary = ""
+        self.logPeriod = 60
+
+    def run(self):
+        print("Start scheduler (%s)" % self.mode)
+        timerPeriod = self.enableHighResolutionTimer()
+        lastTick = None
+        lastSummary = lastLog = time.perf_counter()
+        start = time.perf_counter()
+        n = 0
+        while not self.stopped:
+            if self.mode == "audio":
+                self.waitFrame()
+            else:
+                n += 1
+                if not self.waitUntil(start + n * self.period):
+                    # Такты пропущены (например, система была занята) - начинаем отсчёт заново
+                    start = time.perf_counter()
+                    n = 0
+            if self.stopped:
+                break
+
+            now = time.perf_counter()
+            if lastTick is not None:
+                self.histogram.add(now - lastTick)
+            lastTick = now
+            self.tick()
+
+            if now - lastSummary >= 1:
+                lastSummary = now
+                st = self.histogram.stats()
+                self.summary = "Tick p50 %.1f ms, p99 %.1f ms" % (st["p50"], st["p99"])
+            if now - lastLog >= self.logPeriod:
+                lastLog = now
+                print("Scheduler: " + str(self.histogram.stats()))
+        self.disableHighResolutionTimer(timerPeriod)
+        print("Stop scheduler")
+
+    def waitUntil(self, deadline):
+        """ Ожидание момента deadline (perf_counter).
+
+        Возвращает False, если момент пропущен больше чем на период.
+        """
+        delay = deadline - time.perf_counter()
+        if delay < -self.period:
+            return False
+        if delay > self.spinMargin:
+            time.sleep(delay - self.spinMargin)
+        while time.perf_counter() < deadline:
+            time.sleep(0)
+        return True
+
+    def waitFrame(self):
+        """ Ожидание спектра, который ещё не прочитан (мог появиться во время такта) """
+        while (self.buffer.seq == self.buffer.lastReadSeq) and not self.stopped:
+            time.sleep(0.0005)
+
+    def enableHighResolutionTimer(self):
+        """ Windows: включение системного таймера с разрешением 1 мс на время работы """
+        if os.name != "nt":
+            return None
+        import ctypes
+        ctypes.windll.winmm.timeBeginPeriod(1)
+        return 1
+
+    def disableHighResolutionTimer(self, period):
+        """ Windows: возврат разрешения системного таймера """
+        if period is not None:
+            import ctypes
+            ctypes.windll.winmm.timeEndPeriod(period)
+
+    def stop(self):
+        """ Остановка потока с ожиданием его завершения """
+        self.stopped = True
+        self.join()
+        print("Scheduler: " + str(self.histogram.stats()))
@@ -0,0 +1,254 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Захват звука и быстрое преобразование Фурье
+'''
+
+import math
+import time
+import queue
+import multiprocessing
+
+import numpy as np
+
+from spectrumbuffer import SharedSpectrumBuffer
+from dsp import StftAnalyzer, BandAnalyzer
+from filestream import PcmFile, FileInputStream
+
+
+def stftHopSize(samplerate, fftsize, hop = None):
+    """ Шаг STFT в сэмплах. hop -- шаг, мс (None - четверть fftsize) """
+    if hop is None:
+        return fftsize // 4
+    return max(1, min(fftsize, int(round(samplerate * hop / 1000))))
+
+
+def captureBlockSize(samplerate, block_duration = 20, fftsize = None, hop = None):
+    """ Размер блока захвата в сэмплах.
+
+    При STFT блок равен шагу, чтобы каждый спектр публиковался в своём блоке
+    и доходил до обработки, а не публиковался пачкой по несколько спектров.
+    """
+    if fftsize is not None:
+        return stftHopSize(samplerate, fftsize, hop)
+    return int(samplerate * block_duration / 1000)
+
+
+def captureSamplerate(device = None, filename = None, pcm_rate = 44100):
+    """ Частота дискретизации аудиоустройства device или файла filename
+    (pcm_rate - частота raw PCM файла, у WAV файла берётся из заголовка)
+    """
+    if filename is not None:
+        source = PcmFile(filename, pcm_rate)
+        source.close()
+        return source.samplerate
+    import sounddevice as sounddev
+    return sounddev.query_devices(device, 'input')['default_samplerate']
+
+
+def spectrumRate(samplerate, block_duration = 20, fftsize = None, hop = None):
+    """ Количество спектров в секунду """
+    return samplerate / captureBlockSize(samplerate, block_duration, fftsize, hop)
+
+
+def spectrumCallback(buffer, samplerate, low = 40, high = 2000, gain = 7, fftsize = None, hop = None,
+                     bands = None, block_duration = 20):
+    """ Создание callback-функции, которая вычисляет спектр блока звука и публикует его в буфер.
+
+    buffer -- буфер спектров (SpectrumBuffer или SharedSpectrumBuffer)
+    samplerate -- частота дискретизации
+    low, high -- границы анализируемого диапазона частот, Гц
+    gain -- усиление
+    fftsize -- размер БПФ для STFT с окном Ханна, None - БПФ по одному блоку без окна
+    hop -- шаг STFT, мс (None - четверть fftsize). Спектр публикуется после каждого шага.
+    bands -- расположение полос: None - линейно с шагом (high - low) / (bins - 1),
+             "log" или "mel" - полосы BandAnalyzer, занимающие диапазон от low до high
+    block_duration -- длительность блока звука, мс (для STFT - длительность, на которой настроены пороги уровня)
+    """
+    if fftsize is not None:
+        return stftCallback(buffer, samplerate, low, high, gain, fftsize, hop, bands, block_duration)
+
+    bins = buffer.bins
+    delta_f = (high - low) / (bins - 1)
+    fftsize = math.ceil(samplerate / delta_f)
+    low_bin = math.floor(low / delta_f)
+    # Множитель для перевода амплитуды в условные единицы спектра
+    scale = gain / fftsize * 100000
+    if bands is not None:
+        analyzer = BandAnalyzer(samplerate, fftsize, bins, low, high, bands)
+
+    # callback-функция, которая вызывается при получении звукового сэмпла
+    def callback(indata, frames, time, status):
+        if status:
+            text = '************************ ' + str(status) + ' ************************'
+            print(text)
+
+        # Быстрое преобразование Фурье сразу для обоих каналов.
+        # levels[:, 0] - левый канал, levels[:, 1] - правый канал.
+        if bands is None:
+            magnitude = np.abs(np.fft.rfft(indata[:, 0:2], n=fftsize, axis=0)[low_bin:low_bin + bins])
+        else:
+            magnitude = analyzer.process(np.abs(np.fft.rfft(indata[:, 0:2], n=fftsize, axis=0)))
+        magnitude *= scale
+        levels = np.rint(magnitude).astype(np.int64)
+        peaks = levels.max(axis=0)
+        np.maximum(levels[:, 0], levels[:, 1], out=buffer.nextSlot())
+        buffer.publish(peaks[0], peaks[1])
+
+    return callback
+
+
+def stftCallback(buffer, samplerate, low, high, gain, fftsize, hop = None, bands = None, block_duration = 20):
+    """ Создание callback-функции, которая вычисляет спектр методом STFT.
+
+    Окно, кольцевой буфер сэмплов и номера бинов полос вычисляются один раз.
+    Линейные полосы берутся в тех же частотах, что и при БПФ по блоку, а уровни
+    приводятся к той же шкале, поэтому пороги режимов работы не меняются.
+    hop -- шаг STFT, мс (None - четверть fftsize)
+    bands -- расположение полос (см. spectrumCallback)
+    block_duration -- длительность блока, на которой настроены пороги уровня, мс
+    """
+    bins = buffer.bins
+    delta_f = (high - low) / (bins - 1)
+    low_bin = math.floor(low / delta_f)
+    stft = StftAnalyzer(fftsize, stftHopSize(samplerate, fftsize, hop), 2)
+    if bands is None:
+        index = stft.binIndex(samplerate, (low_bin + np.arange(bins)) * delta_f)
+    else:
+        analyzer = BandAnalyzer(samplerate, fftsize, bins, low, high, bands)
+    # Синус дает одинаковый уровень с окном Ханна и при БПФ по блоку без окна
+    scale = gain * 100000 * min(1.0, block_duration / 1000 * delta_f)
+
+    levels = np.zeros((bins, 2))
+    rounded = np.zeros((bins, 2), dtype=np.int64)
+
+    def publish(magnitude):
+        if bands is None:
+            np.take(magnitude, index, axis=0, out=levels)
+            np.multiply(levels, scale, out=levels)
+        else:
+            np.multiply(analyzer.process(magnitude), scale, out=levels)
+        np.rint(levels, out=levels)
+        rounded[:] = levels
+        peaks = rounded.max(axis=0)
+        np.maximum(rounded[:, 0], rounded[:, 1], out=buffer.nextSlot())
+        buffer.publish(peaks[0], peaks[1])
+
+    def callback(indata, frames, time, status):
+        if status:
+            text = '************************ ' + str(status) + ' ************************'
+            print(text)
+        stft.push(indata, publish)
+
+    return callback
+
+
+def captureSpectrum(buffer, isStopped, device = None, block_duration = 20, low = 40, high = 2000, gain = 7,
+                    filename = None, realtime = True, fftsize = None, hop = None, bands = None,
+                    pcm_rate = 44100, pcm_channels = 2):
+    """ Захват звука с аудиоустройства или из файла и публикация спектра в буфер.
+
+    Функция работает, пока isStopped() не вернёт True или не закончится файл.
+
+    buffer -- буфер спектров (SpectrumBuffer или SharedSpectrumBuffer)
+    isStopped() -- функция проверки необходимости остановки
+    device -- аудиоустройство, None - устройство по умолчанию
+    block_duration -- длительность блока звука, мс (при STFT блок равен шагу STFT)
+    low, high -- границы анализируемого диапазона частот, Гц
+    gain -- усиление
+    filename -- WAV или raw PCM файл вместо аудиоустройства
+    realtime -- воспроизводить файл в темпе реального времени, иначе с максимальной скоростью
+    fftsize, hop -- параметры STFT (см. spectrumCallback)
+    bands -- расположение полос спектра (см. spectrumCallback)
+    pcm_rate, pcm_channels -- частота дискретизации и количество каналов raw PCM файла (сэмплы int16)
+    """
+    if filename is None:
+        # sounddevice нужен только для аудиоустройства: без библиотеки PortAudio файл всё равно воспроизводится
+        import sounddevice as sounddev
+        samplerate = sounddev.query_devices(device, 'input')['default_samplerate']
+        callback = spectrumCallback(buffer, samplerate, low, high, gain, fftsize, hop, bands, block_duration)
+        # Захват звука с аудиоустройства
+        stream = sounddev.InputStream(device=device, channels=2, callback=callback,
+                            blocksize=captureBlockSize(samplerate, block_duration, fftsize, hop),
+                            samplerate=samplerate)
+    else:
+        source = PcmFile(filename, pcm_rate, pcm_channels)
+        samplerate = source.samplerate
+        callback = spectrumCallback(buffer, samplerate, low, high, gain, fftsize, hop, bands, block_duration)
+        stream = FileInputStream(source, callback, captureBlockSize(samplerate, block_duration, fftsize, hop),
+                                 realtime = realtime)
+
+    with stream:
+        while not isStopped() and stream.active:
+            time.sleep(0.1)
+
+
+def _soundProcessMain(bufferName, bins, slots, stopEvent, errors, params):
+    """ Точка входа дочернего процесса захвата звука """
+    print("Start Sound capture process")
+    buffer = SharedSpectrumBuffer(bins, slots, name = bufferName)
+    try:
+        captureSpectrum(buffer, stopEvent.is_set, **params)
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        errors.put(type(e).__name__ + ': ' + str(e))
+    finally:
+        buffer.close()
+    print("Stop Sound capture process")
+
+
+class SoundProcess:
+    """ Захват звука и БПФ в отдельном процессе.
+
+    Спектр передаётся в основной процесс через разделяемую память (buffer),
+    остановка - через multiprocessing.Event, ошибки - через очередь.
+    Так обработка звука не конкурирует за GIL с GUI и MIDI.
+    """
+    def __init__(self, bins = 60, slots = 4, lockstep = False, **params):
+        """ bins -- количество полос спектра
+        slots -- количество слотов в кольце
+        lockstep -- процесс захвата ждёт чтения каждого спектра (см. SpectrumBuffer)
+        params -- параметры captureSpectrum (device, block_duration, low, high, gain, filename, realtime,
+                  fftsize, hop, bands, pcm_rate, pcm_channels)
+        """
+        self.buffer = SharedSpectrumBuffer(bins, slots, lockstep = lockstep)
+        self.stopEvent = multiprocessing.Event()
+        self.errors = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target = _soundProcessMain,
+                                               args = (self.buffer.name, bins, slots,
+                                                       self.stopEvent, self.errors, params),
+                                               daemon = True)
+
+    def start(self):
+        """ Запуск процесса """
+        self.process.start()
+
+    def stop(self, timeout = 5):
+        """ Остановка процесса и освобождение разделяемой памяти.
+
+        Если процесс не завершился за timeout секунд, он принудительно завершается.
+        """
+        self.stopEvent.set()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            print("Sound capture process does not respond, terminating")
+            self.process.terminate()
+            self.process.join()
+        for e in self.takeErrors():
+            print("Sound capture process: " + e)
+        self.buffer.close()
+
+    def takeErrors(self):
+        """ Возвращает список ошибок, полученных от процесса захвата звука """
+        result = []
+        while True:
+            try:
+                result.append(self.errors.get_nowait())
+            except queue.Empty:
+                return result
+
+    def isAlive(self):
+        """ Проверка, работает ли процесс """
+        return self.process.is_alive()
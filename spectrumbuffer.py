@@ -0,0 +1,220 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Передача спектра между потоком захвата звука и GUI без блокировок
+'''
+
+import time
+
+import numpy as np
+from multiprocessing import shared_memory
+
+
+class SpectrumBuffer:
+    """ Кольцевой буфер спектров с счётчиком последовательности (seqlock).
+
+    Поток захвата звука (писатель) заполняет следующий свободный слот и только
+    после этого публикует его номер. Читатель копирует последний полностью
+    записанный слот в свой буфер без ожидания писателя. Слот остаётся неизменным,
+    пока писатель не опубликует ещё slots - 2 кадра. Если после копирования номер
+    кадра ушёл дальше, писатель мог начать перезапись слота, и копирование повторяется.
+
+    В режиме lockstep писатель публикует кадр только после того, как читатель
+    прочитал предыдущий: так файл, воспроизводимый с максимальной скоростью,
+    обрабатывается целиком, без пропусков кадров.
+    """
+    def __init__(self, bins = 60, slots = 4, lockstep = False):
+        """ bins -- количество полос спектра
+        slots -- количество слотов в кольце (не меньше 3)
+        lockstep -- писатель ждёт чтения каждого кадра
+        """
+        if slots < 3:
+            raise ValueError("SpectrumBuffer requires at least 3 slots")
+        self.bins = bins
+        self.slots = slots
+        self.spectra = np.zeros((slots, bins), dtype=np.int64)
+        self.levels = np.zeros((slots, 2), dtype=np.int64)
+        # Номер последнего опубликованного кадра. Присваивание целого числа атомарно для GIL,
+        # поэтому блокировка не нужна.
+        self.seq = 0
+        # Номер последнего кадра, прочитанного читателем (для режима lockstep)
+        self.ackSeq = 0
+        self.lockstep = lockstep
+        # Максимальное ожидание читателя в режиме lockstep, с (читатель мог остановиться)
+        self.lockstepTimeout = 1.0
+
+        # Статистика
+        self.written = 0    # записано кадров
+        self.read = 0       # прочитано новых кадров
+        self.dropped = 0    # кадры, которые читатель пропустил
+        self.repeated = 0   # повторные чтения одного и того же кадра
+        self.retries = 0    # повторные копирования из-за перезаписи слота писателем
+        self.lastReadSeq = 0
+        self.initReader()
+
+    def initReader(self):
+        """ Буфер читателя для копии последнего спектра и его представление только для чтения """
+        self.readSpectrum = np.zeros(self.bins, dtype=np.int64)
+        self.readView = self.readSpectrum.view()
+        self.readView.flags.writeable = False
+
+    def nextSlot(self):
+        """ Писатель: возвращает массив следующего слота для заполнения спектром.
+
+        После заполнения необходимо вызвать publish().
+        """
+        return self.spectra[(self.seq + 1) % self.slots]
+
+    def publish(self, leftLevel, rightLevel):
+        """ Писатель: публикует заполненный слот вместе с пиковыми уровнями каналов """
+        if self.lockstep:
+            self.waitReader()
+        index = (self.seq + 1) % self.slots
+        self.levels[index, 0] = leftLevel
+        self.levels[index, 1] = rightLevel
+        self.written += 1
+        self.seq += 1
+
+    def waitReader(self):
+        """ Писатель: ожидание, пока читатель прочитает последний опубликованный кадр """
+        seq = self.seq
+        deadline = None
+        while self.ackSeq < seq:
+            now = time.perf_counter()
+            if deadline is None:
+                deadline = now + self.lockstepTimeout
+            elif now > deadline:
+                return
+            time.sleep(0.0002)
+
+    def write(self, spectrum, leftLevel, rightLevel):
+        """ Писатель: копирует готовый спектр в следующий слот и публикует его """
+        np.copyto(self.nextSlot(), spectrum, casting='unsafe')
+        self.publish(leftLevel, rightLevel)
+
+    def readLatest(self):
+        """ Читатель: возвращает кортеж (спектр, левый уровень, правый уровень) последнего кадра.
+
+        Спектр копируется в буфер читателя и возвращается как представление только для
+        чтения. Следующий вызов readLatest перезаписывает его.
+        """
+        while True:
+            seq = self.seq
+            index = seq % self.slots
+            np.copyto(self.readSpectrum, self.spectra[index])
+            left = int(self.levels[index, 0])
+            right = int(self.levels[index, 1])
+            # Слот кадра seq писатель заполняет заново после публикации кадра seq + slots - 1
+            if self.seq - seq <= self.slots - 2:
+                break
+            self.retries += 1
+
+        delta = seq - self.lastReadSeq
+        if delta == 0:
+            self.repeated += 1
+        else:
+            self.read += 1
+            self.dropped += delta - 1
+        self.lastReadSeq = seq
+        self.ackSeq = seq
+        return (self.readView, left, right)
+
+    def stats(self):
+        """ Статистика работы буфера в виде словаря """
+        return {
+            "written": self.written,
+            "read": self.read,
+            "dropped": self.dropped,
+            "repeated": self.repeated,
+            "retries": self.retries
+        }
+
+
+class SharedSpectrumBuffer(SpectrumBuffer):
+    """ Кольцевой буфер спектров в разделяемой памяти для обмена между процессами.
+
+    Создающий процесс вызывает конструктор без name, остальные процессы
+    подключаются к буферу по его имени (атрибут name).
+    Номер кадра, счётчик записей, номер прочитанного кадра и режим lockstep
+    хранятся в заголовке разделяемой памяти.
+    """
+    def __init__(self, bins = 60, slots = 4, name = None, lockstep = False):
+        """ bins -- количество полос спектра
+        slots -- количество слотов в кольце (не меньше 3)
+        name -- имя существующего буфера, None - создать новый
+        lockstep -- писатель ждёт чтения каждого кадра (задаёт создатель буфера)
+        """
+        if slots < 3:
+            raise ValueError("SpectrumBuffer requires at least 3 slots")
+        self.bins = bins
+        self.slots = slots
+        self.owner = name is None
+        self.lockstepTimeout = 1.0
+
+        # Заголовок (seq, written, ackSeq, lockstep), спектры, уровни каналов
+        count = 4 + slots * bins + slots * 2
+        self.shm = shared_memory.SharedMemory(name = name, create = self.owner, size = count * 8)
+        self.name = self.shm.name
+        mem = np.ndarray((count,), dtype=np.int64, buffer=self.shm.buf)
+        if self.owner:
+            mem[:] = 0
+        self.header = mem[0:4]
+        if self.owner:
+            self.lockstep = lockstep
+        self.spectra = mem[4:4 + slots * bins].reshape(slots, bins)
+        self.levels = mem[4 + slots * bins:].reshape(slots, 2)
+
+        # Статистика читателя
+        self.read = 0
+        self.dropped = 0
+        self.repeated = 0
+        self.retries = 0
+        self.lastReadSeq = self.seq
+        self.initReader()
+
+    @property
+    def seq(self):
+        return int(self.header[0])
+
+    @seq.setter
+    def seq(self, value):
+        self.header[0] = value
+
+    @property
+    def written(self):
+        return int(self.header[1])
+
+    @written.setter
+    def written(self, value):
+        self.header[1] = value
+
+    @property
+    def lockstep(self):
+        return bool(self.header[3])
+
+    @lockstep.setter
+    def lockstep(self, value):
+        self.header[3] = 1 if value else 0
+
+    @property
+    def ackSeq(self):
+        return int(self.header[2])
+
+    @ackSeq.setter
+    def ackSeq(self, value):
+        self.header[2] = value
+
+    def close(self):
+        """ Отключение от разделяемой памяти. Создатель буфера также удаляет её. """
+        if self.shm is None:
+            return
+        self.header = self.spectra = self.levels = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # На слоты ещё ссылается читатель, память освободится при выходе из процесса
+            pass
+        if self.owner:
+            self.shm.unlink()
+        self.shm = None
@@ -0,0 +1,102 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Автоматическая регулировка усиления на записанных спектрах
+'''
+
+import math
+import wave
+
+import numpy as np
+import pytest
+
+from dsp import SlidingMax, PeakHistogram, AutoGainControl
+from filestream import PcmFile, FileInputStream
+from soundcapture import spectrumCallback
+from spectrumbuffer import SpectrumBuffer
+
+
+@pytest.fixture(scope="module")
+def peaks(tmp_path_factory):
+    """ Пиковые уровни спектров записи: удары с шумом, громкая вставка и длинное затухание """
+    samplerate = 44100
+    rng = np.random.RandomState(17)
+    t = np.arange(12 * samplerate) / samplerate
+    x = 0.2 * np.sin(2 * np.pi * 110 * t) * (np.mod(t, 0.5) < 0.15)
+    x += 0.05 * rng.standard_normal(len(t))
+    x[(t > 3) & (t < 4)] *= 4
+    # Затухание за последние 6 секунд
+    x *= np.where(t > 6, np.exp(-(t - 6)), 1.0)
+    path = tmp_path_factory.mktemp("agc") / "record.wav"
+    with wave.open(str(path), 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(samplerate)
+        w.writeframes((np.clip(x, -1, 1) * 32000).astype('<i2').tobytes())
+
+    buffer = SpectrumBuffer(60)
+    callback = spectrumCallback(buffer, samplerate)
+    result = []
+
+    def record(indata, frames, time, status):
+        callback(indata, frames, time, status)
+        result.append(float(buffer.readLatest()[0].max()))
+
+    FileInputStream(PcmFile(str(path)), record, samplerate // 50, realtime = False).run()
+    return result
+
+
+def windowMax(values, size):
+    return [max(values[max(0, i - size + 1):i + 1]) for i in range(0, len(values))]
+
+
+@pytest.mark.parametrize("size", (1, 3, 50, 750))
+def test_sliding_max_recorded(peaks, size):
+    window = SlidingMax(size)
+    assert [window.add(v) for v in peaks] == windowMax(peaks, size)
+
+
+@pytest.mark.parametrize("values", ([10, 9, 8, 7, 6], list(range(1000, 0, -1)), [5, 5, 5, 5, 5, 4, 6, 1]))
+def test_sliding_max_fade(values):
+    window = SlidingMax(3)
+    assert [window.add(v) for v in values] == windowMax(values, 3)
+
+
+def test_sliding_max_reset(peaks):
+    window = SlidingMax(50)
+    for v in peaks[0:100]:
+        window.add(v)
+    window.reset()
+    assert [window.add(v) for v in peaks[100:200]] == windowMax(peaks[100:200], 50)
+
+
+def test_peak_histogram_recorded(peaks):
+    size = 250
+    histogram = PeakHistogram(size)
+    step = 10 ** (1 / histogram.steps)
+    for i, v in enumerate(peaks):
+        histogram.add(v)
+        window = np.array(peaks[max(0, i - size + 1):i + 1])
+        expected = max(np.sort(window)[int(math.ceil(len(window) * 0.95)) - 1], 1)
+        # Ответ - верхняя граница столбца, в который попало значение процентиля
+        assert expected <= histogram.percentile(95) * 1.000001
+        assert histogram.percentile(95) <= max(expected, 1) * step * 1.000001
+
+
+def test_agc_recorded(peaks):
+    rate = 50
+    agc = AutoGainControl(rate, window = 2, attack = 0.05, release = 1.0)
+    attack = math.exp(-1 / (0.05 * rate))
+    release = math.exp(-1 / (1.0 * rate))
+    gain = None
+    for reference, v in zip(windowMax(peaks, 2 * rate), peaks):
+        desired = agc.target / max(reference, 1)
+        if gain is None:
+            gain = desired
+        else:
+            coef = attack if desired < gain else release
+            gain = desired + coef * (gain - desired)
+        assert agc.process(v) == pytest.approx(gain)
+    # При затухании окно забывает громкую вставку и усиление растёт
+    assert gain > agc.target / max(peaks)
@@ -0,0 +1,47 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Обнаружение атак на ровном звуке с растеканием спектра и на шуме
+'''
+
+import numpy as np
+
+from beat import OnsetDetector
+
+# Уровни полос лампы Y на ровном басе 60 Гц при БПФ по блокам 20 мс: 1.2 периода на блок,
+# картина растекания повторяется через 5 блоков
+LEAKAGE = np.array([[3390, 3960, 3941, 2206], [5411, 2206, 5041, 3312], [607, 4850, 3049, 1018],
+                    [5457, 2176, 5133, 3300], [3433, 3999, 3946, 2192]])
+
+
+def detect(frames, kicks, rate = 50, k = 1.375):
+    """ Количество лишних и пропущенных атак по номерам кадров с ударами kicks.
+
+    Первый кадр - начало звука после тишины, он не учитывается.
+    """
+    detector = OnsetDetector([(0, 4)], 4, rate)
+    onsets = [i for i, spectrum in enumerate(frames) if detector.process(spectrum, i / rate, k)[0]]
+    return len(set(onsets) - set(kicks) - {0}), len(set(kicks) - set(onsets))
+
+
+def test_periodic_leakage_is_not_an_onset():
+    frames = [LEAKAGE[i % 5] for i in range(0, 500)]
+    # Удары каждые полсекунды поверх баса
+    kicks = range(100, 500, 25)
+    for i in kicks:
+        frames[i] = LEAKAGE[i % 5] + 5000
+    assert detect(frames, kicks) == (0, 0)
+
+
+def test_noise_is_not_an_onset():
+    rng = np.random.RandomState(0)
+    # Шум уровня 20-100 с ударами раз в секунду, кадры 5 мс
+    frames = list(np.abs(rng.normal(0, 50, (2000, 4))))
+    kicks = range(400, 2000, 200)
+    for i in kicks:
+        frames[i] = frames[i] + 5000
+    # До сравнения с максимумом за refractory: больше 50 лишних атак за 10 с
+    false, missed = detect(frames, kicks, rate = 200)
+    assert false <= 1
+    assert missed <= 1
@@ -0,0 +1,120 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Сравнение табличных режимов работы с исходными методами processModeN
+'''
+
+import numpy as np
+import pytest
+
+from effects import EffectEngine, RED, GREEN, BLUE
+
+
+def _decay(leds, indices):
+    for i in indices:
+        for c in (RED, GREEN, BLUE):
+            leds[i][c] = max(leds[i][c] - 50, 0)
+
+
+def _mirror(leds):
+    for i in range(0, 5):
+        leds[9 - i] = list(leds[i])
+
+
+def legacyMode1(spectrum, leds):
+    ch = [max(spectrum[0:2]), max(spectrum[2:4]), max(spectrum[4:8]), max(spectrum[8:14]), max(spectrum[14:30])]
+    _decay(leds, range(0, 5))
+    for i in range(0, 5):
+        if ch[i] > 900:
+            leds[i][RED] = 255
+        elif ch[i] > 800:
+            leds[i][GREEN] = 255
+        elif ch[i] > 650:
+            leds[i][BLUE] = 255
+    _mirror(leds)
+
+
+def _groups(spectrum):
+    return [max(spectrum[0:5]), max(spectrum[5:23]), max(spectrum[23:60])]
+
+
+def _legacyFlash(groups):
+    """ Режимы 2-4: затухание всех светодиодов и вспышка групп светодиодов по каналам """
+    def process(spectrum, leds):
+        ch = _groups(spectrum)
+        _decay(leds, range(0, 10))
+        for c, indices in zip((RED, GREEN, BLUE), groups):
+            if ch[c] > 750:
+                for i in indices:
+                    leds[i][c] = 255
+    return process
+
+
+legacyMode2 = _legacyFlash(([0, 1, 2, 3], [3, 4, 5, 6], [6, 7, 8, 9]))
+legacyMode3 = _legacyFlash(([0, 3, 6, 9], [1, 4, 5, 8], [2, 4, 5, 7]))
+legacyMode4 = _legacyFlash((range(0, 10), range(0, 10), range(0, 10)))
+
+
+def legacyMode5(spectrum, leds):
+    ch = _groups(spectrum)
+    for i in range(0, 4):
+        leds[i] = list(leds[i + 1])
+    _decay(leds, range(4, 6))
+    for c in (RED, GREEN, BLUE):
+        if ch[c] > 750:
+            leds[4][c] = 255
+    _mirror(leds)
+
+
+def legacyMode6(spectrum, leds):
+    for i in range(0, 10):
+        ch = max(spectrum[i * 3:i * 3 + 3])
+        leds[i] = [0, 0, 0]
+        v = min(round(ch / 3), 255)
+        if ch > 800:
+            leds[i][RED] = v
+        elif ch > 600:
+            leds[i][BLUE] = v
+        else:
+            leds[i][GREEN] = v
+
+
+def legacyMode7(spectrum, leds):
+    ch = [min(round(c ** 4 / 1000000000 / 3), 255) for c in _groups(spectrum)]
+    for c, indices in zip((RED, GREEN, BLUE), ([0, 1, 2, 3], [3, 4, 5, 6], [6, 7, 8, 9])):
+        for i in indices:
+            leds[i][c] = ch[c]
+
+
+LEGACY_MODES = {1: legacyMode1, 2: legacyMode2, 3: legacyMode3, 4: legacyMode4,
+                5: legacyMode5, 6: legacyMode6, 7: legacyMode7}
+
+
+def randomSpectra(seed, count = 3000):
+    """ Спектры с паузами: примерно половина кадров тихие, остальные - случайные уровни до 1200 """
+    rng = np.random.RandomState(seed)
+    spectra = rng.randint(0, 1200, size=(count, 60))
+    spectra[rng.rand(count) < 0.5] //= 20
+    return spectra
+
+
+@pytest.mark.parametrize("mode", sorted(LEGACY_MODES))
+def test_mode_matches_legacy(mode):
+    engine = EffectEngine()
+    leds = [[0, 0, 0] for i in range(0, 10)]
+    for n, spectrum in enumerate(randomSpectra(mode)):
+        LEGACY_MODES[mode](spectrum.tolist(), leds)
+        result = engine.process(mode, spectrum)
+        assert result.tolist() == leds, "mode %d, frame %d" % (mode, n)
+
+
+@pytest.mark.parametrize("mode", (1, 5))
+def test_mirror_decays_after_silence(mode):
+    engine = EffectEngine()
+    spectrum = np.zeros(60)
+    spectrum[0] = 1000
+    engine.process(mode, spectrum)
+    for i in range(0, 50):
+        engine.process(mode, np.zeros(60))
+    assert not engine.leds.any()
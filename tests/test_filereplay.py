@@ -0,0 +1,137 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Воспроизведение файла через обработчик цветомузыки
+'''
+
+import time
+import wave
+
+import numpy as np
+import pytest
+
+from engine import ColormusicEngine
+from filestream import PcmFile, FileInputStream
+
+
+def writeWav(path, seconds = 2, samplerate = 44100):
+    """ Моно WAV: тон 220 Гц, включающийся на 0.1 с каждые полсекунды """
+    t = np.arange(int(seconds * samplerate)) / samplerate
+    x = 0.3 * np.sin(2 * np.pi * 220 * t) * (np.mod(t, 0.5) < 0.1)
+    with wave.open(str(path), 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(samplerate)
+        w.writeframes((x * 32000).astype('<i2').tobytes())
+
+
+def replay(path, use_multiprocessing, **params):
+    settings = {"udp": [], "hid": [], "mode": 1, "sensitivityRYG": [100, 100, 100]}
+    engine = ColormusicEngine(settings)
+    ticks = []
+    tick = engine.tick
+    engine.tick = lambda: (ticks.append(engine.buffer.seq), tick())
+    engine.startCapture(use_multiprocessing, filename = str(path), realtime = False, **params)
+    engine.start()
+    deadline = time.monotonic() + 30
+    while engine.isCapturing() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    # Последний спектр ещё может обрабатываться
+    time.sleep(0.1)
+    stats = engine.buffer.stats()
+    engine.stop()
+    return stats, ticks
+
+
+@pytest.mark.parametrize("use_multiprocessing", (False, True))
+def test_fullspeed_ticks_every_spectrum(tmp_path, use_multiprocessing):
+    path = tmp_path / "tone.wav"
+    writeWav(path)
+    stats, ticks = replay(path, use_multiprocessing)
+    # 2 с блоками по 20 мс
+    assert stats["written"] == 100
+    assert stats["read"] == 100
+    assert stats["dropped"] == 0
+    assert ticks == list(range(1, 101))
+
+
+def test_capture_process_errors_are_polled(tmp_path):
+    settings = {"udp": [], "hid": [], "mode": 1, "sensitivityRYG": [100, 100, 100]}
+    engine = ColormusicEngine(settings)
+    engine.startCapture(True, filename = str(tmp_path / "missing.wav"), realtime = False)
+    errors = []
+    deadline = time.monotonic() + 10
+    while not errors and time.monotonic() < deadline:
+        errors = engine.checkCapture()
+        time.sleep(0.05)
+    # Ошибка видна до остановки обработчика
+    assert len(errors) == 1
+    assert "missing.wav" in errors[0]
+    assert engine.checkCapture() == []
+    engine.stop()
+
+
+def test_fullspeed_onsets_use_audio_time(tmp_path):
+    path = tmp_path / "tone.wav"
+    writeWav(path, seconds = 4)
+    settings = {"udp": [], "hid": [], "mode": 1, "sensitivityRYG": [100, 100, 100]}
+    engine = ColormusicEngine(settings)
+    engine.startCapture(False, filename = str(path), realtime = False)
+    times = []
+    process = engine.beat.process
+
+    def recordBeat(spectrum, now, k):
+        result = process(spectrum, now, k)
+        if result[0].any():
+            times.append(now)
+        return result
+
+    engine.beat.process = recordBeat
+    engine.start()
+    deadline = time.monotonic() + 30
+    while engine.isCapturing() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    time.sleep(0.1)
+    engine.stop()
+    # Файл воспроизводится быстрее реального времени, но атаки привязаны к началу тона
+    # каждые 0.5 с звука (с задержкой не больше трёх блоков по 20 мс)
+    times = np.array(times)
+    assert len(times) >= 6
+    assert np.all(np.mod(times, 0.5) <= 0.06)
+    assert times.max() <= 4.0
+
+
+def test_callback_error_ends_stream(tmp_path):
+    path = tmp_path / "tone.wav"
+    writeWav(path, seconds = 0.5)
+
+    def callback(indata, frames, time, status):
+        raise ValueError("callback")
+
+    stream = FileInputStream(PcmFile(str(path)), callback, 882, realtime = False)
+    with pytest.raises(ValueError):
+        stream.run()
+    # Цикл ожидания в captureSpectrum и --headless завершается
+    assert not stream.active
+    assert stream.elapsed > 0
+    stream.close()
+
+
+def test_raw_pcm_format(tmp_path):
+    path = tmp_path / "tone.raw"
+    # 0.5 с моно 22050 Гц
+    path.write_bytes(np.full(11025, 16384, dtype='<i2').tobytes())
+    settings = {"udp": [], "hid": [], "mode": 1, "sensitivityRYG": [100, 100, 100]}
+    engine = ColormusicEngine(settings)
+    engine.startCapture(False, filename = str(path), realtime = False, pcm_rate = 22050, pcm_channels = 1)
+    assert engine.fileSpectrumRate == pytest.approx(50, abs=0.1)
+    engine.start()
+    deadline = time.monotonic() + 30
+    while engine.isCapturing() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    time.sleep(0.1)
+    stats = engine.buffer.stats()
+    engine.stop()
+    # 0.5 с блоками по 20 мс (441 кадр)
+    assert stats["written"] == 25
@@ -0,0 +1,74 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Яркость ламп RYGB: дежурный канал и защита от превышения тока
+'''
+
+import numpy as np
+import pytest
+
+from engine import ColormusicEngine, LAMP_BANDS
+
+
+def lampEngine(rate = 50):
+    settings = {"udp": [], "hid": [], "mode": 1, "sensitivityRYG": [100, 100, 100]}
+    return ColormusicEngine(settings, rate = rate)
+
+
+def lampSpectrum(r, y, g):
+    """ Спектр с уровнями r, y, g в полосах ламп R, Y, G """
+    spectrum = np.zeros(60)
+    for i, level in enumerate((r, y, g)):
+        spectrum[LAMP_BANDS[i]:LAMP_BANDS[i + 1]] = level
+    return spectrum
+
+
+def run(engine, spectra, onsets = None):
+    """ Яркости ламп (кадры x 4) для последовательности спектров и флагов атак """
+    result = []
+    for i, spectrum in enumerate(spectra):
+        engine.spectrum = spectrum
+        if onsets is not None:
+            engine.onsets[:] = onsets[i]
+        engine.processRGBY()
+        result.append(engine.lampBytes.copy())
+    return np.array(result)
+
+
+def checkRules(lamps):
+    """ Синяя лампа горит полностью ровно тогда, когда R, Y и G выключены в том же кадре """
+    on = lamps[:, 0:3] >= 128
+    assert np.all(lamps[on.any(axis=1), 3] == 0)
+    assert np.all(lamps[~on.any(axis=1), 3] == 255)
+    # Все четыре лампы одновременно не включены (подсветка ниже порога допускается)
+    assert not np.any(np.all(lamps >= 128, axis=1))
+
+
+def test_standby_same_frame():
+    engine = lampEngine()
+    loud = lampSpectrum(1000, 0, 0)
+    quiet = lampSpectrum(0, 0, 0)
+    lamps = run(engine, [quiet] * 3 + [loud] * 5 + [quiet] * 20)
+    checkRules(lamps)
+    # В кадре, где R погасла ниже порога, синяя уже горит
+    off = np.flatnonzero(lamps[:, 0] < 128)
+    first = off[off > 3][0]
+    assert lamps[first, 3] == 255
+    assert lamps[first - 1, 3] == 0
+
+
+@pytest.mark.parametrize("rate", (50, 200))
+@pytest.mark.parametrize("beat", (False, True))
+def test_overcurrent_random(rate, beat):
+    engine = lampEngine(rate)
+    engine.beatRGBY = beat
+    rng = np.random.RandomState(1)
+    # Тишина с редкими громкими кадрами и атаками в разных полосах
+    levels = rng.choice([0, 100, 300, 1000], (2000, 3), p = [0.9, 0.04, 0.03, 0.03])
+    spectra = [lampSpectrum(*frame) for frame in levels]
+    lamps = run(engine, spectra, rng.rand(2000, 3) < 0.02 if beat else None)
+    checkRules(lamps)
+    # Проверка не пустая: были кадры и с синей лампой, и с включенными R, Y, G
+    assert (lamps[:, 3] == 255).any()
+    assert (lamps[:, 0:3] >= 128).any()
@@ -0,0 +1,201 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Приём MIDI сообщений в потоке GUI и кадровый буфер Launchpad
+'''
+
+import copy
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+# Без экрана Qt рисует в память
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+pygame = pytest.importorskip("pygame")
+QtWidgets = pytest.importorskip("PyQt5.QtWidgets")
+
+from main import settings as defaultSettings
+from engine import ColormusicEngine
+from gui import ColormusicApp
+from midi import MidiDevice, LaunchpadFrameBuffer, MIDI_KNOB, MIDI_LED_BUTTON
+from midi import LPC_RED, LPC_GREEN, LPC_ORANGE, LPC_COLOR_MASK
+
+
+class FakeInput:
+    """ Устройство ввода MIDI: сообщения messages по одному в миллисекунду (1000 сообщений/с).
+
+    Метка времени сообщения - момент его появления по часам PortMidi, как у pygame.midi.Input.
+    """
+    def __init__(self, messages):
+        self.messages = messages
+        self.start = pygame.midi.time()
+        self.next = 0
+
+    def due(self):
+        """ Количество сообщений, которые уже должны были прийти """
+        return min(len(self.messages), pygame.midi.time() - self.start)
+
+    def poll(self):
+        return self.next < self.due()
+
+    def read(self, count):
+        end = min(self.next + count, self.due())
+        events = [[list(self.messages[i]) + [0], self.start + i] for i in range(self.next, end)]
+        self.next = end
+        return events
+
+    def finished(self):
+        return self.next == len(self.messages)
+
+
+class FakeOutput:
+    """ Устройство вывода MIDI: запоминает все сообщения (msg, key, velocity) по порядку """
+    def __init__(self):
+        self.messages = []
+
+    def write_short(self, msg, key, velocity):
+        self.messages.append((msg, key, velocity))
+
+    def write(self, events):
+        self.messages += [tuple(event[0]) for event in events]
+
+    def take(self):
+        """ Сообщения, отправленные с прошлого вызова """
+        result = self.messages
+        self.messages = []
+        return result
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(scope = "module")
+def app():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+@pytest.fixture
+def window(app):
+    settings = copy.deepcopy(defaultSettings)
+    settings["udp"] = []
+    engine = ColormusicEngine(settings)
+    window = ColormusicApp(engine, settings)
+    # Сообщения MIDI разбираются только из теста
+    window.timer.stop()
+    window.paintTimer.stop()
+    yield window
+    window.closeRes()
+    engine.closeUDP()
+
+
+def knobSweep(count):
+    """ Вращение трёх энкодеров X-TOUCH MINI по очереди и нажатие кнопки на каждом 100-м сообщении """
+    messages = []
+    for i in range(0, count):
+        if i % 100 == 99:
+            messages.append((MIDI_LED_BUTTON, 8, 127))
+        else:
+            messages.append((MIDI_KNOB, 1 + i % 3, (i // 3) % 128))
+    return messages
+
+
+def test_burst_is_coalesced_in_gui_thread(window):
+    messages = knobSweep(1000)
+    source = FakeInput(messages)
+    reader = MidiDevice.MidiInputThread(None, window.midiCallback)
+    thread = threading.Thread(target = reader.pollInput, args = (source, window.midiCallback))
+    handled = []
+    handleMidi = window.handleMidi
+
+    def recordHandle(message):
+        handled.append((threading.current_thread(), message))
+        handleMidi(message)
+
+    window.handleMidi = recordHandle
+    thread.start()
+    # Такты таймера окна (20 мс) до конца серии
+    ticks = 0
+    while not source.finished() or window.midiQueue:
+        time.sleep(0.02)
+        window.processMidi()
+        ticks += 1
+    reader.stopped = True
+    thread.join()
+
+    # Все сообщения приняты, обрабатываются только в потоке GUI
+    assert reader.stats()["received"] == 1000
+    assert window.midiHandled == 1000 - reader.stats()["coalesced"]
+    assert all(t is threading.main_thread() for t, message in handled)
+    # Нажатия кнопок не объединяются, серии CC - до одного сообщения на энкодер за такт
+    buttons = [m for t, m in handled if m[0] == MIDI_LED_BUTTON]
+    knobs = [m for t, m in handled if m[0] == MIDI_KNOB]
+    assert len(buttons) == 10
+    assert len(knobs) <= 3 * ticks
+    assert len(knobs) < 1000 / 4
+    # Энкодеры остановились на последних значениях серии
+    last = {m[1]: m[2] for m in messages if m[0] == MIDI_KNOB}
+    assert (window.sensR.value(), window.sensY.value(), window.sensG.value()) == (last[1], last[2], last[3])
+    # Задержка: от метки PortMidi до очереди - не больше опроса, от очереди до обработки - не больше такта
+    assert reader.stats()["maxLatency"] <= 20
+    assert window.midiLatencyMax <= 0.06
+
+
+@pytest.fixture
+def launchpad():
+    midi = MidiDevice()
+    # Поток ввода без устройства сразу завершается
+    midi.startInput(device_id = -1)
+    midi.devOut = FakeOutput()
+    yield midi
+    del midi
+
+
+def test_launchpad_frame_updates(launchpad):
+    out = launchpad.devOut
+    frame = LaunchpadFrameBuffer(launchpad)
+    # Сброс и двойная буферизация: запись в страницу 1, видна страница 0
+    assert out.take() == [(0xB0, 0, 0), (0xB0, 0, 0x31)]
+    SWAP_TO_1 = (0xB0, 0, 0x34)
+    SWAP_TO_0 = (0xB0, 0, 0x31)
+
+    # Пустой кадр уже на ланчпаде: ни сообщений, ни обмена страниц
+    assert frame.show() == 0
+    assert out.take() == []
+
+    # Частичное изменение: по сообщению на светодиод сетки и верхнего ряда, затем обмен страниц
+    frame.grid[2, 3] = LPC_RED[3]
+    frame.grid[7, 8] = LPC_ORANGE[3]
+    frame.top[5] = LPC_GREEN[3]
+    assert frame.show() == 4
+    assert out.take() == [(0x90, 16 * 2 + 3, LPC_RED[3] & LPC_COLOR_MASK),
+                          (0x90, 16 * 7 + 8, LPC_ORANGE[3] & LPC_COLOR_MASK),
+                          (0xB0, 0x68 + 5, LPC_GREEN[3] & LPC_COLOR_MASK),
+                          SWAP_TO_1]
+
+    # Тот же кадр повторно не отправляется и страницы не меняются
+    assert frame.show() == 0
+    assert out.take() == []
+
+    # Полное изменение: 40 сообщений быстрого обновления по два светодиода, затем обмен обратно
+    frame.drawLevels([1000, 900, 700, 500, 300, 100, 0, 1000])
+    frame.grid[:, 8] = LPC_GREEN[2]
+    frame.top[:] = LPC_RED[1]
+    assert frame.show() == 41
+    sent = out.take()
+    colors = np.concatenate((frame.grid[:, 0:8].ravel(), frame.grid[:, 8], frame.top)) & LPC_COLOR_MASK
+    assert sent[0:40] == [(0x92, int(a), int(b)) for a, b in zip(colors[0::2], colors[1::2])]
+    assert sent[40] == SWAP_TO_0
+
+    # После обмена снова пишется страница 1
+    frame.top[0] = LPC_GREEN[3]
+    assert frame.show() == 2
+    assert out.take() == [(0xB0, 0x68, LPC_GREEN[3] & LPC_COLOR_MASK), SWAP_TO_1]
+    assert frame.stats() == {"frames": 3, "messages": 47}
+
+    frame.close()
+    assert out.take() == [(0xB0, 0, 0x30), (0xB0, 0, 0)]
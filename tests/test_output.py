@@ -0,0 +1,206 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Потоки отправки на устройства: ограничение частоты, независимость устройств, карты каналов
+'''
+
+import time
+import socket
+
+import numpy as np
+import pytest
+
+from engine import ColormusicEngine
+from output import DeviceOutput, OutputRegistry, HidOutput, UdpOutput, HID_REPORT_SIZE
+from protocol import decodeFrame
+
+
+class FakeReport:
+    """ Выходной отчёт USB HID: запоминает время и содержимое отправленных кадров """
+    def __init__(self, delay = 0.0):
+        """ delay -- время отправки одного кадра, с """
+        self.delay = delay
+        self.data = None
+        self.sent = []
+
+    def set_raw_data(self, data):
+        self.data = bytes(data)
+
+    def send(self):
+        if self.delay:
+            time.sleep(self.delay)
+        self.sent.append((time.monotonic(), self.data))
+
+
+def hidFrame(value):
+    """ Отчёт USB HID, у которого все каналы равны value """
+    return bytes([0]) + bytes([value & 0xFF]) * (HID_REPORT_SIZE - 1)
+
+
+def submitFrames(submit, rate, seconds):
+    """ Разные кадры с частотой rate в течение seconds. Возвращает последний кадр. """
+    count = int(rate * seconds)
+    frame = None
+    for i in range(0, count):
+        frame = hidFrame(i)
+        submit(frame)
+        time.sleep(1 / rate)
+    return frame
+
+
+def waitFor(condition, timeout = 1.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+@pytest.fixture
+def listener():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.settimeout(0.5)
+    yield sock
+    sock.close()
+
+
+def test_max_rate_throttling():
+    report = FakeReport()
+    dev = DeviceOutput("hid0", "hid", HidOutput(report).send, maxRate = 50)
+    dev.start()
+    start = time.monotonic()
+    last = submitFrames(dev.submit, 500, 0.5)
+    duration = time.monotonic() - start
+    assert waitFor(lambda: report.sent[-1][1] == last)
+    dev.stop()
+
+    times = np.array([t for t, data in report.sent])
+    # Не чаще 50 Гц, но и не реже: кадры приходили в 10 раз чаще
+    assert len(times) <= duration * 50 + 2
+    assert len(times) >= duration * 50 * 0.7
+    assert np.diff(times).min() >= 0.019
+    assert dev.limited > 0
+    assert dev.overwrites > 0
+
+
+def test_slow_device_does_not_delay_others(listener):
+    slow = FakeReport(delay = 0.05)
+    fast = FakeReport()
+    registry = OutputRegistry()
+    registry.addDevice("hid0", "hid", HidOutput(slow).send)
+    registry.addDevice("hid1", "hid", HidOutput(fast).send)
+    udp = UdpOutput(*listener.getsockname())
+    registry.addDevice("udp0", "udp", udp.send)
+    registry.start()
+
+    def submit(frame):
+        registry.submitGroup("hid", frame)
+        registry.submitGroup("udp", frame[1:5])
+
+    last = submitFrames(submit, 200, 0.5)
+    assert waitFor(lambda: fast.sent[-1][1] == last)
+    fastCount = len(fast.sent)
+    assert waitFor(lambda: slow.sent[-1][1] == last)
+    registry.stop()
+    udp.close()
+
+    received = []
+    try:
+        while True:
+            received.append(listener.recv(1500))
+    except socket.timeout:
+        pass
+    # Быстрые устройства получили почти все кадры, медленное - каждый ~10-й, но последний кадр - все
+    assert fastCount >= 80
+    assert len(received) >= 80
+    assert received[-1] == last[1:5]
+    assert len(slow.sent) <= 15
+    assert registry.stats()["hid0"]["overwrites"] > 0
+    assert registry.stats()["hid1"]["overwrites"] < registry.stats()["hid0"]["overwrites"]
+
+
+def test_channel_maps(monkeypatch, listener):
+    reports = [FakeReport(), FakeReport()]
+    monkeypatch.setattr(ColormusicEngine, "openHID", lambda self, vid, pid: [HidOutput(r) for r in reports])
+    ip, port = listener.getsockname()
+    settings = {
+        "udp": [{"ip": ip, "port": port, "channels": [3, 0]},
+                {"ip": ip, "port": port, "channels": [2, 1, 0], "protocol": "binary"}],
+        "hid": [{"channels": [9, 8]}, {}],
+        "mode": 1,
+        "sensitivityRYG": [100, 100, 100]
+    }
+    engine = ColormusicEngine(settings)
+    engine.output.start()
+    engine.leds[:] = np.arange(30).reshape(10, 3)
+    engine.lampBytes[:] = (255, 0, 100, 200)
+    engine.chanRYGB = [True, False, False, True]
+    engine.writeHID()
+    engine.sendUDP()
+    assert waitFor(lambda: all(len(r.sent) for r in reports))
+    received = sorted([listener.recv(1500) for i in range(0, 2)], key = len)
+    engine.output.stop()
+    engine.closeUDP()
+
+    # HID 0: светодиоды 9 и 8 обработчика, остальные выключены
+    assert reports[0].sent[0][1] == bytes([0, 27, 28, 29, 24, 25, 26]) + bytes(HID_REPORT_SIZE - 7)
+    # HID 1 без карты: все 10 светодиодов как есть
+    assert reports[1].sent[0][1] == bytes([0]) + bytes(range(30))
+    # UDP 0: лампы B и R в старом формате
+    assert received[0] == b"11"
+    # UDP 1: яркости G, Y, R в двоичном кадре
+    assert decodeFrame(received[1])[2] == [100, 0, 255]
+
+
+def udpEngine(udp):
+    settings = {"udp": udp, "hid": [], "mode": 1, "sensitivityRYG": [100, 100, 100]}
+    engine = ColormusicEngine(settings)
+    engine.output.start()
+    return engine
+
+
+def test_udp_address_change_reuses_device(listener):
+    other = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    other.bind(("127.0.0.1", 0))
+    other.settimeout(0.5)
+    ip, port = listener.getsockname()
+    engine = udpEngine({"ip": ip, "port": port})
+    dev = engine.output.group("udp")[0]
+    udp = engine.udp[0]
+    assert not engine.updateUDP()
+
+    engine.settings["udp"] = {"ip": ip, "port": other.getsockname()[1]}
+    assert engine.updateUDP()
+    # Поток отправки тот же, пересоздан только сокет
+    assert engine.output.group("udp") == [dev]
+    assert engine.udp == [udp]
+    engine.chanRYGB = [True, False, False, False]
+    engine.sendUDP()
+    assert other.recv(1500) == b"1000"
+    engine.output.stop()
+    engine.closeUDP()
+    other.close()
+
+
+def test_udp_settings_change_rebuilds_devices(listener):
+    ip, port = listener.getsockname()
+    engine = udpEngine({"ip": ip, "port": port})
+    old = engine.output.group("udp")[0]
+
+    engine.settings["udp"] = [{"ip": ip, "port": port, "channels": [3]},
+                              {"ip": ip, "port": port, "protocol": "binary"}]
+    assert engine.updateUDP()
+    devices = engine.output.group("udp")
+    assert len(devices) == 2
+    assert not old.is_alive()
+    assert all(dev.is_alive() for dev in devices)
+    assert [dev for dev in engine.output.devices if dev.group == "udp"] == devices
+    engine.lampBytes[:] = (0, 0, 0, 255)
+    engine.chanRYGB = [False, False, False, True]
+    engine.sendUDP()
+    received = sorted([listener.recv(1500) for i in range(0, 2)], key = len)
+    engine.output.stop()
+    engine.closeUDP()
+    assert received[0] == b"1"
+    assert decodeFrame(received[1])[2] == [0, 0, 0, 255]
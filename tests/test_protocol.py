@@ -0,0 +1,191 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Проверка двоичного протокола кадров на эталонном приёмнике
+'''
+
+import time
+import socket
+
+import pytest
+
+from protocol import FrameEncoder, FrameReceiver, decodeFrame, timestampMs, RESYNC_TIME
+from output import UdpOutput, DeviceOutput, AsyncUdpOutput
+
+
+def frames(count, start = 0):
+    """ Кадры с номерами start, start + 1, ... (по кругу) и яркостью по номеру """
+    encoder = FrameEncoder(4)
+    encoder.seq = start
+    result = []
+    for i in range(0, count):
+        result.append(bytes(encoder.stamp(bytearray(encoder.encode([i & 0xFF, 0, 0, 255])))))
+    return result
+
+
+def test_encode_decode():
+    frame = frames(1, 7)[0]
+    seq, stamp, values = decodeFrame(frame)
+    assert seq == 7
+    assert values == [0, 0, 0, 255]
+    with pytest.raises(ValueError):
+        decodeFrame(frame[:-1])
+
+
+def test_out_of_order():
+    f = frames(5)
+    receiver = FrameReceiver()
+    now = timestampMs()
+    for i in [0, 2, 1, 3, 3, 4]:
+        receiver.process(f[i], now)
+    st = receiver.stats()
+    # Кадр 1 пришёл после 2 и отброшен, повтор 3 - тоже, пропуск 1 посчитан потерей
+    assert st["received"] == 4
+    assert st["stale"] == 2
+    assert st["lost"] == 1
+    assert receiver.lastSeq == 4
+
+
+def test_wraparound():
+    f = frames(6, 0xFFFD)
+    receiver = FrameReceiver()
+    now = timestampMs()
+    for frame in f:
+        assert receiver.process(frame, now)
+    assert receiver.lastSeq == 2
+    # Кадр до перехода через 0 устаревший
+    assert not receiver.process(f[1], now)
+    st = receiver.stats()
+    assert st["lost"] == 0
+    assert st["stale"] == 1
+
+
+def test_resync_after_pause():
+    f = frames(3)
+    receiver = FrameReceiver()
+    now = timestampMs()
+    receiver.process(f[2], now)
+    # Отправитель перезапущен: после паузы принимается кадр с любым номером
+    assert not receiver.process(f[0], now + 10)
+    assert receiver.process(f[0], now + RESYNC_TIME + 10)
+    assert receiver.stats()["lost"] == 0
+
+
+def test_legacy():
+    receiver = FrameReceiver()
+    assert receiver.process(b"1010")
+    assert receiver.values == [255, 0, 255, 0]
+    assert not receiver.process(b"10")
+    st = receiver.stats()
+    assert st["legacy"] == 1
+    assert st["invalid"] == 1
+    assert st["lost"] == 0
+
+
+def receive(sock, receiver, timeout = 0.5):
+    """ Приём всех кадров из сокета, пока они приходят """
+    sock.settimeout(timeout)
+    while True:
+        try:
+            data = sock.recv(1500)
+        except socket.timeout:
+            return
+        receiver.process(data)
+
+
+@pytest.fixture
+def listener():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    sock.bind(("127.0.0.1", 0))
+    yield sock
+    sock.close()
+
+
+def submitAll(dev, encoder, count):
+    """ Кадры с разной яркостью чаще, чем их отправляет устройство """
+    for i in range(0, count):
+        dev.submit(encoder.update([i & 0xFF, (i >> 8) & 0xFF, 0, 0]))
+        time.sleep(0.0005)
+
+
+def test_loopback_overwrites_are_not_lost(listener):
+    udp = UdpOutput(*listener.getsockname())
+    dev = DeviceOutput("udp0", "udp", udp.send, maxRate = 200)
+    encoder = FrameEncoder(4)
+    dev.stamp = encoder.stamp
+    dev.start()
+    submitAll(dev, encoder, 300)
+    dev.stop()
+    udp.close()
+
+    receiver = FrameReceiver()
+    receive(listener, receiver)
+    assert dev.overwrites > 0
+    assert receiver.stats()["received"] == dev.sent
+    assert receiver.stats()["lost"] == 0
+
+
+def test_loopback_queue_drops_are_not_lost(listener):
+    dev = AsyncUdpOutput("udp0", "udp", [listener.getsockname()], maxRate = 200, maxQueue = 2)
+    encoder = FrameEncoder(4)
+    dev.stamp = encoder.stamp
+    dev.start()
+    assert dev.ready.wait(1.0)
+    submitAll(dev, encoder, 300)
+    time.sleep(0.1)
+    dev.stop()
+
+    receiver = FrameReceiver()
+    receive(listener, receiver)
+    assert receiver.stats()["received"] == dev.frames
+    assert receiver.stats()["lost"] == 0
+
+
+def test_loopback_loss(listener):
+    udp = UdpOutput(*listener.getsockname())
+    state = {"frames": 0, "dropped": 0}
+
+    def lossySend(frame):
+        # Каждый пятый кадр теряется в сети уже после назначения номера
+        state["frames"] += 1
+        if state["frames"] % 5 == 0:
+            state["dropped"] += 1
+            return True
+        return udp.send(frame)
+
+    dev = DeviceOutput("udp0", "udp", lossySend)
+    encoder = FrameEncoder(4)
+    dev.stamp = encoder.stamp
+    dev.start()
+    submitAll(dev, encoder, 200)
+    dev.stop()
+    udp.close()
+
+    receiver = FrameReceiver()
+    receive(listener, receiver)
+    st = receiver.stats()
+    assert state["dropped"] > 0
+    # Последний потерянный кадр без следующего за ним не обнаружить
+    assert st["lost"] in (state["dropped"], state["dropped"] - 1)
+    assert st["received"] + state["dropped"] == dev.sent
+    assert st["maxLatency"] < 1000
+
+
+def test_rate_limited_sends_newest(listener):
+    dev = AsyncUdpOutput("udp0", "udp", [listener.getsockname()], maxRate = 20)
+    encoder = FrameEncoder(4)
+    dev.stamp = encoder.stamp
+    dev.start()
+    assert dev.ready.wait(1.0)
+    submitAll(dev, encoder, 200)
+    time.sleep(0.2)
+    dev.stop()
+
+    receiver = FrameReceiver()
+    receive(listener, receiver)
+    # После ожидания отправляется самый свежий кадр, а не кадры из очереди по порядку
+    assert dev.collapsed > 0
+    assert receiver.values == [199, 0, 0, 0]
+    assert dev.stats()["avgLatency"] < 0.03
@@ -0,0 +1,54 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Независимость режимов работы от частоты тактов
+'''
+
+import numpy as np
+import pytest
+
+from effects import EffectEngine
+from engine import ColormusicEngine
+from test_filereplay import writeWav
+
+
+def run(mode, rate, seconds, flash = 1000):
+    """ Вспышка на первом такте, затем тишина seconds секунд """
+    engine = EffectEngine(rate = rate)
+    spectrum = np.zeros(60)
+    spectrum[0:60] = flash
+    engine.process(mode, spectrum)
+    for i in range(0, int(round(seconds * rate))):
+        engine.process(mode, np.zeros(60))
+    return engine.leds.copy()
+
+
+@pytest.mark.parametrize("mode", (1, 2, 5))
+@pytest.mark.parametrize("seconds", (0.04, 0.1, 0.2))
+def test_effect_timing_independent_of_rate(mode, seconds):
+    expected = run(mode, 50, seconds)
+    assert run(mode, 100, seconds).tolist() == expected.tolist()
+    assert run(mode, 200, seconds).tolist() == expected.tolist()
+
+
+def test_level_mode_clears_every_tick():
+    engine = EffectEngine(rate = 200)
+    spectrum = np.full(60, 900)
+    engine.process(6, spectrum)
+    engine.process(6, np.full(60, 300))
+    # Красный от предыдущего такта не остаётся рядом с зелёным
+    assert engine.leds[:, 0].tolist() == [0] * 10
+    assert engine.leds[:, 1].tolist() == [100] * 10
+
+
+@pytest.mark.parametrize("fftsize, hop, expected", ((None, None, 50.0), (2048, 5, 44100 / 220)))
+def test_audio_ticks_use_spectrum_rate(tmp_path, fftsize, hop, expected):
+    path = tmp_path / "tone.wav"
+    writeWav(path, 0.2)
+    settings = {"udp": [], "hid": [], "mode": 1, "sensitivityRYG": [100, 100, 100]}
+    engine = ColormusicEngine(settings, rate = 200, tickMode = "audio")
+    engine.startCapture(filename = str(path), fftsize = fftsize, hop = hop)
+    engine.sound.stop()
+    assert engine.rate == pytest.approx(expected)
+    assert engine.beat.tempo.rate == pytest.approx(expected)
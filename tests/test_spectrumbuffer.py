@@ -0,0 +1,68 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Чтение спектров из кольцевого буфера (seqlock)
+'''
+
+import numpy as np
+import pytest
+
+from spectrumbuffer import SpectrumBuffer, SharedSpectrumBuffer
+
+
+def writeFrame(buffer, value):
+    """ Кадр, у которого все полосы и уровни равны value """
+    buffer.write(np.full(buffer.bins, value), value, value)
+
+
+class OvertakingSlots:
+    """ Слоты буфера, при первом чтении которых писатель успевает опубликовать ещё frames кадров """
+    def __init__(self, buffer, frames):
+        self.buffer = buffer
+        self.array = buffer.spectra
+        self.frames = frames
+
+    def __getitem__(self, index):
+        slot = self.array[index]
+        buffer = self.buffer
+        for i in range(0, self.frames):
+            seq = buffer.seq + 1
+            self.array[seq % buffer.slots] = seq
+            buffer.levels[seq % buffer.slots] = seq
+            buffer.seq = seq
+        self.frames = 0
+        return slot
+
+
+@pytest.mark.parametrize("shared", (False, True))
+def test_read_returns_stable_copy(shared):
+    buffer = SharedSpectrumBuffer(8, 4) if shared else SpectrumBuffer(8, 4)
+    writeFrame(buffer, 1)
+    spectrum, left, right = buffer.readLatest()
+    assert list(spectrum) == [1] * 8
+    assert (left, right) == (1, 1)
+    with pytest.raises(ValueError):
+        spectrum[0] = 5
+    # Писатель прошёл по всему кольцу, прочитанный кадр не изменился
+    for value in range(2, 10):
+        writeFrame(buffer, value)
+    assert list(spectrum) == [1] * 8
+    assert list(buffer.readLatest()[0]) == [9] * 8
+    assert buffer.stats()["dropped"] == 7
+    if shared:
+        del spectrum
+        buffer.close()
+
+
+@pytest.mark.parametrize("frames, retries", ((2, 0), (3, 1), (4, 1)))
+def test_read_retries_when_writer_overtakes(frames, retries):
+    buffer = SpectrumBuffer(8, 4)
+    writeFrame(buffer, 1)
+    buffer.spectra = OvertakingSlots(buffer, frames)
+    spectrum, left, right = buffer.readLatest()
+    # Кадр цельный: полосы, уровни и номер прочитанного кадра совпадают
+    assert list(spectrum) == [buffer.lastReadSeq] * 8
+    assert (left, right) == (buffer.lastReadSeq, buffer.lastReadSeq)
+    assert buffer.lastReadSeq == (1 if retries == 0 else 1 + frames)
+    assert buffer.stats()["retries"] == retries
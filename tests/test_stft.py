@@ -0,0 +1,57 @@
+'''
+* Author:       Gladyshev Dmitriy (2021)
+*
+* Design Name:  ColormusicCC
+* Description:  Блоки захвата и кольцо спектров при STFT
+'''
+
+import numpy as np
+import pytest
+
+from engine import ColormusicEngine
+from soundcapture import spectrumCallback, captureBlockSize, spectrumRate
+from spectrumbuffer import SpectrumBuffer
+from test_filereplay import writeWav
+
+
+@pytest.mark.parametrize("fftsize, hop", ((2048, 5), (2048, None), (1024, 2), (4096, 20)))
+def test_one_spectrum_per_block(fftsize, hop):
+    samplerate = 44100
+    blocksize = captureBlockSize(samplerate, 20, fftsize, hop)
+    buffer = SpectrumBuffer(60)
+    callback = spectrumCallback(buffer, samplerate, fftsize = fftsize, hop = hop)
+    block = np.zeros((blocksize, 2), dtype=np.float32)
+    for i in range(1, 21):
+        callback(block, blocksize, None, "")
+        assert buffer.written == i
+
+
+def test_block_spectrum_rate():
+    assert captureBlockSize(44100, 20) == 882
+    assert spectrumRate(44100, 20) == pytest.approx(50)
+    assert spectrumRate(44100, 20, 2048, 5) == pytest.approx(200.45, abs=0.01)
+
+
+def test_ring_holds_spectra_of_one_tick(tmp_path):
+    path = tmp_path / "tone.wav"
+    writeWav(path, 0.2)
+    settings = {"udp": [], "hid": [], "mode": 1, "sensitivityRYG": [100, 100, 100]}
+    engine = ColormusicEngine(settings, rate = 50)
+    engine.startCapture(filename = str(path), fftsize = 2048, hop = 2)
+    engine.sound.stop()
+    # 2 мс шаг - 10 спектров за такт 20 мс
+    assert engine.buffer.slots >= 13
+
+
+def test_stft_level_follows_block_duration():
+    samplerate = 44100
+    t = np.arange(8192) / samplerate
+    block = np.repeat(0.5 * np.sin(2 * np.pi * 440 * t)[:, None], 2, axis=1).astype(np.float32)
+    peaks = []
+    for duration in (10, 20):
+        buffer = SpectrumBuffer(60)
+        callback = spectrumCallback(buffer, samplerate, fftsize = 2048, hop = 5, block_duration = duration)
+        callback(block, len(block), None, "")
+        peaks.append(buffer.readLatest()[1])
+    # Пороги уровня настроены на блок block_duration: вдвое короче блок - вдвое ниже уровень
+    assert peaks[0] == pytest.approx(peaks[1] / 2, rel=0.01)